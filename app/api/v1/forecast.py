@@ -6,16 +6,21 @@ Handles XGBoost model training and price forecasting.
 
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
 from datetime import datetime, timedelta
+import asyncio
 import json
 import pickle
 import base64
 
-from app.core.database import get_db, ForecastModel, MarketData
+from app.core.bar_codec import BarArrays
+from app.core.database import get_db, ForecastModel, async_session_maker
 from app.services.data_service import get_data_service
+from app.services.history_store import history_store
+from app.services.bar_archive import bar_archive
+from app.services.derived_cache import derived_cache
 from app.core.redis_client import get_redis
 
 
@@ -70,12 +75,14 @@ async def get_forecast(
     technical indicators and historical patterns.
     """
     try:
-        # Check for cached forecast first
+        # Check for a cached forecast still valid for the current price and model
         cache_key = f"forecast:{symbol}:{horizon_days}"
-        cached_forecast = await redis_client.get_cached_response(cache_key)
+        cached_forecast = await derived_cache.get(cache_key)
         
         if cached_forecast:
-            return ForecastResponse(**json.loads(cached_forecast))
+            return ForecastResponse(**cached_forecast)
+        
+        versions = await derived_cache.versions([symbol, f"model:{symbol}"])
         
         # Get current market data
         market_data = await data_service.client.get_market_data(symbol)
@@ -191,12 +198,8 @@ async def get_forecast(
             timestamp=datetime.utcnow()
         )
         
-        # Cache the forecast
-        await redis_client.set_cached_response(
-            cache_key,
-            json.dumps(response.dict(), default=str),
-            ttl=3600  # 1 hour cache
-        )
+        # Cache the forecast until the price moves or the model is retrained
+        await derived_cache.set(cache_key, response.dict(), versions)
         
         return response
         
@@ -376,37 +379,35 @@ async def _prepare_forecast_features(symbol: str, data_service) -> Optional[List
     """Prepare features for forecasting model."""
     try:
         # Get historical bars
-        bars = await data_service.client.fetch_stooq_bars(symbol, interval=5)
+        bars = await data_service.client.get_bars(symbol, interval=5)
         
         if len(bars) < 20:  # Need minimum data
             return None
         
         # Calculate technical indicators
-        closes = [bar['close'] for bar in bars[-20:]]  # Last 20 periods
+        import numpy as np
+        recent = bars.tail(20)  # Last 20 periods
+        closes = recent.close
         
         # Simple moving averages
-        sma_5 = sum(closes[-5:]) / 5
-        sma_10 = sum(closes[-10:]) / 10
-        sma_20 = sum(closes) / 20
+        sma_5 = float(closes[-5:].mean())
+        sma_10 = float(closes[-10:].mean())
+        sma_20 = float(closes.mean())
         
         # Price ratios
-        current_price = closes[-1]
+        current_price = float(closes[-1])
         price_to_sma5 = current_price / sma_5 if sma_5 > 0 else 1
         price_to_sma10 = current_price / sma_10 if sma_10 > 0 else 1
         price_to_sma20 = current_price / sma_20 if sma_20 > 0 else 1
         
         # Volatility (simplified)
-        import numpy as np
-        returns = []
-        for i in range(1, len(closes)):
-            returns.append((closes[i] - closes[i-1]) / closes[i-1])
-        
-        volatility = np.std(returns) if returns else 0
+        returns = recent.returns()
+        volatility = float(np.std(returns)) if len(returns) else 0
         
         # Volume indicators (if available)
-        volumes = [bar.get('volume', 0) for bar in bars[-10:]]
-        avg_volume = sum(volumes) / len(volumes) if volumes else 0
-        current_volume = bars[-1].get('volume', 0)
+        volumes = recent.volume[-10:]
+        avg_volume = float(volumes.mean()) if len(volumes) else 0
+        current_volume = float(volumes[-1])
         volume_ratio = current_volume / avg_volume if avg_volume > 0 else 1
         
         # Return feature vector
@@ -456,16 +457,15 @@ async def _train_model_async(symbol: str, db: AsyncSession, redis_client):
             ttl=3600
         )
         
-        # Get historical market data from database
-        async with async_session_maker() as session:
-            result = await session.execute(
-                select(MarketData).where(MarketData.symbol == symbol)
-                .order_by(MarketData.timestamp.desc())
-                .limit(1000)  # Last 1000 data points
-            )
-            market_data = result.scalars().all()
+        # Get historical bars (last 1000, oldest first): memory-mapped archive
+        # first; if it is short, fill in from the database, keeping bars
+        # found in both only once
+        bars = await asyncio.to_thread(bar_archive.read_latest, symbol, 1000)
+        if len(bars) < 1000:
+            stored = await history_store.get_latest(symbol, 1000)
+            bars = BarArrays.merge([stored, bars]).tail(1000)
         
-        if len(market_data) < 50:
+        if len(bars) < 50:
             # Not enough data for training
             await redis_client.set_cached_response(
                 f"training:{symbol}",
@@ -482,16 +482,13 @@ async def _train_model_async(symbol: str, db: AsyncSession, redis_client):
         features = []
         targets = []
         
-        # Sort by timestamp
-        market_data.sort(key=lambda x: x.timestamp)
+        all_closes = bars.close.tolist()
+        all_volumes = bars.volume.tolist()
         
-        for i in range(10, len(market_data) - 1):  # Need lookback and forward data
+        for i in range(10, len(bars) - 1):  # Need lookback and forward data
             # Create features from last 10 periods
-            lookback_data = market_data[i-10:i]
-            
-            # Simple features: OHLC ratios, moving averages, etc.
-            closes = [d.close_price for d in lookback_data]
-            volumes = [d.volume for d in lookback_data]
+            closes = all_closes[i-10:i]
+            volumes = all_volumes[i-10:i]
             
             # Technical indicators
             sma_5 = sum(closes[-5:]) / 5
@@ -519,7 +516,7 @@ async def _train_model_async(symbol: str, db: AsyncSession, redis_client):
             ]
             
             # Target: next period's close price
-            target = market_data[i + 1].close_price
+            target = all_closes[i + 1]
             
             features.append(feature_vector)
             targets.append(target)
@@ -618,6 +615,9 @@ async def _train_model_async(symbol: str, db: AsyncSession, redis_client):
             ttl=3600
         )
         
+        # Forecasts from the previous model are now outdated
+        await derived_cache.invalidate([f"model:{symbol}"])
+        
         # Publish training completion event
         await redis_client.publish_event("model_training_completed", {
             "symbol": symbol,
@@ -9,11 +9,14 @@ from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
 from datetime import datetime
 import asyncio
+import numpy as np
 from loguru import logger
 
 from app.services.knapsack_optimizer import get_optimizer, OptimizationResult
 from app.services.data_service import get_data_service
 from app.core.redis_client import get_redis
+from app.core.bar_codec import BarArrays
+from app.services.derived_cache import derived_cache
 
 
 router = APIRouter()
@@ -170,28 +173,35 @@ async def optimize_simple_portfolio(
         if len(symbols) > 20:
             raise HTTPException(status_code=400, detail="Too many symbols (max 20)")
         
-        # Fetch market data for symbols
+        # Reuse a result until one of its symbols moves materially
+        cache_key = f"optimize_simple:{','.join(sorted(s.lower() for s in symbols))}:{risk_budget}"
+        cached = await derived_cache.get(cache_key)
+        if cached:
+            return cached
+        versions = await derived_cache.versions(symbols)
+        
+        # Fetch market data and bars for all symbols in batch
+        quotes, bars_by_symbol = await asyncio.gather(
+            data_service.client.get_market_data_many(symbols),
+            data_service.client.get_bars_many(symbols, interval=5)
+        )
+        
         asset_data = []
         for symbol in symbols:
             # Get recent market data
-            market_data = await data_service.client.get_market_data(symbol)
+            market_data = quotes.get(symbol)
             if not market_data:
                 logger.warning(f"No market data available for {symbol}")
                 continue
             
             # Get historical bars for returns calculation
-            bars = await data_service.client.fetch_stooq_bars(symbol, interval=5)
+            bars = bars_by_symbol.get(symbol, BarArrays.empty())
             if len(bars) < 10:
                 logger.warning(f"Insufficient historical data for {symbol}")
                 continue
             
             # Calculate simple returns from bars
-            returns = []
-            for i in range(1, len(bars)):
-                prev_close = bars[i-1]['close']
-                curr_close = bars[i]['close']
-                if prev_close > 0:
-                    returns.append((curr_close - prev_close) / prev_close)
+            returns = bars.returns()
             
             if len(returns) < 5:
                 continue
@@ -214,7 +224,7 @@ async def optimize_simple_portfolio(
             risk_budget=risk_budget
         )
         
-        return {
+        response = {
             "success": True,
             "selected_assets": result.selected_assets,
             "allocations": result.allocations,
@@ -224,6 +234,9 @@ async def optimize_simple_portfolio(
             "optimization_time_ms": result.optimization_time_ms,
             "data_points_used": len(asset_data)
         }
+        await derived_cache.set(cache_key, response, versions)
+        
+        return response
         
     except HTTPException:
         raise
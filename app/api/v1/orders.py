@@ -12,8 +12,9 @@ from typing import List, Optional
 from datetime import datetime
 import random
 import uuid
+from loguru import logger
 
-from app.core.database import get_db, Order, Position
+from app.core.database import get_db, Order, Position, async_session_maker
 from app.services.data_service import get_data_service
 from app.core.redis_client import get_redis
 
@@ -380,6 +381,7 @@ async def _process_order_fill(
         # Publish fill event to WebSocket
         fill_event = {
             "order_id": fill_result['order_id'],
+            "user_id": user_id,
             "symbol": symbol,
             "side": side,
             "quantity": quantity,
@@ -391,4 +393,4 @@ async def _process_order_fill(
         await redis_client.publish_fill(fill_event)
         
     except Exception as e:
-        print(f"Error processing order fill: {e}")  # Log error
+        logger.error(f"Error processing order fill: {e}")
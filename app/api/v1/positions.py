@@ -64,10 +64,15 @@ async def get_positions(
         total_market_value = 0.0
         total_unrealized_pnl = 0.0
         
+        # Fetch current market data for all positions in one batch
+        quotes = await data_service.client.get_market_data_many(
+            [position.symbol for position in positions]
+        )
+        
         # Enrich positions with current market data
         for position in positions:
             # Get current market price
-            market_data = await data_service.client.get_market_data(position.symbol)
+            market_data = quotes.get(position.symbol)
             current_price = market_data.get('last_price') if market_data else None
             
             # Calculate market value and P&L
@@ -12,11 +12,15 @@ from typing import List, Dict, Optional
 from datetime import datetime, timedelta
 import numpy as np
 import asyncio
+import hashlib
+import json
 import uuid
 
 from app.core.database import get_db, Position, MarketData, RiskMetrics
 from app.services.data_service import get_data_service
 from app.core.redis_client import get_redis
+from app.core.bar_codec import BarArrays
+from app.services.derived_cache import derived_cache
 
 
 router = APIRouter()
@@ -100,15 +104,22 @@ async def get_risk_snapshot(
         portfolio_value = 0.0
         position_data = []
         
+        # Batch quote and bar lookups for all positions
+        symbols = [position.symbol for position in positions]
+        quotes, bars_by_symbol = await asyncio.gather(
+            data_service.client.get_market_data_many(symbols),
+            data_service.client.get_bars_many(symbols, interval=5)
+        )
+        
         for position in positions:
-            market_data = await data_service.client.get_market_data(position.symbol)
+            market_data = quotes.get(position.symbol)
             current_price = market_data.get('last_price', position.avg_price) if market_data else position.avg_price
             
             market_value = position.quantity * current_price
             portfolio_value += market_value
             
             # Get historical data for risk calculations
-            bars = await data_service.client.fetch_stooq_bars(position.symbol, interval=5)
+            bars = bars_by_symbol.get(position.symbol, BarArrays.empty())
             returns = _calculate_returns_from_bars(bars)
             
             position_data.append({
@@ -174,6 +185,25 @@ async def run_stress_test(
         if not positions:
             raise HTTPException(status_code=400, detail="No positions to stress test")
         
+        # Same scenarios on unchanged positions and prices: reuse the results
+        cache_key = _stress_cache_key(user_id, request.scenarios, positions)
+        cached_results = await derived_cache.get(cache_key)
+        if cached_results is not None:
+            response = StressTestResponse(
+                job_id=job_id,
+                status="completed",
+                results=cached_results,
+                timestamp=datetime.utcnow()
+            )
+            await redis_client.set_cached_response(
+                f"stress_test:{job_id}",
+                response.json(),
+                ttl=3600
+            )
+            return response
+        
+        versions = await derived_cache.versions(pos.symbol for pos in positions)
+        
         # Start stress test in background
         background_tasks.add_task(
             _run_stress_test_async,
@@ -181,7 +211,9 @@ async def run_stress_test(
             request.scenarios,
             positions,
             user_id,
-            redis_client
+            redis_client,
+            cache_key,
+            versions
         )
         
         return StressTestResponse(
@@ -208,7 +240,6 @@ async def get_stress_test_results(
         results = await redis_client.get_cached_response(f"stress_test:{job_id}")
         
         if results:
-            import json
             return json.loads(results)
         else:
             return {
@@ -264,19 +295,9 @@ async def get_risk_alerts(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def _calculate_returns_from_bars(bars: List[Dict]) -> List[float]:
+def _calculate_returns_from_bars(bars: BarArrays) -> np.ndarray:
     """Calculate returns from price bars."""
-    if len(bars) < 2:
-        return []
-    
-    returns = []
-    for i in range(1, len(bars)):
-        prev_close = bars[i-1]['close']
-        curr_close = bars[i]['close']
-        if prev_close > 0:
-            returns.append((curr_close - prev_close) / prev_close)
-    
-    return returns
+    return bars.returns()
 
 
 async def _calculate_portfolio_risk_metrics(position_data: List[Dict], portfolio_value: float) -> Dict:
@@ -291,8 +312,8 @@ async def _calculate_portfolio_risk_metrics(position_data: List[Dict], portfolio
         symbols = []
         
         for pos in position_data:
-            if pos['returns']:
-                all_returns.append(np.array(pos['returns']))
+            if len(pos['returns']):
+                all_returns.append(np.asarray(pos['returns']))
                 weights.append(pos['weight'])
                 symbols.append(pos['symbol'])
         
@@ -396,7 +417,9 @@ async def _run_stress_test_async(
     scenarios: List[StressTestScenario],
     positions: List[Position],
     user_id: int,
-    redis_client
+    redis_client,
+    cache_key: Optional[str] = None,
+    versions: Optional[Dict[str, int]] = None
 ):
     """Run stress test scenarios asynchronously."""
     try:
@@ -440,13 +463,15 @@ async def _run_stress_test_async(
             timestamp=datetime.utcnow()
         )
         
-        import json
         await redis_client.set_cached_response(
             f"stress_test:{job_id}",
-            json.dumps(response.dict()),
+            json.dumps(response.dict(), default=str),
             ttl=3600  # 1 hour
         )
         
+        if cache_key and versions is not None:
+            await derived_cache.set(cache_key, [result.dict() for result in results], versions)
+        
         # Publish completion event
         await redis_client.publish_event("stress_test_completed", {
             "job_id": job_id,
@@ -464,14 +489,25 @@ async def _run_stress_test_async(
             timestamp=datetime.utcnow()
         )
         
-        import json
         await redis_client.set_cached_response(
             f"stress_test:{job_id}",
-            json.dumps(error_response.dict()),
+            json.dumps(error_response.dict(), default=str),
             ttl=3600
         )
 
 
+def _stress_cache_key(user_id: int, scenarios: List[StressTestScenario], positions: List[Position]) -> str:
+    """Cache key covering the scenarios and the exact positions they were applied to."""
+    fingerprint = json.dumps({
+        "scenarios": [scenario.dict() for scenario in scenarios],
+        "positions": sorted(
+            (pos.symbol.lower(), float(pos.quantity), float(pos.avg_price)) for pos in positions
+        )
+    }, sort_keys=True)
+    digest = hashlib.sha1(fingerprint.encode()).hexdigest()[:16]
+    return f"stress:{user_id}:{digest}"
+
+
 def _apply_stress_scenario(positions: List[Position], scenario: StressTestScenario, current_value: float) -> float:
     """Apply stress scenario to portfolio positions."""
     # Simplified stress scenario application
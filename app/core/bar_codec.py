@@ -0,0 +1,178 @@
+"""
+Bar Codec - Compact columnar encoding for OHLCV bars
+
+Bars are stored as parallel arrays (int64 epoch seconds for time, float64 for
+open/high/low/close/volume) behind a 16-byte header, instead of JSON lists of
+dicts. Uncompressed payloads decode to zero-copy NumPy views over the buffer.
+
+Layout (little-endian):
+    magic   4s   b"MKB1"
+    version u8
+    flags   u8   bit 0 = zlib-compressed body
+    reserved u16
+    count   u64  number of bars
+    body         time[count] open[count] high[count] low[count] close[count] volume[count]
+"""
+
+import calendar
+import struct
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+
+MAGIC = b"MKB1"
+VERSION = 1
+FLAG_COMPRESSED = 0x01
+
+HEADER = struct.Struct("<4sBBHQ")
+PRICE_COLUMNS = ("open", "high", "low", "close", "volume")
+
+
+class BarCodecError(ValueError):
+    """Raised when a payload is not a valid encoded bar block."""
+
+
+@dataclass
+class BarArrays:
+    """Columnar OHLCV bars; every field is a 1-D array of equal length."""
+    time: np.ndarray    # int64 epoch seconds (UTC)
+    open: np.ndarray    # float64
+    high: np.ndarray    # float64
+    low: np.ndarray     # float64
+    close: np.ndarray   # float64
+    volume: np.ndarray  # float64
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    @classmethod
+    def empty(cls) -> "BarArrays":
+        """Zero-length bars."""
+        return cls(
+            np.empty(0, dtype=np.int64),
+            *(np.empty(0, dtype=np.float64) for _ in PRICE_COLUMNS)
+        )
+
+    @classmethod
+    def from_dicts(cls, bars: List[Dict]) -> "BarArrays":
+        """Build from the legacy list-of-dicts format."""
+        if not bars:
+            return cls.empty()
+        return cls(
+            np.array([_to_epoch(bar.get("time", bar.get("datetime"))) for bar in bars], dtype=np.int64),
+            *(np.array([bar.get(col) or 0.0 for bar in bars], dtype=np.float64) for col in PRICE_COLUMNS)
+        )
+
+    @classmethod
+    def concat(cls, parts: Sequence["BarArrays"]) -> "BarArrays":
+        """Concatenate several bar blocks (copies)."""
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls.empty()
+        if len(parts) == 1:
+            return parts[0]
+        return cls(
+            np.concatenate([part.time for part in parts]),
+            *(np.concatenate([getattr(part, col) for part in parts]) for col in PRICE_COLUMNS)
+        )
+
+    @classmethod
+    def merge(cls, parts: Sequence["BarArrays"]) -> "BarArrays":
+        """Concatenate, sort by time and drop duplicate timestamps (later parts win)."""
+        bars = cls.concat(parts)
+        if not len(bars):
+            return bars
+        order = np.argsort(bars.time, kind="stable")
+        times = bars.time[order]
+        keep = order[np.append(times[1:] != times[:-1], True)]
+        return cls(bars.time[keep], *(getattr(bars, col)[keep] for col in PRICE_COLUMNS))
+
+    def slice(self, start: Optional[int] = None, stop: Optional[int] = None) -> "BarArrays":
+        """Return a view of bars[start:stop]."""
+        return BarArrays(
+            self.time[start:stop],
+            *(getattr(self, col)[start:stop] for col in PRICE_COLUMNS)
+        )
+
+    def tail(self, n: int) -> "BarArrays":
+        """Return a view of the last `n` bars."""
+        return self.slice(-n) if n < len(self) else self
+
+    def returns(self) -> np.ndarray:
+        """Simple close-to-close returns, skipping non-positive prior closes."""
+        if len(self) < 2:
+            return np.empty(0, dtype=np.float64)
+        prev = self.close[:-1]
+        curr = self.close[1:]
+        mask = prev > 0
+        return (curr[mask] - prev[mask]) / prev[mask]
+
+    def to_dicts(self, symbol: Optional[str] = None) -> List[Dict]:
+        """Convert to the list-of-dicts format (for JSON responses only)."""
+        columns = [getattr(self, col).tolist() for col in PRICE_COLUMNS]
+        bars = []
+        for i, ts in enumerate(self.time.tolist()):
+            bar = {"datetime": datetime.utcfromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")}
+            if symbol:
+                bar["symbol"] = symbol
+            for col, values in zip(PRICE_COLUMNS, columns):
+                bar[col] = values[i]
+            bars.append(bar)
+        return bars
+
+
+def encode_bars(bars: BarArrays, compress: bool = False) -> bytes:
+    """Encode bars to the compact binary format."""
+    count = len(bars)
+    body = b"".join(
+        [np.ascontiguousarray(bars.time, dtype="<i8").tobytes()]
+        + [np.ascontiguousarray(getattr(bars, col), dtype="<f8").tobytes() for col in PRICE_COLUMNS]
+    )
+    flags = 0
+    if compress:
+        body = zlib.compress(body, 1)
+        flags |= FLAG_COMPRESSED
+    return HEADER.pack(MAGIC, VERSION, flags, 0, count) + body
+
+
+def decode_bars(payload: Union[bytes, bytearray, memoryview]) -> BarArrays:
+    """
+    Decode bars from the compact binary format.
+
+    Uncompressed payloads are not copied: the returned arrays are read-only
+    views into `payload`, which must stay alive as long as they are used.
+    """
+    if len(payload) < HEADER.size:
+        raise BarCodecError("Payload shorter than header")
+
+    magic, version, flags, _, count = HEADER.unpack_from(payload, 0)
+    if magic != MAGIC or version != VERSION:
+        raise BarCodecError("Not an encoded bar block")
+
+    body: Union[bytes, memoryview] = memoryview(payload)[HEADER.size:]
+    if flags & FLAG_COMPRESSED:
+        body = zlib.decompress(body)
+
+    if len(body) != count * 8 * (1 + len(PRICE_COLUMNS)):
+        raise BarCodecError("Payload length does not match bar count")
+
+    column_bytes = count * 8
+    time = np.frombuffer(body, dtype="<i8", count=count, offset=0)
+    prices = [
+        np.frombuffer(body, dtype="<f8", count=count, offset=column_bytes * (i + 1))
+        for i in range(len(PRICE_COLUMNS))
+    ]
+    return BarArrays(time, *prices)
+
+
+def _to_epoch(value) -> int:
+    """Convert an epoch number or 'YYYY-MM-DD HH:MM:SS' string (UTC) to epoch seconds."""
+    if isinstance(value, int | float):
+        return int(value)
+    if isinstance(value, datetime):
+        return calendar.timegm(value.utctimetuple())
+    return calendar.timegm(datetime.fromisoformat(str(value)).utctimetuple())
@@ -37,14 +37,118 @@ class Settings(BaseSettings):
     # Rate limits
     STOOQ_MAX_REQUESTS_PER_HOUR: int = 120
     YAHOO_MAX_REQUESTS_PER_DAY: int = 200
-    DATA_POLL_INTERVAL_SECONDS: int = 30
+    DATA_POLL_INTERVAL_SECONDS: int = 30  # Base interval before demand/volatility scaling
+    
+    # Upstream HTTP connection pool
+    HTTP_POOL_LIMIT: int = 100
+    HTTP_POOL_LIMIT_PER_HOST: int = 20
+    HTTP_DNS_CACHE_TTL_SECONDS: int = 300
+    HTTP_KEEPALIVE_SECONDS: float = 60
+    HTTP_CONNECT_TIMEOUT_SECONDS: float = 3.0
+    HTTP_READ_TIMEOUT_SECONDS: float = 5.0
+    HTTP_COMPRESSION: bool = True
+    
+    # Upstream source health (circuit breakers and hedged requests)
+    SOURCE_TIMEOUT_SECONDS: float = 5.0  # Per request
+    SOURCE_REQUEST_DEADLINE_SECONDS: float = 6.0  # Across all hedged sources
+    SOURCE_HEALTH_WINDOW: int = 50
+    SOURCE_HEALTH_MIN_REQUESTS: int = 5
+    SOURCE_FAILURE_THRESHOLD: float = 0.5  # Error rate that opens the circuit
+    SOURCE_CIRCUIT_OPEN_SECONDS: float = 30
+    SOURCE_CIRCUIT_MAX_OPEN_SECONDS: float = 600
+    SOURCE_HEDGE_PERCENTILE: float = 95
+    SOURCE_HEDGE_MIN_SECONDS: float = 0.2
+    SOURCE_HEDGE_MAX_SECONDS: float = 2.0
+    
+    # Adaptive poll scheduling
+    POLL_MIN_INTERVAL_SECONDS: int = 10
+    POLL_MAX_INTERVAL_SECONDS: int = 300
+    POLL_CLOSED_INTERVAL_SECONDS: int = 1800  # Outside the exchange session
+    POLL_QUOTA_SHARE: float = 0.8  # Share of the Stooq hourly quota the poller may use
+    POLL_LOOKUP_TTL_SECONDS: int = 900  # How long an API lookup counts as demand
+    POLL_VOLATILITY_REFERENCE: float = 0.001  # Per-poll move that keeps the base interval
+    POLL_POSITIONS_REFRESH_SECONDS: int = 60
+    POLLER_LEASE_SECONDS: float = 15.0  # One node polls; a poller that stops renewing is replaced after this
+    POLL_DEMAND_SYNC_SECONDS: float = 5.0  # How often nodes report subscriptions/lookups to the poller
+    MARKET_TIMEZONE: str = "America/New_York"
+    MARKET_OPEN_TIME: str = "09:30"
+    MARKET_CLOSE_TIME: str = "16:00"
     
     # Cache settings
     REDIS_CACHE_TTL_SECONDS: int = 60
     REDIS_BARS_RETENTION_DAYS: int = 5
+    BAR_CODEC_COMPRESS: bool = False  # zlib trades zero-copy reads for bandwidth
+    TICK_STREAM_MAXLEN: int = 5000  # Per-symbol ticks:{symbol} stream
+    TICK_FANIN_STREAM_MAXLEN: int = 50000  # Global ticks stream
+    TICK_SNAPSHOT_INTERVAL_SECONDS: int = 60  # Full tick between deltas, for late joiners
+    TICK_STREAM_BATCH_SIZE: int = 500  # Entries per XREAD for websocket fan-out
+    TICK_STREAM_BLOCK_MS: int = 1000
+    TICK_STREAM_REPLAY_LIMIT: int = 1000  # Max entries replayed to a resuming client
+    TICK_STREAM_PER_SYMBOL: bool = True  # Read only the ticks:{symbol} streams local clients need
+    FILL_HISTORY_MAXLEN: int = 10000  # Per-user fills:{user_id} stream
+    EVENT_HISTORY_MAXLEN: int = 1000  # Per-type events:{type} stream
+    HISTORY_QUERY_LIMIT: int = 500  # Max fills/events returned by one history query
+    STOOQ_QUOTE_TTL_SECONDS: int = 60
+    YAHOO_QUOTE_TTL_SECONDS: int = 180
+    FMP_PROFILE_TTL_SECONDS: int = 86400
+    STOOQ_BARS_TTL_SECONDS: int = 300
+    STOOQ_CSV_CHUNK_BYTES: int = 65536
+    
+    # In-process quote cache (L1 in front of Redis)
+    QUOTE_CACHE_MAX_ENTRIES: int = 2048
+    QUOTE_CACHE_STALE_SECONDS: int = 60
+    
+    # Derived results (forecasts, stress tests, optimizations)
+    DERIVED_CACHE_TTL_SECONDS: int = 21600  # Safe to keep long: evicted on material moves
+    DERIVED_INVALIDATION_MOVE: float = 0.005  # Relative price move that evicts dependents
+    
+    # WebSocket fan-out
+    WS_SEND_QUEUE_SIZE: int = 1000  # Pending messages per connection
+    WS_SLOW_CONSUMER_POLICY: str = "drop_oldest"  # drop_oldest, coalesce or disconnect
+    WS_SEND_TIMEOUT_SECONDS: float = 10.0  # A send stalled this long evicts the client
+    WS_MAX_CONFLATION_RATE: float = 20.0  # Highest ?max_rate= (Hz) a client may request
+    WS_HEARTBEAT_INTERVAL_SECONDS: float = 30.0
+    WS_HEARTBEAT_TIMEOUT_SECONDS: float = 90.0  # Only for clients that answer heartbeats
+    WS_STATS_TOP_N: int = 10  # Deepest send queues listed in /stats
+    
+    # Websocket cluster (one node per uvicorn worker / Fly machine)
+    NODE_ID: str = ""  # Defaults to FLY_MACHINE_ID, else hostname-pid
+    CLUSTER_HEARTBEAT_SECONDS: float = 10.0  # A node missing 3 heartbeats drops out of the counts
+    
+    # Write-behind market_data ingestion
+    INGEST_BATCH_SIZE: int = 500
+    INGEST_FLUSH_INTERVAL_SECONDS: float = 5.0
+    INGEST_MAX_QUEUE_SIZE: int = 10000
+    
+    # market_data history store
+    HISTORY_PARTITION_MONTHS_AHEAD: int = 2
+    HISTORY_ROLLUP_AFTER_DAYS: int = 7  # Older base bars are downsampled
+    HISTORY_ROLLUP_INTERVAL_SECONDS: int = 3600
+    HISTORY_RETENTION_DAYS: int = 365
+    HISTORY_MAINTENANCE_INTERVAL_SECONDS: int = 3600
+    HISTORY_LOOKBACK_DAYS: int = 30  # Window for bar fallback reads
+    
+    # On-disk bar archive (memory-mapped, for offline analytics)
+    BAR_ARCHIVE_DIR: str = "./data/bars"
+    BAR_ARCHIVE_FLUSH_SECONDS: int = 300
+    BAR_ARCHIVE_COMPACT_INTERVAL_SECONDS: int = 3600
+    
+    # Intraday bar aggregation
+    BAR_INTERVALS_SECONDS: tuple[int, ...] = (60, 300, 900, 3600)
+    BAR_HISTORY_LENGTH: int = 500  # Completed bars kept per symbol/interval
+    
+    # Market simulator (app.simulator_main)
+    SIM_MODE: str = "gbm"  # "gbm" or "replay"
+    SIM_SYMBOL_COUNT: int = 1000
+    SIM_TICK_SECONDS: float = 1.0
+    SIM_SEED: int = 42
+    SIM_BAR_HISTORY: int = 500
+    SIM_REPLAY_DIR: str = ""  # Defaults to BAR_ARCHIVE_DIR
+    SIM_LATENCY_MS: float = 0  # Mean injected latency
+    SIM_ERROR_RATE: float = 0.0  # Share of requests answered with 503
     
     # Trading
-    DEFAULT_TICKERS: list[str] = ["aapl.us", "msft.us", "goog.us", "tsla.us"]
+    DEFAULT_TICKERS: tuple[str, ...] = ("aapl.us", "msft.us", "goog.us", "tsla.us")
     MAX_TICKERS: int = 30
     
     # Security
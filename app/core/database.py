@@ -1,6 +1,6 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime, Boolean, Text, Index
 from datetime import datetime
 from loguru import logger
 
@@ -87,16 +87,26 @@ class Order(Base):
 
 class MarketData(Base):
     __tablename__ = "market_data"
+    __table_args__ = (
+        # Range queries are always "one symbol, time window"
+        Index("ix_market_data_symbol_timestamp", "symbol", "timestamp"),
+        # Append-only, time-correlated rows: a tiny BRIN covers time-only scans
+        Index("ix_market_data_timestamp_brin", "timestamp", postgresql_using="brin"),
+        # Monthly partitions are managed by app.services.history_store
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
-    symbol = Column(String, nullable=False, index=True)
-    timestamp = Column(DateTime, nullable=False, index=True)
+    # The partition key must be part of the primary key
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    timestamp = Column(DateTime, primary_key=True)
+    symbol = Column(String, nullable=False)
     open_price = Column(Float, nullable=False)
     high_price = Column(Float, nullable=False)
     low_price = Column(Float, nullable=False)
     close_price = Column(Float, nullable=False)
     volume = Column(Float, nullable=False)
     source = Column(String, nullable=False)  # "stooq", "yahoo", "fmp"
+    interval_seconds = Column(Integer, nullable=False, default=60, server_default="60")  # Bar width; grows after rollup
 
 
 class RiskMetrics(Base):
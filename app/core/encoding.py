@@ -0,0 +1,146 @@
+"""
+Encoding - JSON/MessagePack serialization and pre-serialized websocket frames
+
+orjson and msgpack are optional: without orjson the standard json module is
+used, and without msgpack the "msgpack" websocket encoding falls back to JSON.
+
+Websocket clients choose an encoding at connect time:
+
+- json:    text frames (default);
+- msgpack: binary MessagePack frames;
+- struct:  quotes as fixed 72-byte binary frames (QUOTE_FRAME), every other
+           message as JSON text.
+
+Text frames are always JSON, so a client can tell control messages and
+fallbacks from binary data by the frame type.
+
+A Frame wraps one outbound message and encodes it at most once per encoding,
+however many connections it is sent to.
+"""
+
+import json
+import math
+import struct
+from datetime import UTC, datetime
+from typing import Any, Dict, Optional, Union
+
+from loguru import logger
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+
+JSON = "json"
+MSGPACK = "msgpack"
+STRUCT = "struct"
+ENCODINGS = (JSON, MSGPACK, STRUCT)
+
+# symbol (UTF-8, NUL-padded), last, bid, ask, high, low, volume, timestamp (epoch s);
+# missing numbers are NaN
+QUOTE_FRAME = struct.Struct("<16s7d")
+
+Payload = Union[str, bytes]
+
+
+def dumps(obj: Any) -> str:
+    """Serialize to a JSON string."""
+    if orjson is not None:
+        return orjson.dumps(
+            obj, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        ).decode()
+    return json.dumps(obj, default=str)
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Parse a JSON string or bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def negotiate(requested: Optional[str]) -> str:
+    """
+    The encoding to use for a client's request.
+
+    Unknown encodings raise ValueError; msgpack without the library
+    degrades to JSON.
+    """
+    encoding = (requested or JSON).lower()
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown encoding {requested!r}; expected one of {ENCODINGS}")
+    if encoding == MSGPACK and msgpack is None:
+        logger.warning("msgpack is not installed, falling back to JSON")
+        return JSON
+    return encoding
+
+
+def pack_quote(message: Dict[str, Any]) -> bytes:
+    """Pack a quote message into a QUOTE_FRAME."""
+    return QUOTE_FRAME.pack(
+        message.get("symbol", "").encode()[:16],
+        *(_number(message.get(field)) for field in ("last", "bid", "ask", "high", "low", "volume")),
+        _epoch(message.get("timestamp"))
+    )
+
+
+def unpack_quote(frame: bytes) -> Dict[str, Any]:
+    """Inverse of pack_quote (NaN fields come back as None)."""
+    symbol, *numbers = QUOTE_FRAME.unpack(frame)
+    fields = ("last", "bid", "ask", "high", "low", "volume", "timestamp")
+    return {
+        "type": "quote",
+        "symbol": symbol.rstrip(b"\0").decode(),
+        **{field: None if math.isnan(value) else value for field, value in zip(fields, numbers)}
+    }
+
+
+class Frame:
+    """One outbound message, encoded lazily and at most once per encoding."""
+
+    __slots__ = ("message", "_encoded")
+
+    def __init__(self, message: Dict[str, Any]):
+        self.message = message
+        self._encoded: Dict[str, Payload] = {}
+
+    def encode(self, encoding: str = JSON) -> Payload:
+        payload = self._encoded.get(encoding)
+        if payload is None:
+            if encoding == MSGPACK:
+                payload = msgpack.packb(self.message, default=str, use_bin_type=True)
+            elif encoding == STRUCT and self.message.get("type") == "quote":
+                payload = pack_quote(self.message)
+            elif encoding != JSON:
+                # Non-quote messages of struct clients are JSON text
+                payload = self.encode(JSON)
+            else:
+                payload = dumps(self.message)
+            self._encoded[encoding] = payload
+        return payload
+
+
+def _number(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _epoch(timestamp: Any) -> float:
+    if isinstance(timestamp, int | float):
+        return float(timestamp)
+    try:
+        parsed = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return math.nan
+    if parsed.tzinfo is None:
+        # Tick timestamps are naive UTC
+        parsed = parsed.replace(tzinfo=UTC)
+    return parsed.timestamp()
@@ -1,9 +1,10 @@
 import redis.asyncio as aioredis
 from loguru import logger
-from typing import Optional
-import json
+from typing import Iterable, Optional, Dict, List, Set, Tuple
 
+from app.core import encoding
 from app.core.config import settings
+from app.core.bar_codec import BarArrays, BarCodecError, encode_bars, decode_bars
 
 
 class RedisClient:
@@ -11,6 +12,10 @@ class RedisClient:
     
     def __init__(self):
         self.redis: Optional[aioredis.Redis] = None
+        # Binary-safe connection for encoded bar blocks
+        self.raw_redis: Optional[aioredis.Redis] = None
+        # Event types seen so far, so event history reads need no lookup first
+        self._event_types: Set[str] = set()
     
     async def connect(self):
         """Connect to Redis."""
@@ -20,6 +25,10 @@ class RedisClient:
                 encoding="utf-8",
                 decode_responses=True
             )
+            self.raw_redis = aioredis.from_url(
+                settings.REDIS_URL,
+                decode_responses=False
+            )
             await self.redis.ping()
             logger.info("Connected to Redis successfully")
         except Exception as e:
@@ -30,8 +39,10 @@ class RedisClient:
         """Disconnect from Redis."""
         if self.redis:
             await self.redis.close()
+        if self.raw_redis:
+            await self.raw_redis.close()
     
-    async def set_cached_response(self, key: str, value: str, ttl: int = None):
+    async def set_cached_response(self, key: str, value: str, ttl: Optional[int] = None):
         """Cache a response with TTL."""
         ttl = ttl or settings.REDIS_CACHE_TTL_SECONDS
         await self.redis.setex(key, ttl, value)
@@ -40,55 +51,449 @@ class RedisClient:
         """Get cached response."""
         return await self.redis.get(key)
     
+    async def mget_cached(self, keys: List[str]) -> List[Optional[str]]:
+        """Get several cached responses in one round trip (MGET)."""
+        if not keys:
+            return []
+        return await self.redis.mget(keys)
+    
+    async def mset_cached_with_ttl(self, entries: Dict[str, Tuple[str, int]]):
+        """
+        Cache several responses in one round trip.
+        
+        Args:
+            entries: Mapping of key -> (value, ttl_seconds)
+        """
+        if not entries:
+            return
+        
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, (value, ttl) in entries.items():
+                pipe.setex(key, ttl or settings.REDIS_CACHE_TTL_SECONDS, value)
+            await pipe.execute()
+    
     async def publish_tick(self, symbol: str, tick_data: dict):
         """Publish tick data to Redis streams."""
-        await self.redis.xadd("ticks", {
+        await self.publish_ticks({symbol: tick_data})
+    
+    async def publish_ticks(self, ticks: Dict[str, dict], kinds: Optional[Dict[str, str]] = None):
+        """
+        Publish ticks for several symbols in one pipelined round trip.
+        
+        Each tick is appended to its per-symbol stream (`ticks:{symbol}`) and
+        to the global `ticks` fan-in stream. Both are trimmed with approximate
+        MAXLEN so memory stays bounded by retention.
+        
+        Args:
+            kinds: Optional symbol -> "snapshot" | "delta"; a delta carries only
+                the fields that changed since the previous entry. Defaults
+                to "snapshot".
+        """
+        if not ticks:
+            return
+        kinds = kinds or {}
+        
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for symbol, tick_data in ticks.items():
+                fields = self._tick_fields(symbol, tick_data, kinds.get(symbol, "snapshot"))
+                pipe.xadd(
+                    self.tick_stream_key(symbol),
+                    fields,
+                    maxlen=settings.TICK_STREAM_MAXLEN,
+                    approximate=True
+                )
+                pipe.xadd(
+                    "ticks",
+                    fields,
+                    maxlen=settings.TICK_FANIN_STREAM_MAXLEN,
+                    approximate=True
+                )
+            await pipe.execute()
+    
+    @staticmethod
+    def tick_stream_key(symbol: str) -> str:
+        """Per-symbol tick stream key."""
+        return f"ticks:{symbol.lower()}"
+    
+    @staticmethod
+    def _tick_fields(symbol: str, tick_data: dict, kind: str = "snapshot") -> dict:
+        """Stream entry fields for a tick."""
+        return {
             "symbol": symbol,
-            "data": json.dumps(tick_data),
+            "kind": kind,
+            "data": encoding.dumps(tick_data),
             "timestamp": tick_data.get("timestamp", "")
-        })
+        }
     
     async def get_recent_ticks(self, symbol: str, count: int = 100) -> list:
-        """Get recent ticks for a symbol."""
+        """
+        Get the most recent `count` ticks for a symbol, newest first.
+        
+        Deltas are folded onto the preceding snapshot so every returned tick
+        is a full quote. The stream is read back in pages until the snapshot
+        the oldest returned tick builds on, so fewer than `count` ticks come
+        back only when the stream holds fewer (or none with a snapshot base).
+        """
         try:
-            # Get from Redis stream
-            stream_data = await self.redis.xrevrange("ticks", count=count)
+            key = self.tick_stream_key(symbol)
+            page_size = max(count, 100)
+            entries = []  # Newest first
+            end = "+"
+            while True:
+                page = await self.redis.xrevrange(key, max=end, count=page_size)
+                entries.extend(page)
+                if len(page) < page_size or any(
+                    fields.get("kind", "snapshot") != "delta" for _, fields in entries[count - 1:]
+                ):
+                    break
+                end = f"({page[-1][0]}"  # Exclusive: continue before the oldest read
+            
             ticks = []
-            for entry_id, fields in stream_data:
-                if fields.get("symbol") == symbol:
-                    tick_data = json.loads(fields.get("data", "{}"))
-                    ticks.append(tick_data)
-            return ticks
+            state = None
+            for entry_id, fields in reversed(entries):
+                data = encoding.loads(fields.get("data", "{}"))
+                if fields.get("kind", "snapshot") == "delta":
+                    if state is None:
+                        continue
+                    state = {**state, **data}
+                else:
+                    state = data
+                ticks.append(state)
+            return ticks[::-1][:count]
         except Exception as e:
             logger.error(f"Error getting recent ticks: {e}")
             return []
     
-    async def store_market_bars(self, symbol: str, bars: list):
-        """Store market bars in Redis with expiration."""
-        key = f"bars:{symbol}"
-        await self.redis.setex(
-            key,
-            settings.REDIS_BARS_RETENTION_DAYS * 24 * 3600,
-            json.dumps(bars)
+    @staticmethod
+    def market_bars_key(symbol: str, interval_seconds: int) -> str:
+        """Sorted set of aggregated bars of one symbol and interval, scored by bar start."""
+        return f"bar_series:{symbol.lower()}:{interval_seconds}"
+    
+    async def store_market_bars(self, symbol: str, bars: BarArrays, interval_seconds: int = 60):
+        """Append bars to a symbol's series in Redis."""
+        await self.append_market_bars({(symbol, interval_seconds): bars})
+    
+    async def append_market_bars(self, series: Dict[Tuple[str, int], BarArrays]):
+        """
+        Append closed bars to several (symbol, interval) series in one pipeline.
+        
+        Each bar is a sorted set member scored by its start time and replaces
+        any bar with the same start, so writers only ever extend a series and
+        never drop bars another process (or an earlier run) wrote. Series are
+        trimmed to BAR_HISTORY_LENGTH bars and expire after
+        REDIS_BARS_RETENTION_DAYS without a write.
+        """
+        if not series:
+            return
+        
+        ttl = settings.REDIS_BARS_RETENTION_DAYS * 24 * 3600
+        async with self.raw_redis.pipeline(transaction=False) as pipe:
+            for (symbol, interval), bars in series.items():
+                key = self.market_bars_key(symbol, interval)
+                for i in range(len(bars)):
+                    start = int(bars.time[i])
+                    pipe.zremrangebyscore(key, start, start)
+                    pipe.zadd(key, {encode_bars(bars.slice(i, i + 1)): start})
+                pipe.zremrangebyrank(key, 0, -settings.BAR_HISTORY_LENGTH - 1)
+                pipe.expire(key, ttl)
+            await pipe.execute()
+    
+    async def get_market_bars(self, symbol: str, interval_seconds: int = 60) -> BarArrays:
+        """Get market bars from Redis, oldest first."""
+        return (await self.get_market_bars_many([(symbol, interval_seconds)]))[0]
+    
+    async def get_market_bars_many(self, series: List[Tuple[str, int]]) -> List[BarArrays]:
+        """Get several (symbol, interval) bar series in one pipeline (empty if missing)."""
+        if not series:
+            return []
+        
+        async with self.raw_redis.pipeline(transaction=False) as pipe:
+            for symbol, interval in series:
+                pipe.zrange(self.market_bars_key(symbol, interval), 0, -1)
+            results = await pipe.execute()
+        
+        return [
+            BarArrays.concat([
+                bars for bars in (
+                    self._decode_cached_bars(self.market_bars_key(symbol, interval), member)
+                    for member in members
+                ) if bars is not None
+            ])
+            for (symbol, interval), members in zip(series, results)
+        ]
+    
+    async def publish_bar_updates(self, updates: List[dict]):
+        """Publish bar updates to their `bars:{symbol}` pub/sub channels in one pipeline."""
+        if not updates:
+            return
+        
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for update in updates:
+                pipe.publish(self.bar_channel(update["symbol"]), encoding.dumps(update))
+            await pipe.execute()
+    
+    @staticmethod
+    def bar_channel(symbol: str) -> str:
+        """Per-symbol bar updates channel, subscribed only by nodes with viewers."""
+        return f"bars:{symbol.lower()}"
+    
+    async def set_cached_bars(self, key: str, bars: BarArrays, ttl: int):
+        """Cache bars in the compact binary encoding."""
+        await self.raw_redis.setex(
+            key, ttl, encode_bars(bars, compress=settings.BAR_CODEC_COMPRESS)
         )
     
-    async def get_market_bars(self, symbol: str) -> list:
-        """Get market bars from Redis."""
-        key = f"bars:{symbol}"
-        data = await self.redis.get(key)
-        return json.loads(data) if data else []
+    async def get_cached_bars(self, key: str) -> Optional[BarArrays]:
+        """Get cached bars as NumPy views, or None if missing/undecodable."""
+        return self._decode_cached_bars(key, await self.raw_redis.get(key))
+    
+    async def mget_cached_bars(self, keys: List[str]) -> List[Optional[BarArrays]]:
+        """Get several cached bar blocks in one round trip (MGET)."""
+        if not keys:
+            return []
+        payloads = await self.raw_redis.mget(keys)
+        return [self._decode_cached_bars(key, payload) for key, payload in zip(keys, payloads)]
+    
+    async def mset_cached_bars_with_ttl(self, entries: Dict[str, Tuple[BarArrays, int]]):
+        """Cache several bar blocks in one pipelined round trip."""
+        if not entries:
+            return
+        
+        async with self.raw_redis.pipeline(transaction=False) as pipe:
+            for key, (bars, ttl) in entries.items():
+                pipe.setex(key, ttl, encode_bars(bars, compress=settings.BAR_CODEC_COMPRESS))
+            await pipe.execute()
+    
+    @staticmethod
+    def _decode_cached_bars(key: str, payload: Optional[bytes]) -> Optional[BarArrays]:
+        if not payload:
+            return None
+        try:
+            return decode_bars(payload)
+        except BarCodecError as e:
+            # e.g. a legacy JSON value still within its TTL
+            logger.warning(f"Ignoring undecodable bars at {key}: {e}")
+            return None
+    
+    # Poll demand reported by every node, read by the poller
+    POLL_SUBSCRIPTIONS_KEY = "poll_demand:subscriptions"
+    POLL_LOOKUPS_KEY = "poll_demand:lookups"
+    
+    async def publish_poll_demand(self, subscribed: Iterable[str], lookups: Dict[str, float], now: float):
+        """
+        Report one node's poll demand to the poller in one pipeline.
+        
+        Subscribed symbols are scored with the report time and lookups with
+        their own time (kept if newer), so the poller can age out both.
+        """
+        subscribed = list(subscribed)
+        if not subscribed and not lookups:
+            return
+        
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if subscribed:
+                pipe.zadd(self.POLL_SUBSCRIPTIONS_KEY, {symbol: now for symbol in subscribed})
+            if lookups:
+                pipe.zadd(self.POLL_LOOKUPS_KEY, lookups, gt=True)
+            await pipe.execute()
+    
+    async def get_poll_demand(
+        self,
+        subscribed_since: float,
+        looked_up_since: float
+    ) -> Tuple[List[str], Dict[str, float]]:
+        """Cluster-wide subscribed symbols and lookup times, trimming entries past the cutoffs."""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(self.POLL_SUBSCRIPTIONS_KEY, "-inf", f"({subscribed_since}")
+            pipe.zremrangebyscore(self.POLL_LOOKUPS_KEY, "-inf", f"({looked_up_since}")
+            pipe.zrange(self.POLL_SUBSCRIPTIONS_KEY, 0, -1)
+            pipe.zrange(self.POLL_LOOKUPS_KEY, 0, -1, withscores=True)
+            _, _, subscribed, lookups = await pipe.execute()
+        return subscribed, dict(lookups)
+    
+    @staticmethod
+    def data_version_key(dependency: str) -> str:
+        """Version counter of one dependency (a symbol or e.g. `model:{symbol}`)."""
+        return f"data_version:{dependency.lower()}"
+    
+    @staticmethod
+    def derived_deps_key(dependency: str) -> str:
+        """Set of derived-result keys computed from one dependency."""
+        return f"derived_deps:{dependency.lower()}"
+    
+    async def get_data_versions(self, dependencies: List[str]) -> Dict[str, int]:
+        """Current version of each dependency in one MGET (0 if never bumped)."""
+        if not dependencies:
+            return {}
+        values = await self.redis.mget([self.data_version_key(dep) for dep in dependencies])
+        return {dep.lower(): int(value or 0) for dep, value in zip(dependencies, values)}
+    
+    async def set_derived(self, key: str, value: str, dependencies: List[str], ttl: int):
+        """Store a derived result and index it under each dependency, in one pipeline."""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.setex(key, ttl, value)
+            for dep in dependencies:
+                deps_key = self.derived_deps_key(dep)
+                pipe.sadd(deps_key, key)
+                pipe.expire(deps_key, ttl)
+            await pipe.execute()
+    
+    async def invalidate_derived(self, dependencies: List[str]) -> int:
+        """
+        Bump each dependency's version and delete every result indexed under it.
+        
+        Returns the number of derived keys deleted.
+        """
+        if not dependencies:
+            return 0
+        
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for dep in dependencies:
+                pipe.incr(self.data_version_key(dep))
+                pipe.smembers(self.derived_deps_key(dep))
+            replies = await pipe.execute()
+        
+        keys = set()
+        for members in replies[1::2]:
+            keys.update(members)
+        
+        to_delete = list(keys) + [self.derived_deps_key(dep) for dep in dependencies]
+        await self.redis.delete(*to_delete)
+        return len(keys)
+    
+    # Fill and event history
+    #
+    # Fills and events are appended to capped streams (`fills:{user_id}`,
+    # `events:{type}`) in the same pipeline that publishes them, so history
+    # survives without listeners. Entry IDs are millisecond timestamps:
+    # last-N and time-range queries are one XREVRANGE per stream.
+    
+    EVENT_TYPES_KEY = "event_types"
+    
+    @staticmethod
+    def fill_stream_key(user_id) -> str:
+        return f"fills:{user_id}"
+    
+    @staticmethod
+    def event_stream_key(event_type: str) -> str:
+        return f"events:{event_type}"
     
     async def publish_event(self, event_type: str, data: dict):
-        """Publish event to Redis pub/sub."""
-        await self.redis.publish("events", json.dumps({
+        """Record an event in its history stream and publish it to Redis pub/sub."""
+        message = encoding.dumps({
             "type": event_type,
             "data": data,
             "timestamp": data.get("timestamp", "")
-        }))
+        })
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xadd(
+                self.event_stream_key(event_type),
+                {"data": message},
+                maxlen=settings.EVENT_HISTORY_MAXLEN,
+                approximate=True
+            )
+            pipe.sadd(self.EVENT_TYPES_KEY, event_type)
+            pipe.publish("events", message)
+            await pipe.execute()
+        self._event_types.add(event_type)
     
     async def publish_fill(self, fill_data: dict):
-        """Publish fill event."""
-        await self.redis.publish("fills", json.dumps(fill_data))
+        """Record a fill in its user's history stream and publish it."""
+        message = encoding.dumps(fill_data)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if fill_data.get("user_id") is not None:
+                pipe.xadd(
+                    self.fill_stream_key(fill_data["user_id"]),
+                    {"data": message},
+                    maxlen=settings.FILL_HISTORY_MAXLEN,
+                    approximate=True
+                )
+            pipe.publish("fills", message)
+            await pipe.execute()
+    
+    async def get_recent_fills(
+        self,
+        user_id,
+        count: int = 50,
+        since: Optional[float] = None,
+        until: Optional[float] = None
+    ) -> List[dict]:
+        """
+        A user's fills, newest first: the last `count`, optionally limited to
+        the epoch-second range [since, until].
+        """
+        entries = await self.redis.xrevrange(
+            self.fill_stream_key(user_id),
+            **self._history_range(since, until),
+            count=min(count, settings.HISTORY_QUERY_LIMIT)
+        )
+        return self._history_entries(entries)
+    
+    async def get_recent_events(
+        self,
+        event_types: Optional[List[str]] = None,
+        count: int = 50,
+        since: Optional[float] = None,
+        until: Optional[float] = None
+    ) -> List[dict]:
+        """
+        Recent events, newest first, merged across types.
+        
+        Args:
+            event_types: Keywords matched as substrings of event types, like
+                the events websocket subscriptions (all types if None)
+        """
+        count = min(count, settings.HISTORY_QUERY_LIMIT)
+        history_range = self._history_range(since, until)
+        
+        # The type set is read in the same round trip as the streams of the
+        # types already known; only types new to this process need a second one
+        matching = self._matching_event_types(self._event_types, event_types)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.smembers(self.EVENT_TYPES_KEY)
+            for event_type in matching:
+                pipe.xrevrange(self.event_stream_key(event_type), **history_range, count=count)
+            known, *results = await pipe.execute()
+        
+        new = self._matching_event_types(set(known) - self._event_types, event_types)
+        self._event_types.update(known)
+        if new:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for event_type in new:
+                    pipe.xrevrange(self.event_stream_key(event_type), **history_range, count=count)
+                results += await pipe.execute()
+        
+        entries = sorted(
+            (entry for entries in results for entry in entries),
+            key=lambda entry: tuple(int(part) for part in entry[0].split("-")),
+            reverse=True
+        )
+        return self._history_entries(entries[:count])
+    
+    @staticmethod
+    def _matching_event_types(known: Iterable[str], keywords: Optional[List[str]]) -> List[str]:
+        return sorted(
+            event_type for event_type in known
+            if keywords is None or any(keyword in event_type for keyword in keywords)
+        )
+    
+    @staticmethod
+    def _history_range(since: Optional[float], until: Optional[float]) -> dict:
+        """XREVRANGE bounds for an epoch-second range (stream IDs are in ms)."""
+        return {
+            "max": str(int(until * 1000)) if until is not None else "+",
+            "min": str(int(since * 1000)) if since is not None else "-"
+        }
+    
+    @staticmethod
+    def _history_entries(entries) -> List[dict]:
+        history = []
+        for entry_id, fields in entries:
+            try:
+                history.append({"id": entry_id, **encoding.loads(fields["data"])})
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Skipping malformed history entry {entry_id}: {e}")
+        return history
 
 
 # Global Redis client instance
@@ -7,9 +7,18 @@ from loguru import logger
 from app.core.config import settings
 from app.core.database import init_db
 from app.core.redis_client import init_redis
+from app.services.history_store import history_store
+from app.services.bar_archive import bar_archive
+from app.services.derived_cache import derived_cache
+from app.services.portfolio_state import portfolio_state
 from app.api.v1 import positions, orders, risk, forecast, optimize
 from app.websockets import data_ws, events_ws, fills_ws
-from app.services.data_service import start_data_service
+from app.websockets import manager
+from app.websockets.hub import hub
+from app.websockets.cluster import cluster
+from app.websockets.session import sessions, timer_wheel
+from app.services.tick_stream_consumer import tick_stream_consumer
+from app.services.data_service import start_data_service, stop_data_service, data_service
 
 
 @asynccontextmanager
@@ -20,13 +29,25 @@ async def lifespan(app: FastAPI):
     await init_db()
     await init_redis()
     
-    # Start background data service
-    await start_data_service()
+    # One Redis subscriber per channel and one ticks stream reader, shared by all websockets
+    await hub.start()
+    await tick_stream_consumer.start()
+    
+    # Register this process as a websocket node for cluster-wide counts
+    await cluster.start()
+    
+    # Start background data service (polls only while this node holds the poller lease)
+    await start_data_service(cluster.node_id)
     
     yield
     
     # Shutdown
     logger.info("Shutting down MKTO Backend...")
+    await cluster.stop()
+    await tick_stream_consumer.stop()
+    await hub.stop()
+    await timer_wheel.stop()
+    await stop_data_service()
 
 
 app = FastAPI(
@@ -76,6 +97,37 @@ async def health_check():
     }
 
 
+@app.get("/stats")
+async def runtime_stats():
+    """In-process cache and pipeline metrics."""
+    return {
+        "quote_cache": data_service.client.quote_cache.get_stats(),
+        "sources": {
+            source: health.get_stats() for source, health in data_service.client.health.items()
+        },
+        "http_pool": data_service.client.http_metrics.get_stats(),
+        "polling": data_service.scheduler.get_stats(),
+        "poller_lease": data_service.lease.get_stats(),
+        "tick_deltas": data_service.tick_tracker.get_stats(),
+        "derived_cache": derived_cache.get_stats(),
+        "ingestion": data_service.writer.get_stats(),
+        "history": history_store.get_stats(),
+        "archive": bar_archive.get_stats(),
+        "pubsub_hub": hub.get_stats(),
+        "tick_stream": tick_stream_consumer.get_stats(),
+        "websockets": manager.get_stats(),
+        "sessions": sessions.get_stats(),
+        "portfolio_state": portfolio_state.get_stats(),
+        "cluster_node": cluster.get_stats()
+    }
+
+
+@app.get("/stats/cluster")
+async def cluster_stats():
+    """Websocket connections and subscriptions summed over every live node."""
+    return await cluster.get_cluster_stats()
+
+
 if __name__ == "__main__":
     uvicorn.run(
         "app.main:app",
@@ -0,0 +1,180 @@
+"""
+Bar Aggregator - Streaming OHLCV bars from polled ticks
+
+Keeps running OHLCV state per (symbol, interval) and updates it in O(1) per
+tick. Bars close when a tick lands in a later window or when the wall clock
+passes the window end, whichever happens first. Completed bars are kept in a
+bounded per-series history and handed out in batches for persistence.
+"""
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.bar_codec import BarArrays
+
+
+@dataclass
+class CompletedBar:
+    """A closed OHLCV bar."""
+    symbol: str
+    interval: int  # seconds
+    start: int     # epoch seconds
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+
+    def to_dict(self) -> Dict:
+        return {
+            "symbol": self.symbol,
+            "interval": self.interval,
+            "start": self.start,
+            "open": self.open,
+            "high": self.high,
+            "low": self.low,
+            "close": self.close,
+            "volume": self.volume
+        }
+
+
+class _RunningBar:
+    """Mutable OHLCV state for the current window."""
+
+    __slots__ = ("start", "open", "high", "low", "close", "volume")
+
+    def __init__(self, start: int, price: float, volume: float):
+        self.start = start
+        self.open = price
+        self.high = price
+        self.low = price
+        self.close = price
+        self.volume = volume
+
+    def update(self, price: float, volume: float):
+        if price > self.high:
+            self.high = price
+        elif price < self.low:
+            self.low = price
+        self.close = price
+        self.volume += volume
+
+
+class BarAggregator:
+    """Aggregates ticks into OHLCV bars for several intervals at once."""
+
+    def __init__(self, intervals: Sequence[int] = (60, 300, 900, 3600), history_length: int = 500):
+        self.intervals = tuple(sorted(intervals))
+        self.history_length = history_length
+
+        self._running: Dict[Tuple[str, int], _RunningBar] = {}
+        self._history: Dict[Tuple[str, int], Deque[Tuple]] = {}
+        self._pending: List[CompletedBar] = []
+
+        # Per-symbol tick bookkeeping
+        self._last_tick_ts: Dict[str, float] = {}
+        self._last_cum_volume: Dict[str, float] = {}
+
+    def add_tick(
+        self,
+        symbol: str,
+        price: float,
+        timestamp: float,
+        cumulative_volume: Optional[float] = None
+    ) -> bool:
+        """
+        Apply one tick to every interval.
+
+        `cumulative_volume` is the session volume reported by the quote; bar
+        volume is its increase since the previous tick. Returns False if the
+        tick was ignored (duplicate, out of order, or without a price).
+        """
+        if not price:
+            return False
+
+        symbol = symbol.lower()
+        if timestamp <= self._last_tick_ts.get(symbol, 0):
+            return False
+        self._last_tick_ts[symbol] = timestamp
+
+        volume = self._volume_delta(symbol, cumulative_volume)
+        ts = int(timestamp)
+
+        for interval in self.intervals:
+            key = (symbol, interval)
+            start = ts - ts % interval
+            bar = self._running.get(key)
+
+            if bar is None:
+                self._running[key] = _RunningBar(start, price, volume)
+            elif start == bar.start:
+                bar.update(price, volume)
+            else:
+                self._close(key, bar)
+                self._running[key] = _RunningBar(start, price, volume)
+
+        return True
+
+    def close_due(self, now: float) -> int:
+        """Close every running bar whose window ended at or before `now`."""
+        due = [
+            (key, bar) for key, bar in self._running.items()
+            if bar.start + key[1] <= now
+        ]
+        for key, bar in due:
+            del self._running[key]
+            self._close(key, bar)
+        return len(due)
+
+    def drain_completed(self) -> List[CompletedBar]:
+        """Return and clear the bars completed since the last drain."""
+        completed, self._pending = self._pending, []
+        return completed
+
+    def running_bar(self, symbol: str, interval: int) -> Optional[Dict]:
+        """Current (open) bar for a series."""
+        bar = self._running.get((symbol.lower(), interval))
+        if bar is None:
+            return None
+        return CompletedBar(
+            symbol.lower(), interval, bar.start, bar.open, bar.high, bar.low, bar.close, bar.volume
+        ).to_dict()
+
+    def history(self, symbol: str, interval: int) -> BarArrays:
+        """Completed bars for a series, oldest first."""
+        rows = self._history.get((symbol.lower(), interval))
+        if not rows:
+            return BarArrays.empty()
+        time, open_, high, low, close, volume = zip(*rows)
+        return BarArrays(
+            np.array(time, dtype=np.int64),
+            np.array(open_, dtype=np.float64),
+            np.array(high, dtype=np.float64),
+            np.array(low, dtype=np.float64),
+            np.array(close, dtype=np.float64),
+            np.array(volume, dtype=np.float64)
+        )
+
+    def _close(self, key: Tuple[str, int], bar: _RunningBar):
+        symbol, interval = key
+        history = self._history.get(key)
+        if history is None:
+            history = self._history[key] = deque(maxlen=self.history_length)
+        history.append((bar.start, bar.open, bar.high, bar.low, bar.close, bar.volume))
+        self._pending.append(CompletedBar(
+            symbol, interval, bar.start, bar.open, bar.high, bar.low, bar.close, bar.volume
+        ))
+
+    def _volume_delta(self, symbol: str, cumulative_volume: Optional[float]) -> float:
+        if cumulative_volume is None:
+            return 0.0
+        previous = self._last_cum_volume.get(symbol)
+        self._last_cum_volume[symbol] = cumulative_volume
+        if previous is None:
+            return 0.0
+        delta = cumulative_volume - previous
+        # A drop means a new session started; its volume so far is the new total
+        return delta if delta >= 0 else cumulative_volume
@@ -0,0 +1,286 @@
+"""
+Bar Archive - Memory-mapped on-disk bar files for offline analytics
+
+Closed bars are written to local disk in the bar codec layout, one file per
+symbol, interval and UTC day:
+
+    {BAR_ARCHIVE_DIR}/{symbol}/{interval}/{YYYY-MM-DD}.mkb
+
+Bars arrive a few at a time, so the writer appends small segment files
+(`{YYYY-MM-DD}.{n}.mkb`) and a compaction job later merges a finished day's
+segments into its day file. Readers memory-map the files, so a single day is
+returned as zero-copy NumPy views and long ranges cost one concatenation
+instead of a database scan.
+"""
+
+import asyncio
+import os
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from app.core.bar_codec import BarArrays, BarCodecError, decode_bars, encode_bars, PRICE_COLUMNS
+from app.core.config import settings
+
+
+SUFFIX = ".mkb"
+
+
+class BarArchive:
+    """Per-symbol, per-day bar files with buffered writes and compaction."""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+        self._buffer: Dict[Tuple[str, int, date], List[Tuple]] = {}
+        self._tasks: List[asyncio.Task] = []
+
+        # Metrics
+        self.bars_written = 0
+        self.segments_written = 0
+        self.days_compacted = 0
+        self.files_mapped = 0
+        self.write_errors = 0
+
+    def add(self, symbol: str, interval: int, start: int, open_: float, high: float,
+            low: float, close: float, volume: float):
+        """Buffer one closed bar until the next flush."""
+        day = datetime.utcfromtimestamp(start).date()
+        self._buffer.setdefault((symbol.lower(), interval, day), []).append(
+            (start, open_, high, low, close, volume)
+        )
+
+    async def flush(self) -> int:
+        """Write buffered bars as segment files (off the event loop)."""
+        if not self._buffer:
+            return 0
+        buffered, self._buffer = self._buffer, {}
+        try:
+            return await asyncio.to_thread(self._write_segments, buffered)
+        except Exception as e:
+            self.write_errors += 1
+            logger.error(f"Error writing bar archive segments: {e}")
+            return 0
+
+    async def compact(self, before: Optional[date] = None) -> int:
+        """Merge segment files of days before `before` (default: today UTC)."""
+        before = before or datetime.utcnow().date()
+        return await asyncio.to_thread(self._compact, before)
+
+    def read(
+        self,
+        symbol: str,
+        start: datetime,
+        end: Optional[datetime] = None,
+        interval: int = 60
+    ) -> BarArrays:
+        """
+        Bars for a symbol in [start, end).
+
+        A range within one compacted day is returned as read-only views over
+        the memory-mapped file; longer ranges are concatenated.
+        """
+        end = end or datetime.utcnow()
+        start_ts = int(start.timestamp()) if start.tzinfo else _epoch(start)
+        end_ts = int(end.timestamp()) if end.tzinfo else _epoch(end)
+
+        parts = []
+        day = start.date()
+        while day <= end.date():
+            bars = self._read_day(symbol, interval, day)
+            if len(bars):
+                lo = int(np.searchsorted(bars.time, start_ts, side="left"))
+                hi = int(np.searchsorted(bars.time, end_ts, side="left"))
+                parts.append(bars.slice(lo, hi))
+            day += timedelta(days=1)
+        return BarArrays.concat(parts)
+
+    def read_latest(self, symbol: str, count: int, interval: int = 60, max_days: int = 400) -> BarArrays:
+        """The most recent `count` archived bars, walking back day by day."""
+        days = self.days(symbol, interval)[-max_days:]
+        parts = []
+        total = 0
+        for day in reversed(days):
+            bars = self._read_day(symbol, interval, day)
+            if len(bars):
+                parts.append(bars)
+                total += len(bars)
+                if total >= count:
+                    break
+        return BarArrays.concat(parts[::-1]).tail(count)
+
+    def days(self, symbol: str, interval: int = 60) -> List[date]:
+        """Archived days for a series, oldest first."""
+        directory = self._series_dir(symbol, interval)
+        if not directory.is_dir():
+            return []
+        days = set()
+        for path in directory.glob(f"*{SUFFIX}"):
+            try:
+                days.add(date.fromisoformat(path.name.split(".")[0]))
+            except ValueError:
+                continue
+        return sorted(days)
+
+    async def start(self):
+        """Start the periodic flush and compaction tasks."""
+        self._tasks = [
+            asyncio.create_task(self._periodic(self.flush, settings.BAR_ARCHIVE_FLUSH_SECONDS)),
+            asyncio.create_task(self._periodic(self.compact, settings.BAR_ARCHIVE_COMPACT_INTERVAL_SECONDS)),
+        ]
+
+    async def stop(self):
+        """Stop background tasks and flush what is still buffered."""
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        await self.flush()
+
+    def get_stats(self) -> Dict:
+        """Write, compaction and read metrics."""
+        return {
+            "root": str(self.root),
+            "buffered_bars": sum(len(rows) for rows in self._buffer.values()),
+            "bars_written": self.bars_written,
+            "segments_written": self.segments_written,
+            "days_compacted": self.days_compacted,
+            "files_mapped": self.files_mapped,
+            "write_errors": self.write_errors
+        }
+
+    async def _periodic(self, job, interval_seconds: float):
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Bar archive job failed: {e}")
+
+    def _series_dir(self, symbol: str, interval: int) -> Path:
+        return self.root / symbol.lower() / str(interval)
+
+    def _write_segments(self, buffered: Dict[Tuple[str, int, date], List[Tuple]]) -> int:
+        written = 0
+        for (symbol, interval, day), rows in buffered.items():
+            directory = self._series_dir(symbol, interval)
+            directory.mkdir(parents=True, exist_ok=True)
+            rows.sort()
+            time_, *prices = zip(*rows)
+            bars = BarArrays(
+                np.array(time_, dtype=np.int64),
+                *(np.array(column, dtype=np.float64) for column in prices)
+            )
+            path = directory / f"{day.isoformat()}.{time.time_ns()}{SUFFIX}"
+            _atomic_write(path, encode_bars(bars))
+            written += len(bars)
+            self.segments_written += 1
+        self.bars_written += written
+        return written
+
+    def _compact(self, before: date) -> int:
+        compacted = 0
+        if not self.root.is_dir():
+            return 0
+        for directory in self.root.glob("*/*"):
+            segments_by_day: Dict[date, List[Path]] = {}
+            for path in directory.glob(f"*.*{SUFFIX}"):
+                name, _, rest = path.name.partition(".")
+                if rest == SUFFIX.lstrip("."):
+                    continue  # Already a day file
+                try:
+                    day = date.fromisoformat(name)
+                except ValueError:
+                    continue
+                if day < before:
+                    segments_by_day.setdefault(day, []).append(path)
+
+            for day, segments in segments_by_day.items():
+                day_file = directory / f"{day.isoformat()}{SUFFIX}"
+                sources = ([day_file] if day_file.exists() else []) + sorted(segments)
+                merged = _merge([_load(path) for path in sources])
+                _atomic_write(day_file, encode_bars(merged))
+                for path in segments:
+                    path.unlink()
+                compacted += 1
+
+        self.days_compacted += compacted
+        return compacted
+
+    def _read_day(self, symbol: str, interval: int, day: date) -> BarArrays:
+        directory = self._series_dir(symbol, interval)
+        day_file = directory / f"{day.isoformat()}{SUFFIX}"
+        segments = sorted(directory.glob(f"{day.isoformat()}.*{SUFFIX}")) if directory.is_dir() else []
+
+        parts = []
+        for path in ([day_file] if day_file.exists() else []) + segments:
+            bars = self._map(path)
+            if bars is not None:
+                parts.append(bars)
+
+        if len(parts) == 1:
+            return parts[0]  # Zero-copy
+        return _merge(parts)
+
+    def _map(self, path: Path) -> Optional[BarArrays]:
+        try:
+            if path.stat().st_size == 0:
+                return None
+            bars = decode_bars(np.memmap(path, dtype=np.uint8, mode="r"))
+            self.files_mapped += 1
+            return bars
+        except (OSError, BarCodecError) as e:
+            logger.warning(f"Skipping unreadable bar archive file {path}: {e}")
+            return None
+
+
+def _load(path: Path) -> BarArrays:
+    """Read a file fully into memory (used before its file is replaced)."""
+    try:
+        return decode_bars(path.read_bytes())
+    except BarCodecError as e:
+        logger.warning(f"Dropping corrupt bar archive file {path}: {e}")
+        return BarArrays.empty()
+
+
+def _merge(parts: List[BarArrays]) -> BarArrays:
+    """Concatenate, sort by time and keep the last bar for each timestamp."""
+    bars = BarArrays.concat(parts)
+    if len(bars) < 2:
+        return bars
+    # Reverse first so np.unique keeps the most recently written duplicate
+    order = np.argsort(bars.time[::-1], kind="stable")
+    _, first = np.unique(bars.time[::-1][order], return_index=True)
+    keep = (len(bars) - 1) - order[first]
+    return BarArrays(bars.time[keep], *(getattr(bars, col)[keep] for col in PRICE_COLUMNS))
+
+
+def _atomic_write(path: Path, payload: bytes):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _epoch(value: datetime) -> int:
+    return int((value - datetime(1970, 1, 1)).total_seconds())
+
+
+# Global bar archive instance
+bar_archive = BarArchive(settings.BAR_ARCHIVE_DIR)
+
+
+def get_bar_archive() -> BarArchive:
+    """Dependency to get bar archive."""
+    return bar_archive
@@ -0,0 +1,132 @@
+"""
+Bar Parser - Streaming Stooq CSV parsing into columnar arrays
+
+Parses the Stooq intraday CSV body chunk by chunk as it arrives, appending
+numeric fields straight into growable typed arrays. No per-row dicts are
+built and the full body is never held as one string.
+
+Example input:
+    Date,Time,Open,High,Low,Close,Volume
+    2025-07-16,15:35:00,209.11,209.59,209.02,209.40,125000
+"""
+
+import calendar
+from array import array
+from typing import Dict, Optional
+
+import numpy as np
+
+from app.core.bar_codec import BarArrays
+
+
+class StooqBarParser:
+    """Incremental parser for Stooq intraday bar CSV."""
+
+    REQUIRED_COLUMNS = (b"Date", b"Time", b"Open", b"High", b"Low", b"Close")
+
+    def __init__(self):
+        self._pending = b""
+        self._indices: Optional[tuple] = None
+        self._volume_index: Optional[int] = None
+        self._header_seen = False
+        self._day_epochs: Dict[bytes, int] = {}
+
+        self._time = array("q")
+        self._open = array("d")
+        self._high = array("d")
+        self._low = array("d")
+        self._close = array("d")
+        self._volume = array("d")
+
+        self.rows_skipped = 0
+
+    def feed(self, chunk: bytes):
+        """Consume the next chunk of the response body."""
+        if not chunk:
+            return
+        lines = (self._pending + chunk).split(b"\n")
+        self._pending = lines.pop()
+        for line in lines:
+            self._parse_line(line)
+
+    def finish(self) -> BarArrays:
+        """
+        Flush the trailing line and return the parsed bars.
+
+        The returned arrays share memory with the parser's buffers, so the
+        parser must not be fed again afterwards.
+        """
+        if self._pending:
+            self._parse_line(self._pending)
+            self._pending = b""
+
+        return BarArrays(
+            np.frombuffer(self._time, dtype=np.int64),
+            np.frombuffer(self._open, dtype=np.float64),
+            np.frombuffer(self._high, dtype=np.float64),
+            np.frombuffer(self._low, dtype=np.float64),
+            np.frombuffer(self._close, dtype=np.float64),
+            np.frombuffer(self._volume, dtype=np.float64)
+        )
+
+    def _parse_line(self, line: bytes):
+        line = line.rstrip(b"\r")
+        if not line:
+            return
+
+        fields = line.split(b",")
+
+        if not self._header_seen:
+            self._header_seen = True
+            self._parse_header(fields)
+            return
+
+        if self._indices is None:
+            return
+
+        date_i, time_i, open_i, high_i, low_i, close_i = self._indices
+        try:
+            ts = self._day_epoch(fields[date_i]) + _seconds_of_day(fields[time_i])
+            open_price = float(fields[open_i])
+            high = float(fields[high_i])
+            low = float(fields[low_i])
+            close = float(fields[close_i])
+            volume = (
+                float(fields[self._volume_index] or 0)
+                if self._volume_index is not None and self._volume_index < len(fields)
+                else 0.0
+            )
+        except (ValueError, IndexError):
+            self.rows_skipped += 1
+            return
+
+        self._time.append(ts)
+        self._open.append(open_price)
+        self._high.append(high)
+        self._low.append(low)
+        self._close.append(close)
+        self._volume.append(volume)
+
+    def _parse_header(self, fields: list):
+        names = [name.strip() for name in fields]
+        if not all(col in names for col in self.REQUIRED_COLUMNS):
+            # e.g. Stooq's plain-text "No data" response
+            return
+        self._indices = tuple(names.index(col) for col in self.REQUIRED_COLUMNS)
+        self._volume_index = names.index(b"Volume") if b"Volume" in names else None
+
+    def _day_epoch(self, date: bytes) -> int:
+        epoch = self._day_epochs.get(date)
+        if epoch is None:
+            digits = date.replace(b"-", b"")
+            epoch = calendar.timegm(
+                (int(digits[:4]), int(digits[4:6]), int(digits[6:8]), 0, 0, 0)
+            )
+            self._day_epochs[date] = epoch
+        return epoch
+
+
+def _seconds_of_day(value: bytes) -> int:
+    """Parse 'HH:MM:SS' or 'HHMMSS' into seconds after midnight."""
+    digits = value.replace(b":", b"")
+    return int(digits[:2]) * 3600 + int(digits[2:4]) * 60 + int(digits[4:6] or 0)
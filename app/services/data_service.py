@@ -7,16 +7,32 @@ Implements rate limiting and caching to stay within free tier limits.
 
 import asyncio
 import aiohttp
+import time
 import csv
 import io
-from datetime import datetime, timedelta
-from typing import Optional, Dict, List
+from datetime import UTC, datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional, Dict, List, Tuple
 from loguru import logger
 import json
 
 from app.core.config import settings
 from app.core.redis_client import get_redis
-from app.core.database import MarketData, async_session_maker
+from app.core.bar_codec import BarArrays
+from app.services.quote_cache import QuoteCache
+from app.services.bar_parser import StooqBarParser
+from app.services.ingestion_buffer import create_market_data_writer
+from app.services.bar_aggregator import BarAggregator
+from app.services.history_store import history_store
+from app.services.bar_archive import bar_archive
+from app.services.poll_scheduler import PollScheduler, create_poll_scheduler
+from app.services.poller_lease import PollerLease
+from app.services.source_health import create_source_health, hedged_request
+from app.services.http_pool import HttpPoolMetrics, create_client_session
+from app.services.tick_deltas import SNAPSHOT, TickDeltaTracker, TickState
+from app.services.tick_stream_consumer import TickStreamConsumer, tick_stream_consumer
+from app.services.derived_cache import derived_cache
+from app.core.database import Position, async_session_maker
+from sqlalchemy import select
 
 
 class RateLimiter:
@@ -27,12 +43,24 @@ class RateLimiter:
         self.window_seconds = window_seconds
         self.calls = []
     
+    def _prune(self, now: datetime):
+        """Remove old calls outside the window."""
+        self.calls = [call_time for call_time in self.calls 
+                     if (now - call_time).total_seconds() < self.window_seconds]
+    
+    def try_acquire(self) -> bool:
+        """Count a call if the window has room; never waits."""
+        now = datetime.utcnow()
+        self._prune(now)
+        if len(self.calls) >= self.max_calls:
+            return False
+        self.calls.append(now)
+        return True
+    
     async def acquire(self):
         """Wait if necessary to respect rate limits."""
         now = datetime.utcnow()
-        # Remove old calls outside the window
-        self.calls = [call_time for call_time in self.calls 
-                     if (now - call_time).total_seconds() < self.window_seconds]
+        self._prune(now)
         
         if len(self.calls) >= self.max_calls:
             # Wait until the oldest call expires
@@ -48,6 +76,7 @@ class MarketDataClient:
     
     def __init__(self):
         self.session: Optional[aiohttp.ClientSession] = None
+        self.http_metrics = HttpPoolMetrics()
         self.redis_client = None
         
         # Rate limiters
@@ -62,13 +91,31 @@ class MarketDataClient:
         
         # Track last successful fetch times
         self.last_fetch = {}
+        
+        # Per-source latency/error tracking and circuit breakers
+        self.health = {
+            source: create_source_health(source) for source in ("stooq", "yahoo", "fmp")
+        }
+        
+        # Notified of API lookups so the poller follows demand
+        self.scheduler: Optional[PollScheduler] = None
+        
+        # In-process L1 cache in front of Redis
+        self.quote_cache = QuoteCache(
+            max_entries=settings.QUOTE_CACHE_MAX_ENTRIES,
+            stale_grace_seconds=settings.QUOTE_CACHE_STALE_SECONDS
+        )
+        # Full quotes folded from the tick stream this node reads
+        self.published = TickState()
+        self.source_ttls = {
+            "stooq": settings.STOOQ_QUOTE_TTL_SECONDS,
+            "yahoo": settings.YAHOO_QUOTE_TTL_SECONDS,
+            "fmp": settings.FMP_PROFILE_TTL_SECONDS
+        }
     
     async def start(self):
         """Initialize the client."""
-        self.session = aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=10),
-            headers={'User-Agent': 'MKTO/1.0'}
-        )
+        self.session = create_client_session(self.http_metrics)
         self.redis_client = await get_redis()
         logger.info("Market data client initialized")
     
@@ -84,109 +131,213 @@ class MarketDataClient:
         Example response:
         AAPL.US,20250716,209.11,209.59,209.64,42.3m
         """
-        url = f"{settings.STOOQ_BASE_URL}/l/?s={symbol}"
-        
-        # Check cache first
+        # Check L1, then Redis
         cache_key = f"stooq_quote:{symbol}"
+        cached = self.quote_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         cached = await self.redis_client.get_cached_response(cache_key)
         if cached:
-            return json.loads(cached)
+            data = json.loads(cached)
+            self.quote_cache.set(cache_key, data, self.source_ttls["stooq"], symbol=symbol)
+            return data
         
-        try:
-            await self.stooq_limiter.acquire()
-            
+        data = await self._request_stooq_quote(symbol)
+        if data:
+            await self.redis_client.set_cached_response(
+                cache_key,
+                json.dumps(data),
+                ttl=self.source_ttls["stooq"]
+            )
+        return data
+    
+    async def _request_stooq_quote(self, symbol: str) -> Optional[Dict]:
+        """Request a quote from Stooq and store it in the L1 cache."""
+        url = f"{settings.STOOQ_BASE_URL}/l/?s={symbol}"
+        cache_key = f"stooq_quote:{symbol}"
+        
+        async def request():
             async with self.session.get(url) as response:
+                self._check_source_status(response)
                 if response.status == 200:
-                    text = await response.text()
-                    
-                    # Parse CSV response
-                    reader = csv.reader(io.StringIO(text))
-                    row = next(reader, None)
-                    
-                    if row and len(row) >= 5:
-                        data = {
-                            "symbol": row[0],
-                            "date": row[1],
-                            "last_price": float(row[2]) if row[2] else None,
-                            "high": float(row[3]) if row[3] else None,
-                            "low": float(row[4]) if row[4] else None,
-                            "volume": self._parse_volume(row[5]) if len(row) > 5 else None,
-                            "timestamp": datetime.utcnow().isoformat(),
-                            "source": "stooq"
-                        }
-                        
-                        # Cache response
-                        await self.redis_client.set_cached_response(
-                            cache_key, 
-                            json.dumps(data),
-                            ttl=60
-                        )
-                        
-                        self.last_fetch[f"stooq:{symbol}"] = datetime.utcnow()
-                        return data
+                    return await response.text()
+        
+        text = await self._call_source(
+            "stooq", request, self.stooq_limiter, f"Stooq quote for {symbol}"
+        )
+        if not text:
+            return None
+        
+        try:
+            # Parse CSV response
+            reader = csv.reader(io.StringIO(text))
+            row = next(reader, None)
+            
+            if row and len(row) >= 5:
+                data = {
+                    "symbol": row[0],
+                    "date": row[1],
+                    "last_price": float(row[2]) if row[2] else None,
+                    "high": float(row[3]) if row[3] else None,
+                    "low": float(row[4]) if row[4] else None,
+                    "volume": self._parse_volume(row[5]) if len(row) > 5 else None,
+                    "timestamp": datetime.utcnow().isoformat(),
+                    "source": "stooq"
+                }
                 
+                self.quote_cache.set(
+                    cache_key, data, self.source_ttls["stooq"], symbol=symbol
+                )
+                
+                self.last_fetch[f"stooq:{symbol}"] = datetime.utcnow()
+                return data
+        
         except Exception as e:
-            logger.error(f"Error fetching Stooq quote for {symbol}: {e}")
+            logger.error(f"Error parsing Stooq quote for {symbol}: {e}")
         
         return None
     
-    async def fetch_stooq_bars(self, symbol: str, interval: int = 5) -> List[Dict]:
+    async def fetch_stooq_bars(self, symbol: str, interval: int = 5) -> BarArrays:
         """
         Fetch intraday bars from Stooq.
         
         Args:
             symbol: Stock symbol (e.g., "aapl.us")
             interval: Interval in minutes (5, 15, 30, 60)
-        """
-        url = f"{settings.STOOQ_BASE_URL}/d/l/?s={symbol}&i={interval}"
         
+        Returns:
+            Columnar bars; cached blocks are zero-copy views over the Redis payload
+        """
         # Check cache
         cache_key = f"stooq_bars:{symbol}:{interval}"
-        cached = await self.redis_client.get_cached_response(cache_key)
-        if cached:
-            return json.loads(cached)
+        cached = await self.redis_client.get_cached_bars(cache_key)
+        if cached is not None:
+            return cached
         
-        try:
-            await self.stooq_limiter.acquire()
+        bars = await self._request_stooq_bars(symbol, interval)
+        if len(bars):
+            await self.redis_client.set_cached_bars(
+                cache_key, bars, settings.STOOQ_BARS_TTL_SECONDS
+            )
+        return bars
+    
+    async def fetch_stooq_bars_many(
+        self,
+        symbols: List[str],
+        interval: int = 5
+    ) -> Dict[str, BarArrays]:
+        """
+        Fetch intraday bars for several symbols.
+        
+        Cached bars are read with one MGET; missing symbols are fetched from
+        Stooq concurrently and written back in one pipeline.
+        """
+        symbols = list(dict.fromkeys(symbols))
+        keys = [f"stooq_bars:{symbol}:{interval}" for symbol in symbols]
+        cached = await self.redis_client.mget_cached_bars(keys)
+        
+        results = {}
+        missing = []
+        for symbol, bars in zip(symbols, cached):
+            if bars is not None:
+                results[symbol] = bars
+            else:
+                missing.append(symbol)
+        
+        if missing:
+            fetched = await asyncio.gather(
+                *(self._request_stooq_bars(symbol, interval) for symbol in missing)
+            )
+            writes = {}
+            for symbol, bars in zip(missing, fetched):
+                results[symbol] = bars
+                if len(bars):
+                    writes[f"stooq_bars:{symbol}:{interval}"] = (bars, settings.STOOQ_BARS_TTL_SECONDS)
+            await self.redis_client.mset_cached_bars_with_ttl(writes)
+        
+        return results
+    
+    async def get_bars(self, symbol: str, interval: int = 5, min_bars: int = 20) -> BarArrays:
+        """Get bars for one symbol; see get_bars_many."""
+        return (await self.get_bars_many([symbol], interval, min_bars))[symbol]
+    
+    async def get_bars_many(
+        self,
+        symbols: List[str],
+        interval: int = 5,
+        min_bars: int = 20
+    ) -> Dict[str, BarArrays]:
+        """
+        Get bars, preferring locally built bars over Stooq.
+        
+        Aggregated series with at least `min_bars` bars are read in one MGET,
+        then the history store is queried for the rest (one re-bucketed range
+        query), and only what is still short falls back to fetch_stooq_bars_many.
+        
+        Args:
+            interval: Interval in minutes
+        """
+        symbols = list(dict.fromkeys(symbols))
+        cached = await self.redis_client.get_market_bars_many(
+            [(symbol, interval * 60) for symbol in symbols]
+        )
+        
+        results = {}
+        fallback = []
+        for symbol, bars in zip(symbols, cached):
+            if len(bars) >= min_bars:
+                results[symbol] = bars
+            else:
+                fallback.append(symbol)
+        
+        if fallback:
+            try:
+                stored = await history_store.get_range_many(
+                    fallback,
+                    start=datetime.utcnow() - timedelta(days=settings.HISTORY_LOOKBACK_DAYS),
+                    interval_seconds=interval * 60
+                )
+            except Exception as e:
+                logger.error(f"Error reading bar history: {e}")
+                stored = {}
             
+            for symbol, bars in stored.items():
+                if len(bars) >= min_bars:
+                    results[symbol] = bars
+            fallback = [symbol for symbol in fallback if symbol not in results]
+        
+        if fallback:
+            results.update(await self.fetch_stooq_bars_many(fallback, interval))
+        
+        return results
+    
+    async def _request_stooq_bars(self, symbol: str, interval: int) -> BarArrays:
+        """Request intraday bars from Stooq."""
+        url = f"{settings.STOOQ_BASE_URL}/d/l/?s={symbol}&i={interval}"
+        
+        async def request():
             async with self.session.get(url) as response:
+                self._check_source_status(response)
                 if response.status == 200:
-                    text = await response.text()
-                    
-                    # Parse CSV response
-                    reader = csv.DictReader(io.StringIO(text))
-                    bars = []
-                    
-                    for row in reader:
-                        if all(key in row for key in ['Date', 'Time', 'Open', 'High', 'Low', 'Close']):
-                            try:
-                                bar = {
-                                    "symbol": symbol,
-                                    "datetime": f"{row['Date']} {row['Time']}",
-                                    "open": float(row['Open']),
-                                    "high": float(row['High']),
-                                    "low": float(row['Low']),
-                                    "close": float(row['Close']),
-                                    "volume": float(row.get('Volume', 0)),
-                                    "source": "stooq"
-                                }
-                                bars.append(bar)
-                            except (ValueError, KeyError):
-                                continue
-                    
-                    # Cache bars
-                    await self.redis_client.set_cached_response(
-                        cache_key,
-                        json.dumps(bars),
-                        ttl=300  # 5 minutes for bars
-                    )
+                    # Stream-parse the CSV body straight into arrays
+                    parser = StooqBarParser()
+                    async for chunk in response.content.iter_chunked(
+                        settings.STOOQ_CSV_CHUNK_BYTES
+                    ):
+                        parser.feed(chunk)
                     
+                    bars = parser.finish()
+                    if parser.rows_skipped:
+                        logger.debug(
+                            f"Skipped {parser.rows_skipped} malformed Stooq bar rows for {symbol}"
+                        )
                     return bars
-                
-        except Exception as e:
-            logger.error(f"Error fetching Stooq bars for {symbol}: {e}")
         
-        return []
+        bars = await self._call_source(
+            "stooq", request, self.stooq_limiter, f"Stooq bars for {symbol}"
+        )
+        return bars if bars is not None else BarArrays.empty()
     
     async def fetch_yahoo_quote(self, symbol: str) -> Optional[Dict]:
         """
@@ -195,50 +346,71 @@ class MarketDataClient:
         Args:
             symbol: Yahoo symbol (e.g., "AAPL")
         """
+        # Check L1, then Redis
+        cache_key = self._yahoo_cache_key(symbol)
+        cached = self.quote_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        cached = await self.redis_client.get_cached_response(cache_key)
+        if cached:
+            data = json.loads(cached)
+            self.quote_cache.set(cache_key, data, self.source_ttls["yahoo"], symbol=symbol)
+            return data
+        
+        data = await self._request_yahoo_quote(symbol)
+        if data:
+            await self.redis_client.set_cached_response(
+                cache_key,
+                json.dumps(data),
+                ttl=self.source_ttls["yahoo"]
+            )
+        return data
+    
+    async def _request_yahoo_quote(self, symbol: str, hedged: bool = False) -> Optional[Dict]:
+        """
+        Request a quote from Yahoo Finance and store it in the L1 cache.
+        
+        A hedged request counts against the Yahoo rate limit like any other,
+        but is skipped rather than delayed when the quota is used up.
+        """
         # Convert symbol format if needed
         yahoo_symbol = symbol.upper().replace('.US', '')
         
         url = f"{settings.YAHOO_BASE_URL}/quote?symbols={yahoo_symbol}"
+        cache_key = self._yahoo_cache_key(symbol)
         
-        # Check cache
-        cache_key = f"yahoo_quote:{yahoo_symbol}"
-        cached = await self.redis_client.get_cached_response(cache_key)
-        if cached:
-            return json.loads(cached)
-        
-        try:
-            await self.yahoo_limiter.acquire()
-            
+        async def request():
             async with self.session.get(url) as response:
+                self._check_source_status(response)
                 if response.status == 200:
-                    data = await response.json()
-                    
-                    if 'quoteResponse' in data and 'result' in data['quoteResponse']:
-                        quotes = data['quoteResponse']['result']
-                        if quotes:
-                            quote = quotes[0]
-                            
-                            result = {
-                                "symbol": quote.get('symbol'),
-                                "last_price": quote.get('regularMarketPrice'),
-                                "high": quote.get('regularMarketDayHigh'),
-                                "low": quote.get('regularMarketDayLow'),
-                                "volume": quote.get('regularMarketVolume'),
-                                "timestamp": datetime.utcnow().isoformat(),
-                                "source": "yahoo"
-                            }
-                            
-                            # Cache response
-                            await self.redis_client.set_cached_response(
-                                cache_key,
-                                json.dumps(result),
-                                ttl=180  # 3 minutes for Yahoo
-                            )
-                            
-                            return result
+                    return await response.json()
+        
+        data = await self._call_source(
+            "yahoo", request, self.yahoo_limiter, f"Yahoo quote for {yahoo_symbol}",
+            wait_for_quota=not hedged
+        )
+        
+        if data and 'quoteResponse' in data and 'result' in data['quoteResponse']:
+            quotes = data['quoteResponse']['result']
+            if quotes:
+                quote = quotes[0]
                 
-        except Exception as e:
-            logger.error(f"Error fetching Yahoo quote for {yahoo_symbol}: {e}")
+                result = {
+                    "symbol": quote.get('symbol'),
+                    "last_price": quote.get('regularMarketPrice'),
+                    "high": quote.get('regularMarketDayHigh'),
+                    "low": quote.get('regularMarketDayLow'),
+                    "volume": quote.get('regularMarketVolume'),
+                    "timestamp": datetime.utcnow().isoformat(),
+                    "source": "yahoo"
+                }
+                
+                self.quote_cache.set(
+                    cache_key, result, self.source_ttls["yahoo"], symbol=symbol
+                )
+                
+                return result
         
         return None
     
@@ -252,45 +424,100 @@ class MarketDataClient:
         fmp_symbol = symbol.upper().replace('.US', '')
         url = f"{settings.FMP_BASE_URL}/profile/{fmp_symbol}?apikey={settings.FMP_API_KEY}"
         
-        # Check cache (longer TTL for fundamentals)
+        # Check L1, then Redis (longer TTL for fundamentals)
         cache_key = f"fmp_profile:{fmp_symbol}"
+        cached = self.quote_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         cached = await self.redis_client.get_cached_response(cache_key)
         if cached:
-            return json.loads(cached)
+            data = json.loads(cached)
+            self.quote_cache.set(cache_key, data, self.source_ttls["fmp"])
+            return data
         
-        try:
+        async def request():
             async with self.session.get(url) as response:
+                self._check_source_status(response)
                 if response.status == 200:
-                    data = await response.json()
-                    
-                    if data and isinstance(data, list) and len(data) > 0:
-                        profile = data[0]
-                        
-                        result = {
-                            "symbol": profile.get('symbol'),
-                            "company_name": profile.get('companyName'),
-                            "sector": profile.get('sector'),
-                            "industry": profile.get('industry'),
-                            "market_cap": profile.get('mktCap'),
-                            "beta": profile.get('beta'),
-                            "timestamp": datetime.utcnow().isoformat(),
-                            "source": "fmp"
-                        }
-                        
-                        # Cache for 24 hours
-                        await self.redis_client.set_cached_response(
-                            cache_key,
-                            json.dumps(result),
-                            ttl=86400
-                        )
-                        
-                        return result
-                
-        except Exception as e:
-            logger.error(f"Error fetching FMP profile for {fmp_symbol}: {e}")
+                    return await response.json()
+        
+        data = await self._call_source("fmp", request, None, f"FMP profile for {fmp_symbol}")
+        
+        if data and isinstance(data, list) and len(data) > 0:
+            profile = data[0]
+            
+            result = {
+                "symbol": profile.get('symbol'),
+                "company_name": profile.get('companyName'),
+                "sector": profile.get('sector'),
+                "industry": profile.get('industry'),
+                "market_cap": profile.get('mktCap'),
+                "beta": profile.get('beta'),
+                "timestamp": datetime.utcnow().isoformat(),
+                "source": "fmp"
+            }
+            
+            # Cache for 24 hours
+            await self.redis_client.set_cached_response(
+                cache_key,
+                json.dumps(result),
+                ttl=self.source_ttls["fmp"]
+            )
+            # Fundamentals are not tagged, so ticks don't evict them
+            self.quote_cache.set(cache_key, result, self.source_ttls["fmp"])
+            
+            return result
         
         return None
     
+    async def _call_source(
+        self,
+        source: str,
+        request: Callable[[], Awaitable[Any]],
+        limiter: Optional[RateLimiter],
+        description: str,
+        wait_for_quota: bool = True
+    ) -> Optional[Any]:
+        """
+        Run one upstream request under the source's circuit breaker.
+        
+        Skips the call while the circuit is open, enforces the per-source
+        timeout and records latency or failure. Returns None on any failure.
+        Without `wait_for_quota` (hedged backups) the call is also skipped
+        when the source's rate limit window is full, instead of waiting.
+        """
+        health = self.health[source]
+        if not health.allow_request():
+            return None
+        if limiter and not wait_for_quota and not limiter.try_acquire():
+            logger.debug(f"Skipping {description}: {source} quota exhausted")
+            return None
+        
+        try:
+            if limiter and wait_for_quota:
+                await limiter.acquire()
+            
+            start = time.perf_counter()
+            result = await asyncio.wait_for(request(), health.timeout_seconds)
+        except asyncio.CancelledError:
+            # Lost a hedge race
+            health.record_cancelled()
+            raise
+        except Exception as e:
+            health.record_failure()
+            logger.error(f"Error fetching {description}: {e!r}")
+            return None
+        
+        health.record_success(time.perf_counter() - start)
+        return result
+    
+    @staticmethod
+    def _check_source_status(response: aiohttp.ClientResponse):
+        """Treat server errors and throttling as source failures."""
+        if response.status >= 500 or response.status == 429:
+            response.raise_for_status()
+    
     def _parse_volume(self, volume_str: str) -> Optional[float]:
         """Parse volume string like '42.3m' to float."""
         if not volume_str:
@@ -315,21 +542,209 @@ class MarketDataClient:
         
         Priority:
         1. Stooq (primary)
-        2. Yahoo Finance (fallback)
+        2. Yahoo Finance (fallback, hedged in when Stooq is slow or failing)
         3. FMP (enrichment)
+        
+        Served from the in-process cache when possible; stale entries are
+        returned immediately and refreshed in the background.
         """
-        # Try Stooq first
-        stooq_data = await self.fetch_stooq_quote(symbol)
+        if self.scheduler:
+            self.scheduler.note_lookups([symbol])
+        
+        cache_key = f"market_data:{symbol.lower()}"
+        cached = self.quote_cache.get_or_revalidate(
+            cache_key, lambda: self._load_market_data(symbol)
+        )
+        if cached is not None:
+            return cached
+        
+        return await self._load_market_data(symbol)
+    
+    async def get_market_data_many(self, symbols: List[str]) -> Dict[str, Optional[Dict]]:
+        """
+        Get market data for several symbols.
+        
+        L1 hits are served in-process; every remaining symbol costs one shared
+        MGET of the Stooq/Yahoo quote caches, and quotes fetched upstream are
+        written back to Redis in one pipeline.
+        """
+        if self.scheduler:
+            self.scheduler.note_lookups(symbols)
+        
+        results = {}
+        missing = []
+        
+        for symbol in dict.fromkeys(symbols):
+            cached = self.quote_cache.get_or_revalidate(
+                f"market_data:{symbol.lower()}",
+                lambda symbol=symbol: self._load_market_data(symbol)
+            )
+            if cached is not None:
+                results[symbol] = cached
+            else:
+                missing.append(symbol)
+        
+        if missing:
+            results.update(await self._load_many(missing))
+        
+        return results
+    
+    async def _load_many(self, missing: List[str]) -> Dict[str, Optional[Dict]]:
+        """Resolve quotes from Redis/upstream (skipping L1) and populate L1."""
+        results = {}
+        keys = []
+        for symbol in missing:
+            keys.append(f"stooq_quote:{symbol}")
+            keys.append(self._yahoo_cache_key(symbol))
+        cached = await self.redis_client.mget_cached(keys)
+        
+        to_fetch = []
+        for i, symbol in enumerate(missing):
+            stooq_data = json.loads(cached[2 * i]) if cached[2 * i] else None
+            yahoo_data = json.loads(cached[2 * i + 1]) if cached[2 * i + 1] else None
+            if stooq_data:
+                self.quote_cache.set(
+                    f"stooq_quote:{symbol}", stooq_data, self.source_ttls["stooq"], symbol=symbol
+                )
+            if yahoo_data:
+                self.quote_cache.set(
+                    self._yahoo_cache_key(symbol), yahoo_data, self.source_ttls["yahoo"], symbol=symbol
+                )
+            
+            if stooq_data and self._is_data_fresh(stooq_data, max_age_minutes=3):
+                results[symbol] = stooq_data
+            elif yahoo_data:
+                results[symbol] = yahoo_data
+            else:
+                to_fetch.append((symbol, stooq_data))
+        
+        if to_fetch:
+            resolved = await asyncio.gather(
+                *(self._resolve_upstream(symbol, stooq_data) for symbol, stooq_data in to_fetch)
+            )
+            writes = {}
+            for (symbol, _), (data, symbol_writes) in zip(to_fetch, resolved):
+                results[symbol] = data
+                writes.update(symbol_writes)
+            await self.redis_client.mset_cached_with_ttl(writes)
+        
+        for symbol in missing:
+            if results.get(symbol):
+                self._cache_market_data(symbol, results[symbol])
+            else:
+                results[symbol] = None
+        
+        return results
+    
+    async def poll_market_data_many(self, symbols: List[str]) -> Dict[str, Optional[Dict]]:
+        """
+        Fetch fresh quotes upstream for the poller, bypassing the caches.
+        
+        The poller decides when a symbol needs a new quote, so cached values
+        would only hide updates. Redis cache writes go out in one pipeline.
+        """
+        symbols = list(dict.fromkeys(symbols))
+        resolved = await asyncio.gather(
+            *(self._resolve_upstream(symbol, None) for symbol in symbols)
+        )
+        
+        results = {}
+        writes = {}
+        for symbol, (data, symbol_writes) in zip(symbols, resolved):
+            results[symbol] = data
+            writes.update(symbol_writes)
+        await self.redis_client.mset_cached_with_ttl(writes)
+        
+        return results
+    
+    async def _load_market_data(self, symbol: str) -> Optional[Dict]:
+        """Load market data from Redis/upstream and populate the L1 cache."""
+        return (await self._load_many([symbol]))[symbol]
+    
+    async def _resolve_upstream(
+        self,
+        symbol: str,
+        stooq_data: Optional[Dict]
+    ) -> Tuple[Optional[Dict], Dict[str, Tuple[str, int]]]:
+        """
+        Resolve a quote from the upstream sources without touching Redis.
+        
+        Returns the quote plus the Redis cache writes it produced, so batch
+        callers can flush all writes in one pipeline.
+        """
+        if not stooq_data:
+            # Stooq first, hedged to Yahoo if Stooq is slow, failing or open
+            data = await hedged_request(
+                [
+                    (self.health["stooq"], lambda: self._request_stooq_quote(symbol)),
+                    (self.health["yahoo"], lambda: self._request_yahoo_quote(symbol, hedged=True)),
+                ],
+                accept=lambda quote: quote.get("source") != "stooq"
+                or self._is_data_fresh(quote, max_age_minutes=3)
+            )
+        else:
+            # Cached Stooq quote is stale
+            logger.info(f"Using Yahoo fallback for {symbol}")
+            data = await self._request_yahoo_quote(symbol) or stooq_data
+        
+        writes = {}
+        if data and data is not stooq_data:
+            if data.get("source") == "yahoo":
+                writes[self._yahoo_cache_key(symbol)] = (json.dumps(data), self.source_ttls["yahoo"])
+            else:
+                writes[f"stooq_quote:{symbol}"] = (json.dumps(data), self.source_ttls["stooq"])
         
-        # Check if Stooq data is recent enough
-        if stooq_data and self._is_data_fresh(stooq_data, max_age_minutes=3):
-            return stooq_data
+        return data, writes
+    
+    @staticmethod
+    def _yahoo_cache_key(symbol: str) -> str:
+        """Redis/L1 cache key for a Yahoo quote."""
+        return f"yahoo_quote:{symbol.upper().replace('.US', '')}"
+    
+    def _cache_market_data(self, symbol: str, data: Dict):
+        """Store a resolved quote in the L1 cache with its source TTL."""
+        ttl = self.source_ttls.get(data.get("source"), settings.REDIS_CACHE_TTL_SECONDS)
+        self.quote_cache.set(f"market_data:{symbol.lower()}", data, ttl, symbol=symbol)
+    
+    def watch_ticks(self, consumer: TickStreamConsumer):
+        """
+        Keep the L1 cache current from the tick stream.
         
-        # Fallback to Yahoo
-        logger.info(f"Using Yahoo fallback for {symbol}")
-        yahoo_data = await self.fetch_yahoo_quote(symbol)
+        Every node runs the consumer, so each one invalidates its own L1
+        whichever node polled the tick. Cached symbols count as consumer
+        interest, so in per-symbol mode the node reads their streams too.
+        """
+        self.quote_cache.on_symbol_added = lambda symbol: consumer.add_interest([symbol])
+        self.quote_cache.on_symbol_removed = lambda symbol: consumer.remove_interest([symbol])
+        consumer.add_handler(self.on_tick_entries)
+        # Deltas only apply on top of a stream read without gaps
+        consumer.add_release_handler(self.published.forget)
+    
+    async def on_tick_entries(self, entries: List[Tuple[str, Dict[str, str]]]):
+        """Fold one batch from the tick stream into the published quotes and the L1 cache."""
+        for _, fields in entries:
+            symbol = fields.get("symbol")
+            if not symbol:
+                continue
+            quote = self.published.apply(
+                symbol, fields.get("kind", SNAPSHOT), json.loads(fields.get("data", "{}"))
+            )
+            if quote is None:
+                # A delta before this node read a snapshot: the next lookup reloads from Redis
+                self.quote_cache.invalidate_symbol(symbol)
+            else:
+                self.on_tick(symbol, dict(quote))
+    
+    def on_tick(self, symbol: str, data: Dict):
+        """
+        Apply a full tick to the L1 cache.
         
-        return yahoo_data or stooq_data
+        Any cached quote for the symbol is superseded by the tick, so it
+        becomes the new market data entry and the symbol's other entries are
+        dropped. Replacing before dropping keeps the symbol cached throughout.
+        """
+        self._cache_market_data(symbol, data)
+        self.quote_cache.invalidate_symbol(symbol, keep=f"market_data:{symbol.lower()}")
     
     def _is_data_fresh(self, data: Dict, max_age_minutes: int = 3) -> bool:
         """Check if data is fresh enough."""
@@ -342,82 +757,271 @@ class MarketDataClient:
 
 
 class DataService:
-    """Main data service orchestrator."""
+    """
+    Main data service orchestrator.
+    
+    Every node runs it, but only the holder of the poller lease polls,
+    publishes ticks, aggregates bars and runs history maintenance; the
+    others consume the tick streams. Each node reports its poll demand
+    (subscriptions and lookups) through Redis so the poller covers it.
+    """
     
     def __init__(self):
         self.client = MarketDataClient()
+        self.client.watch_ticks(tick_stream_consumer)
+        self.scheduler = create_poll_scheduler()
+        self.client.scheduler = self.scheduler
+        self.writer = create_market_data_writer()
+        self.aggregator = self._create_aggregator()
+        self.lease = PollerLease(ttl_seconds=settings.POLLER_LEASE_SECONDS)
         self.running = False
         self.redis_client = None
+        self._coordination_task: Optional[asyncio.Task] = None
+        self._poll_task: Optional[asyncio.Task] = None
+        self._bar_close_task: Optional[asyncio.Task] = None
+        self._tick_sources: Dict[str, str] = {}
+        self.tick_tracker = TickDeltaTracker(settings.TICK_SNAPSHOT_INTERVAL_SECONDS)
     
-    async def start(self):
-        """Start the data service."""
+    @staticmethod
+    def _create_aggregator() -> BarAggregator:
+        return BarAggregator(
+            intervals=settings.BAR_INTERVALS_SECONDS,
+            history_length=settings.BAR_HISTORY_LENGTH
+        )
+    
+    @property
+    def polling(self) -> bool:
+        """Whether this node is the poller."""
+        return self._poll_task is not None
+    
+    async def start(self, node_id: str):
+        """Start the data service; it polls while `node_id` holds the poller lease."""
         await self.client.start()
         self.redis_client = await get_redis()
+        await self.writer.start()
+        await bar_archive.start()
+        self.lease.node_id = node_id
         self.running = True
         
-        # Start the polling loop
-        asyncio.create_task(self._polling_loop())
+        self._coordination_task = asyncio.create_task(self._coordination_loop())
         logger.info("Data service started")
     
     async def stop(self):
-        """Stop the data service."""
+        """Stop the data service, draining buffered writes and handing the lease over."""
         self.running = False
+        if self._coordination_task:
+            self._coordination_task.cancel()
+            try:
+                await self._coordination_task
+            except asyncio.CancelledError:
+                pass
+            self._coordination_task = None
+        await self._stop_polling()
+        if self.redis_client:
+            await self.lease.release(self.redis_client.redis)
+        await self.writer.stop()
+        await bar_archive.stop()
         await self.client.stop()
         logger.info("Data service stopped")
     
+    async def _coordination_loop(self):
+        """Renew the poller lease, poll while holding it, and share poll demand."""
+        interval = min(settings.POLL_DEMAND_SYNC_SECONDS, self.lease.ttl_seconds / 3)
+        
+        while self.running:
+            try:
+                if await self.lease.renew(self.redis_client.redis):
+                    await self._start_polling()
+                else:
+                    await self._stop_polling()
+                await self._sync_demand(time.time(), interval)
+            except Exception as e:
+                logger.error(f"Error coordinating data service: {e}")
+            await asyncio.sleep(interval)
+    
+    async def _sync_demand(self, now: float, interval: float):
+        """Report this node's poll demand; the poller reads everyone's."""
+        subscribed, lookups = self.scheduler.local_demand(now)
+        await self.redis_client.publish_poll_demand(subscribed, lookups, now)
+        if self.polling:
+            subscribed, lookups = await self.redis_client.get_poll_demand(
+                subscribed_since=now - 3 * interval,
+                looked_up_since=now - settings.POLL_LOOKUP_TTL_SECONDS
+            )
+            self.scheduler.set_cluster_demand(subscribed, lookups)
+    
+    async def _start_polling(self):
+        """Become the poller: start the polling, bar-closing and history maintenance loops."""
+        if self.polling:
+            return
+        # Another node may have polled since: publish snapshots first, build bars afresh
+        self.tick_tracker = TickDeltaTracker(settings.TICK_SNAPSHOT_INTERVAL_SECONDS)
+        self.aggregator = self._create_aggregator()
+        self._tick_sources = {}
+        await history_store.start()
+        self._poll_task = asyncio.create_task(self._polling_loop())
+        self._bar_close_task = asyncio.create_task(self._bar_close_loop())
+    
+    async def _stop_polling(self):
+        """Stop polling, e.g. after losing the lease; the node keeps consuming ticks."""
+        if not self.polling:
+            return
+        for task in (self._poll_task, self._bar_close_task):
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._poll_task = None
+        self._bar_close_task = None
+        await history_store.stop()
+        # Published state is now the new poller's; readers fall back to the tick stream
+        self.tick_tracker = TickDeltaTracker(settings.TICK_SNAPSHOT_INTERVAL_SECONDS)
+    
     async def _polling_loop(self):
         """Main polling loop for market data."""
         logger.info("Starting market data polling loop")
         
+        positions_refreshed_at = 0.0
+        
         while self.running:
             try:
-                # Poll each ticker
-                for symbol in settings.DEFAULT_TICKERS:
-                    if not self.running:
-                        break
+                now = time.time()
+                if now - positions_refreshed_at >= settings.POLL_POSITIONS_REFRESH_SECONDS:
+                    await self._refresh_position_symbols()
+                    positions_refreshed_at = now
+                
+                # Poll only the symbols the scheduler says are due
+                due = self.scheduler.due(now)
+                if due:
+                    quotes = await self.client.poll_market_data_many(due)
+                    ticks = {symbol: data for symbol, data in quotes.items() if data}
+                    self.scheduler.mark_polled(due, ticks, now)
+                    
+                    # Publish only what changed (plus periodic snapshots) in one pipeline
+                    updates = self.tick_tracker.diff(ticks, now)
+                    await self.redis_client.publish_ticks(
+                        {symbol: payload for symbol, (kind, payload) in updates.items()},
+                        kinds={symbol: kind for symbol, (kind, payload) in updates.items()}
+                    )
+                    
+                    # The L1 cache follows the tick stream (watch_ticks), like every node's
+                    for symbol, data in ticks.items():
+                        self._aggregate_tick(symbol, data)
                     
-                    data = await self.client.get_market_data(symbol)
-                    if data:
-                        # Publish to Redis streams
-                        await self.redis_client.publish_tick(symbol, data)
-                        
-                        # Store in database (optional, for historical analysis)
-                        await self._store_market_data(data)
+                    # Persist bars closed by these ticks and push running bar state
+                    await self._flush_bars(ticks.keys())
+                    
+                    # Evict forecasts/optimizations built on prices that have moved
+                    moved = derived_cache.material_moves(
+                        {symbol: data.get('last_price') for symbol, data in ticks.items()}
+                    )
+                    if moved:
+                        await derived_cache.invalidate(moved)
                 
-                # Wait before next poll
-                await asyncio.sleep(settings.DATA_POLL_INTERVAL_SECONDS)
+                # Sleep until the next symbol is due
+                await asyncio.sleep(self.scheduler.seconds_until_next())
                 
             except Exception as e:
                 logger.error(f"Error in polling loop: {e}")
                 await asyncio.sleep(5)  # Short sleep on error
     
-    async def _store_market_data(self, data: Dict):
-        """Store market data in database."""
+    async def _refresh_position_symbols(self):
+        """Load the symbols held in open positions into the scheduler."""
         try:
             async with async_session_maker() as session:
-                market_data = MarketData(
-                    symbol=data.get('symbol'),
-                    timestamp=datetime.utcnow(),
-                    open_price=data.get('last_price', 0),  # Simplified for quotes
-                    high_price=data.get('high', 0),
-                    low_price=data.get('low', 0),
-                    close_price=data.get('last_price', 0),
-                    volume=data.get('volume', 0),
-                    source=data.get('source', 'unknown')
+                result = await session.execute(
+                    select(Position.symbol).where(Position.quantity != 0).distinct()
                 )
-                session.add(market_data)
-                await session.commit()
+                self.scheduler.set_positions(result.scalars().all())
         except Exception as e:
-            logger.error(f"Error storing market data: {e}")
+            logger.error(f"Error loading position symbols: {e}")
+    
+    def _aggregate_tick(self, symbol: str, data: Dict):
+        """Feed a polled quote into the bar aggregator."""
+        try:
+            timestamp = datetime.fromisoformat(data.get('timestamp', '')).replace(
+                tzinfo=UTC
+            ).timestamp()
+        except (ValueError, TypeError):
+            return
+        
+        if self.aggregator.add_tick(symbol, data.get('last_price'), timestamp, data.get('volume')):
+            self._tick_sources[symbol.lower()] = data.get('source', 'unknown')
+    
+    async def _bar_close_loop(self):
+        """Close bars on wall-clock boundaries even when no ticks arrive."""
+        base_interval = self.aggregator.intervals[0]
+        
+        while self.running:
+            try:
+                # Wake just after the next boundary of the shortest interval
+                now = time.time()
+                await asyncio.sleep(base_interval - now % base_interval + 0.5)
+                
+                if self.aggregator.close_due(time.time()):
+                    await self._flush_bars()
+            
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error closing bars: {e}")
+    
+    async def _flush_bars(self, updated_symbols=()):
+        """
+        Persist completed bars and publish bar updates.
+        
+        Completed bars are appended to their Redis series in one pipeline,
+        base-interval bars go to market_data through the write-behind buffer,
+        every completed bar is buffered for the on-disk archive, and closed
+        plus running bars are published on the `bars` channel in one pipeline.
+        """
+        completed = self.aggregator.drain_completed()
+        base_interval = self.aggregator.intervals[0]
+        
+        updates = [dict(bar.to_dict(), closed=True) for bar in completed]
+        for symbol in updated_symbols:
+            for interval in self.aggregator.intervals:
+                running = self.aggregator.running_bar(symbol, interval)
+                if running:
+                    updates.append(dict(running, closed=False))
+        
+        if completed:
+            closed: Dict[Tuple[str, int], List[Dict]] = {}
+            for bar in completed:
+                closed.setdefault((bar.symbol, bar.interval), []).append(dict(bar.to_dict(), time=bar.start))
+            await self.redis_client.append_market_bars({
+                key: BarArrays.from_dicts(bars) for key, bars in closed.items()
+            })
+            
+            for bar in completed:
+                bar_archive.add(
+                    bar.symbol, bar.interval, bar.start,
+                    bar.open, bar.high, bar.low, bar.close, bar.volume
+                )
+                if bar.interval == base_interval:
+                    await self.writer.enqueue({
+                        "symbol": bar.symbol.upper(),
+                        "timestamp": datetime.utcfromtimestamp(bar.start),
+                        "open_price": bar.open,
+                        "high_price": bar.high,
+                        "low_price": bar.low,
+                        "close_price": bar.close,
+                        "volume": bar.volume,
+                        "source": self._tick_sources.get(bar.symbol, 'unknown'),
+                        "interval_seconds": bar.interval
+                    })
+        
+        await self.redis_client.publish_bar_updates(updates)
 
 
 # Global data service instance
 data_service = DataService()
 
 
-async def start_data_service():
+async def start_data_service(node_id: str):
     """Start the global data service."""
-    await data_service.start()
+    await data_service.start(node_id)
 
 
 async def stop_data_service():
@@ -0,0 +1,137 @@
+"""
+Derived Cache - Dependency-tracked caching of forecasts, stress and optimization results
+
+Every cached result records the dependencies it was computed from (symbols,
+or tokens such as `model:{symbol}`) together with each dependency's version
+at the time the inputs were read. A result is served only while all of its
+versions are current, so entries can carry long TTLs.
+
+When a symbol's price moves materially, its version is bumped and exactly the
+results indexed under it are deleted; everything else stays cached. The
+next request recomputes on demand.
+
+Usage:
+    versions = await derived_cache.versions(["aapl.us"])   # before reading inputs
+    ... compute ...
+    await derived_cache.set(key, result, versions)
+"""
+
+import json
+from typing import Any, Dict, Iterable, List, Optional
+
+from loguru import logger
+
+from app.core.config import settings
+from app.core.redis_client import get_redis
+
+
+class DerivedCache:
+    """Version-checked cache of derived results with per-dependency invalidation."""
+
+    def __init__(self, ttl: int = 21600, move_threshold: float = 0.005):
+        self.ttl = ttl
+        self.move_threshold = move_threshold
+        self.redis_client = None
+        self._reference_prices: Dict[str, float] = {}
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.invalidations = 0
+        self.evicted = 0
+
+    async def versions(self, dependencies: Iterable[str]) -> Dict[str, int]:
+        """Current versions; capture these before reading the inputs of a result."""
+        redis_client = await self._redis()
+        return await redis_client.get_data_versions(list(dict.fromkeys(dependencies)))
+
+    async def get(self, key: str) -> Optional[Any]:
+        """The cached value, or None if missing or computed from outdated data."""
+        redis_client = await self._redis()
+        raw = await redis_client.get_cached_response(key)
+        if not raw:
+            self.misses += 1
+            return None
+
+        try:
+            entry = json.loads(raw)
+            recorded = entry["deps"]
+            value = entry["value"]
+        except (ValueError, KeyError, TypeError):
+            self.misses += 1
+            return None
+
+        current = await redis_client.get_data_versions(list(recorded))
+        if any(current.get(dep) != version for dep, version in recorded.items()):
+            # Written after an invalidation from inputs read before it
+            self.stale += 1
+            return None
+
+        self.hits += 1
+        return value
+
+    async def set(self, key: str, value: Any, versions: Dict[str, int], ttl: Optional[int] = None):
+        """Cache a JSON-serializable value computed at the given dependency versions."""
+        redis_client = await self._redis()
+        payload = json.dumps({"value": value, "deps": versions}, default=str)
+        await redis_client.set_derived(key, payload, list(versions), ttl or self.ttl)
+
+    async def invalidate(self, dependencies: Iterable[str]) -> int:
+        """Evict every result that depends on any of the given dependencies."""
+        dependencies = list(dict.fromkeys(dep.lower() for dep in dependencies))
+        if not dependencies:
+            return 0
+        redis_client = await self._redis()
+        evicted = await redis_client.invalidate_derived(dependencies)
+        self.invalidations += len(dependencies)
+        self.evicted += evicted
+        if evicted:
+            logger.debug(f"Invalidated {evicted} derived results for {dependencies}")
+        return evicted
+
+    def material_moves(self, prices: Dict[str, Optional[float]]) -> List[str]:
+        """
+        Symbols whose price moved at least move_threshold since their last
+        invalidation (the first observed price only sets the reference).
+        """
+        moved = []
+        for symbol, price in prices.items():
+            if not price:
+                continue
+            symbol = symbol.lower()
+            reference = self._reference_prices.get(symbol)
+            if reference is None:
+                self._reference_prices[symbol] = price
+            elif abs(price - reference) / reference >= self.move_threshold:
+                self._reference_prices[symbol] = price
+                moved.append(symbol)
+        return moved
+
+    def get_stats(self) -> Dict:
+        lookups = self.hits + self.misses + self.stale
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "evicted": self.evicted,
+            "tracked_symbols": len(self._reference_prices),
+            "move_threshold": self.move_threshold
+        }
+
+    async def _redis(self):
+        return self.redis_client or await get_redis()
+
+
+# Global derived-result cache
+derived_cache = DerivedCache(
+    ttl=settings.DERIVED_CACHE_TTL_SECONDS,
+    move_threshold=settings.DERIVED_INVALIDATION_MOVE
+)
+
+
+def get_derived_cache() -> DerivedCache:
+    """Get the derived-result cache."""
+    return derived_cache
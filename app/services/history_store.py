@@ -0,0 +1,357 @@
+"""
+History Store - Range queries and lifecycle for the market_data table
+
+market_data is range-partitioned by month on `timestamp` and indexed on
+(symbol, timestamp), so a "symbol over a time window" read touches only the
+relevant partitions and index range. This module is the single read path for
+that table: queries return columnar BarArrays, optionally re-bucketed to a
+coarser interval in SQL.
+
+A maintenance task keeps partitions created ahead of time, rolls old base
+bars up into coarser bars and drops partitions past retention.
+"""
+
+import asyncio
+import calendar
+import re
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg
+
+from app.core.bar_codec import BarArrays
+from app.core.config import settings
+from app.core.database import MarketData, async_session_maker
+
+
+PARTITION_NAME = re.compile(r"^market_data_(\d{4})_(\d{2})$")
+
+ROLLUP_SQL = text("""
+    WITH moved AS (
+        DELETE FROM market_data
+        WHERE timestamp < :before AND interval_seconds < :interval
+        RETURNING symbol, timestamp, open_price, high_price, low_price,
+                  close_price, volume, source
+    )
+    INSERT INTO market_data (symbol, timestamp, open_price, high_price, low_price,
+                             close_price, volume, source, interval_seconds)
+    SELECT symbol,
+           to_timestamp(floor(extract(epoch FROM timestamp) / :interval) * :interval)
+               AT TIME ZONE 'UTC' AS bucket,
+           (array_agg(open_price ORDER BY timestamp))[1],
+           max(high_price),
+           min(low_price),
+           (array_agg(close_price ORDER BY timestamp DESC))[1],
+           sum(volume),
+           min(source),
+           :interval
+    FROM moved
+    GROUP BY symbol, bucket
+""")
+
+
+class HistoryStore:
+    """Typed reads and partition/retention maintenance for market_data."""
+
+    def __init__(self, session_maker=async_session_maker):
+        self._session_maker = session_maker
+        self._task: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.queries = 0
+        self.rows_read = 0
+        self.rows_rolled_up = 0
+        self.partitions_created = 0
+        self.partitions_dropped = 0
+        self.last_maintenance: Optional[datetime] = None
+
+    async def get_range(
+        self,
+        symbol: str,
+        start: datetime,
+        end: Optional[datetime] = None,
+        interval_seconds: Optional[int] = None
+    ) -> BarArrays:
+        """Bars for one symbol in [start, end); see get_range_many."""
+        return (await self.get_range_many([symbol], start, end, interval_seconds))[symbol]
+
+    async def get_range_many(
+        self,
+        symbols: Sequence[str],
+        start: datetime,
+        end: Optional[datetime] = None,
+        interval_seconds: Optional[int] = None
+    ) -> Dict[str, BarArrays]:
+        """
+        Bars for several symbols in [start, end) with one query.
+
+        With `interval_seconds`, rows are re-bucketed to that width in SQL
+        (first open, max high, min low, last close, summed volume).
+        Symbols without rows map to empty bars.
+        """
+        symbols = list(dict.fromkeys(symbols))
+        results = {symbol: BarArrays.empty() for symbol in symbols}
+        if not symbols:
+            return results
+
+        # Stored symbols are upper-case ("AAPL.US"); callers use either form
+        by_stored = {symbol.upper(): symbol for symbol in symbols}
+
+        if interval_seconds:
+            bucket = (
+                func.floor(func.extract("epoch", MarketData.timestamp) / interval_seconds)
+                * interval_seconds
+            ).label("bucket")
+            query = (
+                select(
+                    MarketData.symbol,
+                    bucket,
+                    array_agg(aggregate_order_by(MarketData.open_price, MarketData.timestamp))[1],
+                    func.max(MarketData.high_price),
+                    func.min(MarketData.low_price),
+                    array_agg(aggregate_order_by(MarketData.close_price, MarketData.timestamp.desc()))[1],
+                    func.sum(MarketData.volume)
+                )
+                # Group by the output alias so the bound interval is not repeated
+                .group_by(MarketData.symbol, text("bucket"))
+                .order_by(MarketData.symbol, bucket)
+            )
+        else:
+            query = select(
+                MarketData.symbol,
+                MarketData.timestamp,
+                MarketData.open_price,
+                MarketData.high_price,
+                MarketData.low_price,
+                MarketData.close_price,
+                MarketData.volume
+            ).order_by(MarketData.symbol, MarketData.timestamp)
+
+        query = query.where(
+            MarketData.symbol.in_(list(by_stored)),
+            MarketData.timestamp >= start
+        )
+        if end is not None:
+            query = query.where(MarketData.timestamp < end)
+
+        async with self._session_maker() as session:
+            rows = (await session.execute(query)).all()
+
+        self.queries += 1
+        self.rows_read += len(rows)
+
+        for stored_symbol, symbol_rows in groupby(rows, key=lambda row: row[0]):
+            symbol = by_stored.get(stored_symbol.upper())
+            if symbol is not None:
+                results[symbol] = _rows_to_bars(list(symbol_rows))
+
+        return results
+
+    async def get_latest(self, symbol: str, limit: int) -> BarArrays:
+        """The most recent `limit` stored bars for a symbol, oldest first."""
+        query = (
+            select(
+                MarketData.symbol,
+                MarketData.timestamp,
+                MarketData.open_price,
+                MarketData.high_price,
+                MarketData.low_price,
+                MarketData.close_price,
+                MarketData.volume
+            )
+            .where(MarketData.symbol == symbol.upper())
+            .order_by(MarketData.timestamp.desc())
+            .limit(limit)
+        )
+
+        async with self._session_maker() as session:
+            rows = (await session.execute(query)).all()
+
+        self.queries += 1
+        self.rows_read += len(rows)
+        return _rows_to_bars(rows[::-1])
+
+    async def start(self):
+        """Start the periodic maintenance task."""
+        try:
+            async with self._session_maker() as session:
+                if not await self._is_partitioned(session):
+                    logger.warning(
+                        "market_data is not partitioned; run "
+                        "migrations/001_partition_market_data.sql"
+                    )
+        except Exception as e:
+            logger.error(f"Could not check market_data partitioning: {e}")
+        self._task = asyncio.create_task(self._maintenance_loop())
+
+    async def stop(self):
+        """Stop the maintenance task."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_maintenance(self, now: Optional[datetime] = None):
+        """Create upcoming partitions, roll up old bars and apply retention."""
+        now = now or datetime.utcnow()
+        await self.ensure_partitions(now, settings.HISTORY_PARTITION_MONTHS_AHEAD)
+        await self.rollup(
+            now - timedelta(days=settings.HISTORY_ROLLUP_AFTER_DAYS),
+            settings.HISTORY_ROLLUP_INTERVAL_SECONDS
+        )
+        await self.apply_retention(now - timedelta(days=settings.HISTORY_RETENTION_DAYS))
+        self.last_maintenance = now
+
+    async def ensure_partitions(self, now: datetime, months_ahead: int) -> int:
+        """Create monthly partitions from the current month through `months_ahead`."""
+        async with self._session_maker() as session:
+            if not await self._is_partitioned(session):
+                return 0
+
+            created = 0
+            month = datetime(now.year, now.month, 1)
+            for _ in range(months_ahead + 1):
+                upper = _add_month(month)
+                name = f"market_data_{month:%Y_%m}"
+                exists = await session.scalar(
+                    text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}
+                )
+                if not exists:
+                    try:
+                        await session.execute(text(
+                            f"CREATE TABLE {name} PARTITION OF market_data "
+                            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"
+                        ))
+                        await session.commit()
+                        created += 1
+                    except Exception as e:
+                        # e.g. the default partition already holds rows for this range
+                        await session.rollback()
+                        logger.error(f"Could not create partition {name}: {e}")
+                month = upper
+
+        self.partitions_created += created
+        return created
+
+    async def rollup(self, before: datetime, interval_seconds: int) -> int:
+        """
+        Downsample bars older than `before` into `interval_seconds` bars.
+
+        The cutoff is aligned down to the interval so no bucket is split
+        between a rolled-up and a raw part.
+        """
+        epoch = calendar.timegm(before.utctimetuple())
+        before = datetime.utcfromtimestamp(epoch - epoch % interval_seconds)
+
+        async with self._session_maker() as session:
+            result = await session.execute(
+                ROLLUP_SQL, {"before": before, "interval": interval_seconds}
+            )
+            await session.commit()
+
+        rolled = result.rowcount or 0
+        self.rows_rolled_up += rolled
+        return rolled
+
+    async def apply_retention(self, cutoff: datetime) -> int:
+        """Drop monthly partitions that end before `cutoff` (DELETE if unpartitioned)."""
+        async with self._session_maker() as session:
+            if not await self._is_partitioned(session):
+                await session.execute(
+                    text("DELETE FROM market_data WHERE timestamp < :cutoff"), {"cutoff": cutoff}
+                )
+                await session.commit()
+                return 0
+
+            names = (await session.execute(text("""
+                SELECT child.relname
+                FROM pg_inherits
+                JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE parent.relname = 'market_data'
+            """))).scalars().all()
+
+            dropped = 0
+            for name in names:
+                match = PARTITION_NAME.match(name)
+                if not match:
+                    continue
+                upper = _add_month(datetime(int(match.group(1)), int(match.group(2)), 1))
+                if upper <= cutoff:
+                    await session.execute(text(f"DROP TABLE {name}"))
+                    dropped += 1
+            await session.commit()
+
+        self.partitions_dropped += dropped
+        return dropped
+
+    def get_stats(self) -> Dict:
+        """Query and maintenance metrics."""
+        return {
+            "queries": self.queries,
+            "rows_read": self.rows_read,
+            "rows_rolled_up": self.rows_rolled_up,
+            "partitions_created": self.partitions_created,
+            "partitions_dropped": self.partitions_dropped,
+            "last_maintenance": self.last_maintenance.isoformat() if self.last_maintenance else None
+        }
+
+    async def _maintenance_loop(self):
+        while True:
+            try:
+                await self.run_maintenance()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"History maintenance failed: {e}")
+            await asyncio.sleep(settings.HISTORY_MAINTENANCE_INTERVAL_SECONDS)
+
+    @staticmethod
+    async def _is_partitioned(session) -> bool:
+        return bool(await session.scalar(text("""
+            SELECT EXISTS (
+                SELECT 1 FROM pg_partitioned_table
+                WHERE partrelid = to_regclass('market_data')
+            )
+        """)))
+
+
+def _rows_to_bars(rows: List) -> BarArrays:
+    """Convert (symbol, time, open, high, low, close, volume) rows to BarArrays."""
+    if not rows:
+        return BarArrays.empty()
+    _, times, open_, high, low, close, volume = zip(*rows)
+    return BarArrays(
+        np.array([_epoch(ts) for ts in times], dtype=np.int64),
+        np.array(open_, dtype=np.float64),
+        np.array(high, dtype=np.float64),
+        np.array(low, dtype=np.float64),
+        np.array(close, dtype=np.float64),
+        np.array(volume, dtype=np.float64)
+    )
+
+
+def _epoch(value) -> int:
+    if isinstance(value, datetime):
+        return calendar.timegm(value.utctimetuple())
+    return int(value)
+
+
+def _add_month(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+# Global history store instance
+history_store = HistoryStore()
+
+
+def get_history_store() -> HistoryStore:
+    """Dependency to get history store."""
+    return history_store
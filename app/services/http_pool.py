@@ -0,0 +1,123 @@
+"""
+HTTP Pool - Shared, tuned aiohttp session for upstream data sources
+
+One ClientSession backs every upstream fetch. Its connector caps total and
+per-host connections, caches DNS lookups and keeps idle connections alive so
+polls reuse warm TLS connections. Connect and read timeouts are separate.
+
+A TraceConfig feeds HttpPoolMetrics: how often a pooled connection was
+reused versus newly opened, how long requests waited for a free connection,
+and how long new connections took to establish.
+"""
+
+import time
+from types import SimpleNamespace
+from typing import Any, Dict
+
+import aiohttp
+
+from app.core.config import settings
+
+
+class HttpPoolMetrics:
+    """Connection reuse and pool-wait metrics collected via aiohttp tracing."""
+
+    def __init__(self):
+        self.requests = 0
+        self.request_errors = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.queued = 0
+        self.queue_wait_seconds = 0.0
+        self.max_queue_wait_seconds = 0.0
+        self.connect_seconds = 0.0
+        self.requests_by_host: Dict[str, int] = {}
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """Build a TraceConfig that reports into this object."""
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(self._on_request_start)
+        trace.on_request_exception.append(self._on_request_exception)
+        trace.on_connection_queued_start.append(self._on_queued_start)
+        trace.on_connection_queued_end.append(self._on_queued_end)
+        trace.on_connection_create_start.append(self._on_create_start)
+        trace.on_connection_create_end.append(self._on_create_end)
+        trace.on_connection_reuseconn.append(self._on_reuseconn)
+        return trace
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Reuse ratio, pool wait and connect time."""
+        acquired = self.connections_created + self.connections_reused
+        return {
+            "requests": self.requests,
+            "request_errors": self.request_errors,
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+            "reuse_ratio": self.connections_reused / acquired if acquired else 0.0,
+            "queued": self.queued,
+            "avg_queue_wait_ms": self.queue_wait_seconds / self.queued * 1000 if self.queued else 0.0,
+            "max_queue_wait_ms": self.max_queue_wait_seconds * 1000,
+            "avg_connect_ms": (
+                self.connect_seconds / self.connections_created * 1000
+                if self.connections_created else 0.0
+            ),
+            "requests_by_host": dict(self.requests_by_host)
+        }
+
+    async def _on_request_start(self, session, ctx: SimpleNamespace, params):
+        self.requests += 1
+        host = params.url.host or ""
+        self.requests_by_host[host] = self.requests_by_host.get(host, 0) + 1
+
+    async def _on_request_exception(self, session, ctx: SimpleNamespace, params):
+        self.request_errors += 1
+
+    async def _on_queued_start(self, session, ctx: SimpleNamespace, params):
+        ctx.queued_at = time.monotonic()
+
+    async def _on_queued_end(self, session, ctx: SimpleNamespace, params):
+        now = time.monotonic()
+        waited = now - getattr(ctx, "queued_at", now)
+        self.queued += 1
+        self.queue_wait_seconds += waited
+        self.max_queue_wait_seconds = max(self.max_queue_wait_seconds, waited)
+
+    async def _on_create_start(self, session, ctx: SimpleNamespace, params):
+        ctx.connect_started_at = time.monotonic()
+
+    async def _on_create_end(self, session, ctx: SimpleNamespace, params):
+        now = time.monotonic()
+        self.connections_created += 1
+        self.connect_seconds += now - getattr(ctx, "connect_started_at", now)
+
+    async def _on_reuseconn(self, session, ctx: SimpleNamespace, params):
+        self.connections_reused += 1
+
+
+def create_client_session(metrics: HttpPoolMetrics) -> aiohttp.ClientSession:
+    """Build the shared upstream session from settings."""
+    connector = aiohttp.TCPConnector(
+        limit=settings.HTTP_POOL_LIMIT,
+        limit_per_host=settings.HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL_SECONDS,
+        use_dns_cache=True,
+        keepalive_timeout=settings.HTTP_KEEPALIVE_SECONDS,
+        enable_cleanup_closed=True
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=None,  # Bounded per source by the circuit breaker timeout
+        connect=settings.HTTP_CONNECT_TIMEOUT_SECONDS,  # Includes waiting for a pooled connection
+        sock_connect=settings.HTTP_CONNECT_TIMEOUT_SECONDS,
+        sock_read=settings.HTTP_READ_TIMEOUT_SECONDS
+    )
+    headers = {
+        'User-Agent': 'MKTO/1.0',
+        'Accept-Encoding': 'gzip, deflate' if settings.HTTP_COMPRESSION else 'identity'
+    }
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        headers=headers,
+        auto_decompress=True,
+        trace_configs=[metrics.trace_config()]
+    )
@@ -0,0 +1,162 @@
+"""
+Ingestion Buffer - Write-behind batching for market_data rows
+
+The poller enqueues rows instead of committing one transaction per tick. A
+background task flushes them as a single multi-row INSERT when the batch is
+full or the flush interval elapses. The queue is bounded, so producers wait
+(backpressure) when the database falls behind, and pending rows are drained
+on shutdown.
+"""
+
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+from sqlalchemy import insert
+
+from app.core.bar_codec import BarArrays
+from app.core.config import settings
+from app.core.database import MarketData, async_session_maker
+
+
+class MarketDataWriter:
+    """Buffered bulk writer for the market_data table."""
+
+    MAX_FLUSH_ATTEMPTS = 3
+
+    def __init__(
+        self,
+        max_batch_size: int = 500,
+        flush_interval_seconds: float = 5.0,
+        max_queue_size: int = 10000
+    ):
+        self.max_batch_size = max_batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        # Metrics
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.last_flush_ms = 0.0
+
+    async def start(self):
+        """Start the background flush task."""
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued, then stop."""
+        self._closing = True
+        if self._task:
+            await self._task
+            self._task = None
+        logger.info(f"Market data writer drained ({self.rows_written} rows written)")
+
+    async def enqueue(self, row: Dict[str, Any]):
+        """Queue one market_data row, waiting if the buffer is full."""
+        await self._queue.put(row)
+
+    async def enqueue_bars(self, symbol: str, bars: BarArrays, source: str, interval_seconds: int = 60):
+        """Queue columnar bars as market_data rows."""
+        columns = zip(
+            bars.time.tolist(), bars.open.tolist(), bars.high.tolist(),
+            bars.low.tolist(), bars.close.tolist(), bars.volume.tolist()
+        )
+        for ts, open_price, high, low, close, volume in columns:
+            await self.enqueue({
+                "symbol": symbol,
+                "timestamp": datetime.utcfromtimestamp(ts),
+                "open_price": open_price,
+                "high_price": high,
+                "low_price": low,
+                "close_price": close,
+                "volume": volume,
+                "source": source,
+                "interval_seconds": interval_seconds
+            })
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Buffer depth and flush metrics."""
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": self.last_flush_ms
+        }
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+            if batch:
+                await self._flush(batch)
+            elif self._closing:
+                break
+
+    async def _collect_batch(self) -> List[Dict[str, Any]]:
+        """Wait for rows until the batch is full or the flush interval elapses."""
+        batch: List[Dict[str, Any]] = []
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval_seconds
+
+        while len(batch) < self.max_batch_size:
+            if self._closing:
+                # Drain without waiting
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    break
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=min(remaining, 1.0)))
+            except asyncio.TimeoutError:
+                continue
+
+        return batch
+
+    async def _flush(self, rows: List[Dict[str, Any]]):
+        """Write a batch with one multi-row INSERT, retrying with backoff."""
+        for attempt in range(1, self.MAX_FLUSH_ATTEMPTS + 1):
+            start = time.perf_counter()
+            try:
+                async with async_session_maker() as session:
+                    await session.execute(insert(MarketData.__table__).values(rows))
+                    await session.commit()
+
+                self.last_flush_ms = (time.perf_counter() - start) * 1000
+                self.rows_written += len(rows)
+                self.flushes += 1
+                return
+            except Exception as e:
+                self.flush_errors += 1
+                logger.error(
+                    f"Error flushing {len(rows)} market data rows "
+                    f"(attempt {attempt}/{self.MAX_FLUSH_ATTEMPTS}): {e}"
+                )
+                if attempt < self.MAX_FLUSH_ATTEMPTS:
+                    # While we back off, the bounded queue pushes back on producers
+                    await asyncio.sleep(min(2 ** attempt, 30))
+
+        self.rows_dropped += len(rows)
+
+
+def create_market_data_writer() -> MarketDataWriter:
+    """Build a writer from settings."""
+    return MarketDataWriter(
+        max_batch_size=settings.INGEST_BATCH_SIZE,
+        flush_interval_seconds=settings.INGEST_FLUSH_INTERVAL_SECONDS,
+        max_queue_size=settings.INGEST_MAX_QUEUE_SIZE
+    )
@@ -0,0 +1,243 @@
+"""
+Market Simulator - Synthetic or replayed prices for offline load testing
+
+Generates quotes and intraday bars for any number of symbols so the poller,
+websockets and analytics can run without touching the real upstreams.
+Two modes:
+
+- gbm:    each symbol follows geometric Brownian motion with its own drift
+          and volatility, advanced lazily to the wall clock on each request.
+- replay: prices step through bars from the on-disk bar archive, one bar per
+          tick, looping at the end.
+
+The output formats (Stooq CSV, Yahoo JSON, FMP JSON) are produced by
+app.simulator_main, which serves them at the upstream URL paths.
+"""
+
+import hashlib
+import math
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+import numpy as np
+
+from app.core.bar_codec import BarArrays
+from app.core.config import settings
+from app.services.bar_archive import BarArchive
+
+
+SECONDS_PER_YEAR = 252 * 6.5 * 3600  # Trading seconds
+
+
+class _SymbolState:
+    """Price path state for one simulated symbol."""
+
+    __slots__ = ("price", "drift", "volatility", "high", "low", "volume", "updated_at", "day", "rng")
+
+    def __init__(self, price: float, drift: float, volatility: float, now: float, rng: np.random.Generator):
+        self.price = price
+        self.drift = drift
+        self.volatility = volatility
+        self.high = price
+        self.low = price
+        self.volume = 0.0
+        self.updated_at = now
+        self.day = int(now // 86400)
+        self.rng = rng
+
+
+class MarketSimulator:
+    """Lazily advanced GBM or archive-replay prices for many symbols."""
+
+    def __init__(
+        self,
+        symbol_count: int = 100,
+        tick_seconds: float = 1.0,
+        mode: str = "gbm",
+        seed: int = 42,
+        replay_dir: Optional[str] = None
+    ):
+        self.tick_seconds = tick_seconds
+        self.mode = mode
+        self.seed = seed
+        self.symbols = [f"sim{i:04d}.us" for i in range(symbol_count)]
+
+        self._states: Dict[str, _SymbolState] = {}
+        self._archive = BarArchive(replay_dir) if replay_dir else None
+        self._replay: Dict[str, BarArrays] = {}
+        self._started_at = time.time()
+
+        # Metrics
+        self.quotes_served = 0
+        self.bars_served = 0
+
+    def quote(self, symbol: str, now: Optional[float] = None) -> Dict:
+        """Current quote for a symbol (created on first use)."""
+        now = now or time.time()
+        symbol = symbol.lower()
+        self.quotes_served += 1
+
+        if self.mode == "replay":
+            return self._replay_quote(symbol, now)
+
+        state = self._advance(symbol, now)
+        return {
+            "symbol": symbol.upper(),
+            "date": datetime.utcfromtimestamp(now).strftime("%Y%m%d"),
+            "last_price": round(state.price, 4),
+            "high": round(state.high, 4),
+            "low": round(state.low, 4),
+            "volume": round(state.volume)
+        }
+
+    def bars(self, symbol: str, interval_seconds: int, count: int = 500, now: Optional[float] = None) -> BarArrays:
+        """The last `count` completed bars ending at the current price."""
+        now = now or time.time()
+        symbol = symbol.lower()
+        self.bars_served += 1
+
+        if self.mode == "replay":
+            return self._replay_bars(symbol, interval_seconds, count, now)
+
+        state = self._advance(symbol, now)
+        end = int(now) - int(now) % interval_seconds
+        times = end - interval_seconds * np.arange(count, 0, -1, dtype=np.int64)
+
+        # Walk backwards from the current price; seeded per bar so repeated
+        # requests for the same window return the same history
+        rng = np.random.default_rng([self._symbol_seed(symbol), interval_seconds, end])
+        dt = interval_seconds / SECONDS_PER_YEAR
+        steps = rng.standard_normal((count, 4)) * state.volatility * math.sqrt(dt / 4)
+        close_path = state.price * np.exp(-np.cumsum(steps[::-1].sum(axis=1)))[::-1]
+        close = np.append(close_path[1:], state.price)
+        open_ = close_path
+        wiggle = np.abs(steps[:, :2]) * close[:, None]
+        high = np.maximum(open_, close) + wiggle[:, 0]
+        low = np.minimum(open_, close) - wiggle[:, 1]
+        volume = rng.integers(1_000, 50_000, count).astype(np.float64)
+
+        return BarArrays(times, open_, high, low, close, volume)
+
+    def profile(self, symbol: str) -> Dict:
+        """Static company profile for a symbol."""
+        seed = self._symbol_seed(symbol)
+        sectors = ["Technology", "Healthcare", "Financials", "Energy", "Industrials"]
+        return {
+            "symbol": symbol.upper().replace(".US", ""),
+            "companyName": f"Simulated {symbol.upper()}",
+            "sector": sectors[seed % len(sectors)],
+            "industry": "Simulation",
+            "mktCap": (seed % 900 + 100) * 1e9,
+            "beta": 0.5 + (seed % 150) / 100
+        }
+
+    def get_stats(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "universe": len(self.symbols),
+            "active_symbols": len(self._states) + len(self._replay),
+            "quotes_served": self.quotes_served,
+            "bars_served": self.bars_served
+        }
+
+    def _symbol_seed(self, symbol: str) -> int:
+        digest = hashlib.blake2b(f"{self.seed}:{symbol.lower()}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    def _advance(self, symbol: str, now: float) -> _SymbolState:
+        state = self._states.get(symbol)
+        if state is None:
+            seed = self._symbol_seed(symbol)
+            rng = np.random.default_rng(seed)
+            state = self._states[symbol] = _SymbolState(
+                price=float(rng.uniform(10, 500)),
+                drift=float(rng.uniform(-0.05, 0.15)),
+                volatility=float(rng.uniform(0.15, 0.6)),
+                now=now,
+                rng=rng
+            )
+            return state
+
+        steps = int((now - state.updated_at) // self.tick_seconds)
+        if steps <= 0:
+            return state
+
+        # n GBM steps collapse into one draw with n times the variance
+        dt = steps * self.tick_seconds / SECONDS_PER_YEAR
+        shock = state.rng.standard_normal()
+        state.price *= math.exp(
+            (state.drift - 0.5 * state.volatility ** 2) * dt + state.volatility * math.sqrt(dt) * shock
+        )
+        state.updated_at += steps * self.tick_seconds
+
+        day = int(now // 86400)
+        if day != state.day:
+            state.day = day
+            state.high = state.low = state.price
+            state.volume = 0.0
+        state.high = max(state.high, state.price)
+        state.low = min(state.low, state.price)
+        state.volume += float(state.rng.integers(100, 5_000)) * steps
+        return state
+
+    def _replay_series(self, symbol: str) -> BarArrays:
+        bars = self._replay.get(symbol)
+        if bars is None:
+            bars = self._archive.read_latest(symbol, 100_000) if self._archive else BarArrays.empty()
+            self._replay[symbol] = bars
+        return bars
+
+    def _replay_index(self, bars: BarArrays, now: float) -> int:
+        return int((now - self._started_at) // self.tick_seconds) % len(bars)
+
+    def _replay_quote(self, symbol: str, now: float) -> Dict:
+        bars = self._replay_series(symbol)
+        if not len(bars):
+            return {}
+        i = self._replay_index(bars, now)
+        day_start = bars.time[i] - bars.time[i] % 86400
+        first = int(np.searchsorted(bars.time, day_start))
+        return {
+            "symbol": symbol.upper(),
+            "date": datetime.utcfromtimestamp(int(bars.time[i])).strftime("%Y%m%d"),
+            "last_price": float(bars.close[i]),
+            "high": float(bars.high[first:i + 1].max()),
+            "low": float(bars.low[first:i + 1].min()),
+            "volume": float(bars.volume[first:i + 1].sum())
+        }
+
+    def _replay_bars(self, symbol: str, interval_seconds: int, count: int, now: float) -> BarArrays:
+        bars = self._replay_series(symbol)
+        if not len(bars):
+            return bars
+        played = bars.slice(0, self._replay_index(bars, now) + 1)
+        return _resample(played, interval_seconds).tail(count)
+
+
+def _resample(bars: BarArrays, interval_seconds: int) -> BarArrays:
+    """Re-bucket sorted bars to a coarser interval."""
+    if len(bars) < 2:
+        return bars
+    buckets = bars.time - bars.time % interval_seconds
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(bars)] - 1
+    return BarArrays(
+        buckets[starts],
+        bars.open[starts],
+        np.maximum.reduceat(bars.high, starts),
+        np.minimum.reduceat(bars.low, starts),
+        bars.close[ends],
+        np.add.reduceat(bars.volume, starts)
+    )
+
+
+def create_market_simulator() -> MarketSimulator:
+    """Build a simulator from settings."""
+    return MarketSimulator(
+        symbol_count=settings.SIM_SYMBOL_COUNT,
+        tick_seconds=settings.SIM_TICK_SECONDS,
+        mode=settings.SIM_MODE,
+        seed=settings.SIM_SEED,
+        replay_dir=settings.SIM_REPLAY_DIR or settings.BAR_ARCHIVE_DIR
+    )
@@ -0,0 +1,269 @@
+"""
+Poll Scheduler - Demand- and session-aware quote polling
+
+Builds the poll set from the default tickers, live websocket subscriptions,
+open positions and recent API lookups, and gives each symbol its own poll
+interval:
+
+    interval = base / (demand factor * volatility factor), clamped to [min, max]
+
+Outside the exchange session every symbol drops to the closed-market interval.
+If the resulting schedule would exceed the upstream quota, all intervals are
+stretched by the same factor so relative priorities are kept.
+
+Only one node polls (see poller_lease). Every node reports its own
+subscriptions and lookups (local_demand) and the poller folds in the
+cluster's (set_cluster_demand), so demand on any node drives the polling.
+"""
+
+import math
+import time
+from datetime import datetime, time as dt_time
+from typing import Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from app.core.config import settings
+
+
+# Demand weights per source
+SUBSCRIPTION_WEIGHT = 3.0
+POSITION_WEIGHT = 2.0
+LOOKUP_WEIGHT = 1.0
+DEFAULT_WEIGHT = 0.5
+
+# EWMA smoothing for absolute per-poll returns
+VOLATILITY_ALPHA = 0.2
+
+
+class MarketSession:
+    """Regular weekday trading session of one exchange."""
+
+    def __init__(self, timezone: str, open_time: str, close_time: str):
+        self.timezone = ZoneInfo(timezone)
+        self.open_time = dt_time.fromisoformat(open_time)
+        self.close_time = dt_time.fromisoformat(close_time)
+
+    def is_open(self, now: float) -> bool:
+        local = datetime.fromtimestamp(now, self.timezone)
+        if local.weekday() >= 5:
+            return False
+        return self.open_time <= local.time() < self.close_time
+
+
+class PollScheduler:
+    """Per-symbol poll timing from demand, volatility, session and quota."""
+
+    def __init__(
+        self,
+        default_symbols: Iterable[str],
+        session: MarketSession,
+        base_interval: float = 30,
+        min_interval: float = 10,
+        max_interval: float = 300,
+        closed_interval: float = 1800,
+        quota_per_hour: float = 96,
+        lookup_ttl: float = 900,
+        volatility_reference: float = 0.001
+    ):
+        self.default_symbols = {symbol.lower() for symbol in default_symbols}
+        self.session = session
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.closed_interval = closed_interval
+        self.quota_per_hour = quota_per_hour
+        self.lookup_ttl = lookup_ttl
+        self.volatility_reference = volatility_reference
+
+        self._subscriptions: Dict[str, int] = {}
+        self._cluster_subscriptions: set = set()
+        self._positions: set = set()
+        self._lookups: Dict[str, float] = {}
+        self._last_price: Dict[str, float] = {}
+        self._volatility: Dict[str, float] = {}
+        self._next_poll: Dict[str, float] = {}
+
+        # Last computed plan, for stats
+        self._stretch = 1.0
+        self._planned_per_hour = 0.0
+
+    # Demand inputs
+
+    def add_subscriptions(self, symbols: Iterable[str]):
+        """Count a websocket subscription to each symbol."""
+        for symbol in symbols:
+            symbol = symbol.lower()
+            self._subscriptions[symbol] = self._subscriptions.get(symbol, 0) + 1
+
+    def remove_subscriptions(self, symbols: Iterable[str]):
+        """Release subscriptions taken with add_subscriptions."""
+        for symbol in symbols:
+            symbol = symbol.lower()
+            count = self._subscriptions.get(symbol, 0) - 1
+            if count > 0:
+                self._subscriptions[symbol] = count
+            else:
+                self._subscriptions.pop(symbol, None)
+
+    def set_positions(self, symbols: Iterable[str]):
+        """Replace the set of symbols held in open positions."""
+        self._positions = {symbol.lower() for symbol in symbols}
+
+    def note_lookups(self, symbols: Iterable[str], now: Optional[float] = None):
+        """Record API lookups; they count as demand for lookup_ttl seconds."""
+        now = now or time.time()
+        # Expired here too: a node that does not poll never calls poll_set
+        self._expire_lookups(now)
+        for symbol in symbols:
+            self._lookups[symbol.lower()] = now
+
+    def local_demand(self, now: Optional[float] = None) -> Tuple[List[str], Dict[str, float]]:
+        """This node's subscribed symbols and unexpired lookup times, to report to the poller."""
+        now = now or time.time()
+        self._expire_lookups(now)
+        return list(self._subscriptions), dict(self._lookups)
+
+    def set_cluster_demand(self, subscribed: Iterable[str], lookups: Dict[str, float]):
+        """Fold in the subscriptions and lookups reported by every node."""
+        self._cluster_subscriptions = {symbol.lower() for symbol in subscribed}
+        for symbol, seen in lookups.items():
+            symbol = symbol.lower()
+            if seen > self._lookups.get(symbol, 0):
+                self._lookups[symbol] = seen
+
+    def observe_price(self, symbol: str, price: Optional[float]):
+        """Update the symbol's volatility estimate from a polled price."""
+        if not price:
+            return
+        symbol = symbol.lower()
+        previous = self._last_price.get(symbol)
+        self._last_price[symbol] = price
+        if previous:
+            move = abs(price - previous) / previous
+            current = self._volatility.get(symbol, move)
+            self._volatility[symbol] = current + VOLATILITY_ALPHA * (move - current)
+
+    # Scheduling
+
+    def poll_set(self, now: Optional[float] = None) -> List[str]:
+        """Every symbol with current demand."""
+        now = now or time.time()
+        self._expire_lookups(now)
+        return sorted(
+            self.default_symbols | self._positions | set(self._subscriptions)
+            | self._cluster_subscriptions | set(self._lookups)
+        )
+
+    def plan(self, now: Optional[float] = None) -> Dict[str, float]:
+        """Poll interval per symbol, after session and quota adjustments."""
+        now = now or time.time()
+        symbols = self.poll_set(now)
+        market_open = self.session.is_open(now)
+
+        intervals = {symbol: self._interval(symbol, market_open) for symbol in symbols}
+
+        planned = sum(3600 / interval for interval in intervals.values())
+        self._stretch = max(1.0, planned / self.quota_per_hour) if self.quota_per_hour > 0 else 1.0
+        if self._stretch > 1.0:
+            intervals = {symbol: interval * self._stretch for symbol, interval in intervals.items()}
+        self._planned_per_hour = planned / self._stretch
+
+        return intervals
+
+    def due(self, now: Optional[float] = None) -> List[str]:
+        """Symbols whose next poll time has passed (new symbols are due at once)."""
+        now = now or time.time()
+        symbols = self.poll_set(now)
+        for symbol in list(self._next_poll):
+            if symbol not in symbols:
+                self._forget(symbol)
+        return [symbol for symbol in symbols if self._next_poll.get(symbol, 0) <= now]
+
+    def mark_polled(self, symbols: Iterable[str], ticks: Dict[str, Dict], now: Optional[float] = None):
+        """Feed poll results back and schedule each symbol's next poll."""
+        now = now or time.time()
+        for symbol, data in ticks.items():
+            self.observe_price(symbol, data.get('last_price'))
+
+        intervals = self.plan(now)
+        for symbol in symbols:
+            symbol = symbol.lower()
+            self._next_poll[symbol] = now + intervals.get(symbol, self.base_interval)
+
+    def seconds_until_next(self, now: Optional[float] = None, cap: float = 5.0) -> float:
+        """How long the poll loop may sleep; capped so new demand is picked up quickly."""
+        now = now or time.time()
+        if not self._next_poll:
+            return cap
+        return min(max(min(self._next_poll.values()) - now, 0.0), cap)
+
+    def get_stats(self) -> Dict:
+        """Poll set, per-symbol intervals and quota usage."""
+        now = time.time()
+        intervals = self.plan(now)
+        return {
+            "market_open": self.session.is_open(now),
+            "symbols": len(intervals),
+            "subscribed": len(self._subscriptions),
+            "cluster_subscribed": len(self._cluster_subscriptions),
+            "positions": len(self._positions),
+            "recent_lookups": len(self._lookups),
+            "intervals": {symbol: round(interval, 1) for symbol, interval in intervals.items()},
+            "planned_polls_per_hour": round(self._planned_per_hour, 1),
+            "quota_per_hour": self.quota_per_hour,
+            "quota_stretch": round(self._stretch, 2)
+        }
+
+    def _interval(self, symbol: str, market_open: bool) -> float:
+        if not market_open:
+            return self.closed_interval
+
+        # Other nodes report subscribed symbols without counts
+        subscriptions = max(
+            self._subscriptions.get(symbol, 0), 1 if symbol in self._cluster_subscriptions else 0
+        )
+        weight = (
+            SUBSCRIPTION_WEIGHT * subscriptions
+            + (POSITION_WEIGHT if symbol in self._positions else 0.0)
+            + (LOOKUP_WEIGHT if symbol in self._lookups else 0.0)
+            + (DEFAULT_WEIGHT if symbol in self.default_symbols else 0.0)
+        )
+        demand_factor = 1.0 + math.log1p(weight)
+
+        volatility = self._volatility.get(symbol)
+        volatility_factor = (
+            min(max(volatility / self.volatility_reference, 0.5), 2.0)
+            if volatility is not None and self.volatility_reference > 0
+            else 1.0
+        )
+
+        interval = self.base_interval / (demand_factor * volatility_factor)
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def _forget(self, symbol: str):
+        """Drop the poll state of a symbol that left the poll set."""
+        self._next_poll.pop(symbol, None)
+        self._last_price.pop(symbol, None)
+        self._volatility.pop(symbol, None)
+
+    def _expire_lookups(self, now: float):
+        cutoff = now - self.lookup_ttl
+        for symbol in [s for s, seen in self._lookups.items() if seen < cutoff]:
+            del self._lookups[symbol]
+
+
+def create_poll_scheduler() -> PollScheduler:
+    """Build a scheduler from settings."""
+    return PollScheduler(
+        default_symbols=settings.DEFAULT_TICKERS,
+        session=MarketSession(
+            settings.MARKET_TIMEZONE, settings.MARKET_OPEN_TIME, settings.MARKET_CLOSE_TIME
+        ),
+        base_interval=settings.DATA_POLL_INTERVAL_SECONDS,
+        min_interval=settings.POLL_MIN_INTERVAL_SECONDS,
+        max_interval=settings.POLL_MAX_INTERVAL_SECONDS,
+        closed_interval=settings.POLL_CLOSED_INTERVAL_SECONDS,
+        quota_per_hour=settings.STOOQ_MAX_REQUESTS_PER_HOUR * settings.POLL_QUOTA_SHARE,
+        lookup_ttl=settings.POLL_LOOKUP_TTL_SECONDS,
+        volatility_reference=settings.POLL_VOLATILITY_REFERENCE
+    )
@@ -0,0 +1,86 @@
+"""
+Poller Lease - Elects the one node that polls market data
+
+Every node runs the data service, but only the holder of the `poller_lease`
+key polls upstream, publishes ticks and aggregates bars; the others only
+consume the tick streams. The holder renews the lease well within its TTL;
+if it dies or loses Redis, the key expires and the next node to try takes
+over, so polling fails over without coordination beyond one Redis key.
+"""
+
+from typing import Dict, Optional
+
+from loguru import logger
+
+
+LEASE_KEY = "poller_lease"
+
+# Extend / delete the lease only if this node still holds it
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class PollerLease:
+    """A Redis lease held by at most one node at a time."""
+
+    def __init__(self, node_id: Optional[str] = None, ttl_seconds: float = 15.0, key: str = LEASE_KEY):
+        self.node_id = node_id
+        self.ttl_seconds = ttl_seconds
+        self.key = key
+        self.held = False
+
+        # Metrics
+        self.acquired = 0
+        self.lost = 0
+        self.errors = 0
+
+    async def renew(self, redis) -> bool:
+        """Take the lease if it is free, or extend it if held; True while this node holds it."""
+        ttl_ms = int(self.ttl_seconds * 1000)
+        try:
+            held = bool(await redis.set(self.key, self.node_id, nx=True, px=ttl_ms))
+            if not held:
+                held = bool(await redis.eval(RENEW_SCRIPT, 1, self.key, self.node_id, ttl_ms))
+        except Exception as e:
+            # Stop polling rather than risk a second poller once the key expires
+            self.errors += 1
+            logger.error(f"Could not renew the poller lease: {e}")
+            held = False
+
+        if held and not self.held:
+            self.acquired += 1
+            logger.info(f"Node {self.node_id} is now the market data poller")
+        elif self.held and not held:
+            self.lost += 1
+            logger.warning(f"Node {self.node_id} lost the poller lease")
+        self.held = held
+        return held
+
+    async def release(self, redis):
+        """Give the lease up so another node takes over without waiting for the TTL."""
+        if not self.held:
+            return
+        self.held = False
+        try:
+            await redis.eval(RELEASE_SCRIPT, 1, self.key, self.node_id)
+        except Exception as e:
+            logger.error(f"Could not release the poller lease: {e}")
+
+    def get_stats(self) -> Dict:
+        return {
+            "node_id": self.node_id,
+            "held": self.held,
+            "acquired": self.acquired,
+            "lost": self.lost,
+            "errors": self.errors
+        }
@@ -0,0 +1,214 @@
+"""
+Portfolio State - In-memory positions per user for the portfolio websocket
+
+A user's positions are loaded from the database when their first portfolio
+socket connects and are then kept current by applying each fill, the same
+way order processing updates the positions table. Every applied fill
+advances the user's sequence number, so a client that starts from a
+snapshot can tell a missed update from the next delta.
+
+Fills are published after their position change is committed. A fill that
+arrives while a user's positions are loading may or may not be part of the
+loaded rows, so the load is repeated until none arrives during it.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from loguru import logger
+from sqlalchemy import select
+
+from app.core.database import Position, async_session_maker
+from app.services.data_service import data_service
+
+
+PositionMap = Dict[str, Dict[str, float]]
+Loader = Callable[[str], Awaitable[PositionMap]]
+PriceLookup = Callable[[str], Optional[float]]
+
+
+async def load_positions(user_id: str) -> PositionMap:
+    """A user's open positions from the positions table."""
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(Position).where(Position.user_id == int(user_id))
+        )
+        return {
+            position.symbol: {"quantity": position.quantity, "avg_price": position.avg_price}
+            for position in result.scalars()
+        }
+
+
+def last_price(symbol: str) -> Optional[float]:
+    """Last published price of a symbol (from the tick stream on nodes that do not poll)."""
+    quote = (
+        data_service.tick_tracker.snapshot([symbol]).get(symbol.lower())
+        or data_service.client.published.get(symbol)
+        or {}
+    )
+    return quote.get("last_price")
+
+
+class PortfolioStateStore:
+    """Sequenced positions of the users with a live portfolio subscription."""
+
+    def __init__(self, loader: Loader = load_positions, price_of: PriceLookup = last_price):
+        self.loader = loader
+        self.price_of = price_of
+        self._positions: Dict[str, PositionMap] = {}
+        self._seq: Dict[str, int] = {}
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._fills_while_loading: Set[str] = set()
+
+        # Metrics
+        self.loads = 0
+        self.reloads = 0
+        self.fills_applied = 0
+
+    async def snapshot(self, user_id) -> Dict:
+        """The user's valued positions and summary, stamped with their sequence number."""
+        user_id = str(user_id)
+        if user_id not in self._positions:
+            task = self._loading.get(user_id)
+            if task is None:
+                task = self._loading[user_id] = asyncio.create_task(self._load(user_id))
+            await asyncio.shield(task)
+
+        positions = self._positions[user_id]
+        return {
+            "seq": self._seq[user_id],
+            "positions": [self._valued(symbol, position) for symbol, position in positions.items()],
+            "summary": self._summary(positions)
+        }
+
+    def apply_fill(self, fill: Dict) -> Optional[Dict]:
+        """
+        Apply a fill to its user's positions.
+
+        Returns the sequenced delta (the symbol's new position, quantity 0
+        once closed, and the new summary), or None if the user's positions
+        are not held in memory.
+        """
+        user_id = str(fill.get("user_id"))
+        positions = self._positions.get(user_id)
+        if positions is None:
+            if user_id in self._loading:
+                self._fills_while_loading.add(user_id)
+            return None
+
+        symbol = fill.get("symbol")
+        quantity = fill.get("quantity", 0)
+        price = fill.get("price", 0)
+        position = positions.get(symbol)
+
+        if fill.get("side") == "buy":
+            if position is None:
+                position = positions[symbol] = {"quantity": quantity, "avg_price": price}
+            else:
+                total_quantity = position["quantity"] + quantity
+                position["avg_price"] = (
+                    position["quantity"] * position["avg_price"] + quantity * price
+                ) / total_quantity
+                position["quantity"] = total_quantity
+        elif position is not None:
+            position["quantity"] -= quantity
+            if position["quantity"] <= 0:
+                del positions[symbol]
+                position = None
+        else:
+            # Sells without a position do not open one
+            return None
+
+        self._seq[user_id] += 1
+        self.fills_applied += 1
+        return {
+            "seq": self._seq[user_id],
+            "position": (
+                self._valued(symbol, position) if position is not None
+                else {"symbol": symbol, "quantity": 0}
+            ),
+            "summary": self._summary(positions)
+        }
+
+    def forget(self, user_id):
+        """Drop a user's positions once nobody is subscribed to them."""
+        user_id = str(user_id)
+        self._positions.pop(user_id, None)
+        self._seq.pop(user_id, None)
+
+    def get_stats(self) -> Dict:
+        return {
+            "users": len(self._positions),
+            "positions": sum(len(positions) for positions in self._positions.values()),
+            "loads": self.loads,
+            "reloads": self.reloads,
+            "fills_applied": self.fills_applied
+        }
+
+    async def _load(self, user_id: str):
+        try:
+            while True:
+                self._fills_while_loading.discard(user_id)
+                self.loads += 1
+                positions = await self.loader(user_id)
+                if user_id not in self._fills_while_loading:
+                    break
+                # A fill raced the load; reload so it is certainly included
+                self.reloads += 1
+            self._positions[user_id] = positions
+            self._seq.setdefault(user_id, 0)
+        except Exception as e:
+            logger.error(f"Error loading positions for user {user_id}: {e}")
+            raise
+        finally:
+            self._loading.pop(user_id, None)
+
+    def _valued(self, symbol: str, position: Dict[str, float]) -> Dict:
+        """Position with market value and P&L, as in the REST positions snapshot."""
+        current_price = self.price_of(symbol)
+        quantity = position["quantity"]
+        avg_price = position["avg_price"]
+        valued = {
+            "symbol": symbol,
+            "quantity": quantity,
+            "avg_price": avg_price,
+            "current_price": current_price,
+            "market_value": None,
+            "unrealized_pnl": None,
+            "unrealized_pnl_percent": None
+        }
+        if current_price:
+            valued["market_value"] = quantity * current_price
+            valued["unrealized_pnl"] = (current_price - avg_price) * quantity
+            valued["unrealized_pnl_percent"] = (
+                (current_price - avg_price) / avg_price * 100 if avg_price > 0 else 0
+            )
+        return valued
+
+    def _summary(self, positions: PositionMap) -> Dict:
+        valued = [self._valued(symbol, position) for symbol, position in positions.items()]
+        priced = [position for position in valued if position["market_value"] is not None]
+        total_market_value = sum(position["market_value"] for position in priced)
+        total_unrealized_pnl = sum(position["unrealized_pnl"] for position in priced)
+        total_cost_basis = sum(position["quantity"] * position["avg_price"] for position in valued)
+        largest = max(priced, key=lambda position: position["market_value"], default=None)
+        return {
+            "total_market_value": total_market_value,
+            "total_unrealized_pnl": total_unrealized_pnl,
+            "total_unrealized_pnl_percent": (
+                total_unrealized_pnl / total_cost_basis * 100 if total_cost_basis > 0 else 0
+            ),
+            "position_count": len(valued),
+            "largest_position": largest["symbol"] if largest else None,
+            "largest_position_percent": (
+                largest["market_value"] / total_market_value * 100 if largest and total_market_value else 0.0
+            )
+        }
+
+# Global portfolio state store
+portfolio_state = PortfolioStateStore()
+
+
+def get_portfolio_state() -> PortfolioStateStore:
+    """Get the portfolio state store."""
+    return portfolio_state
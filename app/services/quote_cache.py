@@ -0,0 +1,196 @@
+"""
+Quote Cache - In-process L1 cache for market data
+
+Sits in front of Redis so repeated quote lookups inside one process are a
+dict lookup instead of a network round trip plus JSON decode. Entries past
+their TTL can still be served for a short grace window while a background
+task revalidates them.
+
+on_symbol_added / on_symbol_removed are called when a symbol gains its
+first cached entry and loses its last one, so the tick stream consumer can
+read exactly the symbols whose entries ticks must invalidate.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from loguru import logger
+
+
+class _CacheEntry:
+    """Single cached value with freshness deadlines."""
+
+    __slots__ = ("value", "expires_at", "stale_until", "symbol")
+
+    def __init__(self, value: Any, expires_at: float, stale_until: float, symbol: Optional[str]):
+        self.value = value
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+        self.symbol = symbol
+
+
+class QuoteCache:
+    """Bounded LRU cache with per-entry TTL and stale-while-revalidate."""
+
+    def __init__(
+        self,
+        max_entries: int = 2048,
+        stale_grace_seconds: float = 60,
+        on_symbol_added: Optional[Callable[[str], None]] = None,
+        on_symbol_removed: Optional[Callable[[str], None]] = None
+    ):
+        self.max_entries = max_entries
+        self.stale_grace_seconds = stale_grace_seconds
+        self.on_symbol_added = on_symbol_added
+        self.on_symbol_removed = on_symbol_removed
+
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._keys_by_symbol: Dict[str, Set[str]] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+        # Metrics
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return a fresh value, or None if missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= time.monotonic():
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def get_or_revalidate(
+        self,
+        key: str,
+        refresh: Callable[[], Awaitable[Any]]
+    ) -> Optional[Any]:
+        """
+        Return a cached value, scheduling a background refresh if it is stale.
+
+        Fresh entries are returned as-is. Entries inside the stale grace window
+        are returned immediately while `refresh` runs in the background (at most
+        one refresh per key). Returns None on a miss; the caller loads inline.
+        """
+        entry = self._entries.get(key)
+        now = time.monotonic()
+
+        if entry is None or entry.stale_until <= now:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+
+        if entry.expires_at > now:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+            self._schedule_refresh(key, refresh)
+
+        return entry.value
+
+    def set(self, key: str, value: Any, ttl: float, symbol: Optional[str] = None):
+        """Store a value for `ttl` seconds, optionally tagged with its symbol."""
+        now = time.monotonic()
+        symbol = symbol.lower() if symbol else None
+
+        old = self._entries.pop(key, None)
+        if old is not None and old.symbol != symbol:
+            self._untag(key, old.symbol)
+
+        self._entries[key] = _CacheEntry(
+            value, now + ttl, now + ttl + self.stale_grace_seconds, symbol
+        )
+        if symbol:
+            self._tag(key, symbol)
+
+        while len(self._entries) > self.max_entries:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self._untag(evicted_key, evicted.symbol)
+            self.evictions += 1
+
+    def invalidate(self, key: str):
+        """Drop a single key."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._untag(key, entry.symbol)
+            self.invalidations += 1
+
+    def invalidate_symbol(self, symbol: str, keep: Optional[str] = None):
+        """Drop every entry tagged with `symbol`, except the key `keep`."""
+        for key in list(self._keys_by_symbol.get(symbol.lower(), ())):
+            if key != keep:
+                self.invalidate(key)
+
+    def clear(self):
+        """Drop all entries and cancel in-flight refreshes, which would repopulate them."""
+        for task in self._refreshing.values():
+            task.cancel()
+        self._refreshing.clear()
+        symbols = list(self._keys_by_symbol)
+        self._entries.clear()
+        self._keys_by_symbol.clear()
+        if self.on_symbol_removed:
+            for symbol in symbols:
+                self.on_symbol_removed(symbol)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Cache size and hit-rate metrics."""
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "refreshing": len(self._refreshing),
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0
+        }
+
+    def _tag(self, key: str, symbol: str):
+        keys = self._keys_by_symbol.get(symbol)
+        if keys is None:
+            keys = self._keys_by_symbol[symbol] = set()
+            if self.on_symbol_added:
+                self.on_symbol_added(symbol)
+        keys.add(key)
+
+    def _untag(self, key: str, symbol: Optional[str]):
+        if not symbol:
+            return
+        keys = self._keys_by_symbol.get(symbol)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_symbol[symbol]
+                if self.on_symbol_removed:
+                    self.on_symbol_removed(symbol)
+
+    def _schedule_refresh(self, key: str, refresh: Callable[[], Awaitable[Any]]):
+        if key in self._refreshing:
+            return
+
+        async def _run():
+            try:
+                await refresh()
+            except Exception as e:
+                logger.error(f"Background refresh failed for {key}: {e}")
+            finally:
+                # A refresh cancelled by clear() may finish after its replacement started
+                if self._refreshing.get(key) is asyncio.current_task():
+                    del self._refreshing[key]
+
+        self._refreshing[key] = asyncio.create_task(_run())
@@ -0,0 +1,220 @@
+"""
+Source Health - Circuit breaking and hedged requests for upstream data sources
+
+Every upstream (Stooq, Yahoo, FMP) gets a SourceHealth that records request
+latency and outcome over a sliding window. When the error rate crosses a
+threshold the circuit opens and the source is skipped until a cool-down
+passes; then a single probe request decides whether it closes again.
+
+hedged_request() runs a prioritized list of sources: if the current source
+has not answered within its latency percentile, the next one is started in
+parallel, and the first acceptable answer wins. An overall deadline bounds
+the total wait.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class SourceHealth:
+    """Sliding-window latency/error tracking with a circuit breaker."""
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 50,
+        min_requests: int = 5,
+        failure_threshold: float = 0.5,
+        open_seconds: float = 30,
+        max_open_seconds: float = 600,
+        hedge_percentile: float = 95,
+        hedge_min_seconds: float = 0.2,
+        hedge_max_seconds: float = 2.0,
+        timeout_seconds: float = 5.0
+    ):
+        self.name = name
+        self.min_requests = min_requests
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_seconds = hedge_min_seconds
+        self.hedge_max_seconds = hedge_max_seconds
+        self.timeout_seconds = timeout_seconds
+
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._state = CLOSED
+        self._open_until = 0.0
+        self._current_open_seconds = open_seconds
+        self._probe_in_flight = False
+
+        # Metrics
+        self.requests = 0
+        self.failures = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() >= self._open_until:
+            return HALF_OPEN
+        return self._state
+
+    def allow_request(self) -> bool:
+        """Whether a request may go to this source now (claims the probe if half-open)."""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._probe_in_flight:
+            self._state = HALF_OPEN
+            self._probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self, latency_seconds: float):
+        self.requests += 1
+        self._latencies.append(latency_seconds)
+        self._outcomes.append(True)
+        if self._state == HALF_OPEN:
+            self._state = CLOSED
+            self._current_open_seconds = self.open_seconds
+            self._outcomes.clear()
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.requests += 1
+        self.failures += 1
+        self._outcomes.append(False)
+        self._probe_in_flight = False
+
+        if self._state == HALF_OPEN:
+            # Failed probe: back off further
+            self._current_open_seconds = min(self._current_open_seconds * 2, self.max_open_seconds)
+            self._open()
+            return
+
+        if len(self._outcomes) >= self.min_requests:
+            error_rate = self._outcomes.count(False) / len(self._outcomes)
+            if error_rate >= self.failure_threshold:
+                self._open()
+
+    def record_cancelled(self):
+        """A request was abandoned (lost a hedge race); it says nothing about health."""
+        self._probe_in_flight = False
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait on this source before hedging to the next one."""
+        if len(self._latencies) < self.min_requests:
+            return self.hedge_max_seconds
+        ordered = sorted(self._latencies)
+        index = min(int(len(ordered) * self.hedge_percentile / 100), len(ordered) - 1)
+        return min(max(ordered[index], self.hedge_min_seconds), self.hedge_max_seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Circuit state, error rate and latency percentiles."""
+        ordered = sorted(self._latencies)
+        outcomes = len(self._outcomes)
+        return {
+            "state": self.state,
+            "requests": self.requests,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "times_opened": self.times_opened,
+            "error_rate": self._outcomes.count(False) / outcomes if outcomes else 0.0,
+            "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1) if ordered else None,
+            "p95_ms": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000, 1) if ordered else None,
+            "hedge_delay_ms": round(self.hedge_delay() * 1000, 1)
+        }
+
+    def _open(self):
+        self._state = OPEN
+        self._open_until = time.monotonic() + self._current_open_seconds
+        self.times_opened += 1
+
+
+async def hedged_request(
+    attempts: List[Tuple[SourceHealth, Callable[[], Awaitable[Optional[Any]]]]],
+    accept: Callable[[Any], bool] = lambda result: result is not None,
+    deadline_seconds: Optional[float] = None
+) -> Optional[Any]:
+    """
+    Run `attempts` in priority order with hedging.
+
+    The next attempt starts when the running one fails, returns an
+    unacceptable result, or exceeds its source's hedge delay. The first
+    accepted result wins and the rest are cancelled. If nothing is accepted,
+    the highest-priority non-None result is returned. Sources whose circuit
+    is open are skipped by the attempt itself (it returns None at once).
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (deadline_seconds or settings.SOURCE_REQUEST_DEADLINE_SECONDS)
+
+    pending: Dict[asyncio.Task, int] = {}
+    results: Dict[int, Any] = {}
+    next_index = 0
+
+    def launch():
+        nonlocal next_index
+        task = asyncio.ensure_future(attempts[next_index][1]())
+        pending[task] = next_index
+        next_index += 1
+
+    try:
+        launch()
+        while pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+
+            # Wait for the newest attempt's hedge delay if a backup is left
+            timeout = remaining
+            if next_index < len(attempts):
+                timeout = min(remaining, attempts[next_index - 1][0].hedge_delay())
+
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                index = pending.pop(task)
+                result = None if task.exception() else task.result()
+                if result is not None and accept(result):
+                    return result
+                results[index] = result
+
+            # Timed out or got nothing usable: bring in the next source
+            if next_index < len(attempts):
+                launch()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    for index in sorted(results):
+        if results[index] is not None:
+            return results[index]
+    return None
+
+
+def create_source_health(name: str) -> SourceHealth:
+    """Build a SourceHealth from settings."""
+    return SourceHealth(
+        name,
+        window=settings.SOURCE_HEALTH_WINDOW,
+        min_requests=settings.SOURCE_HEALTH_MIN_REQUESTS,
+        failure_threshold=settings.SOURCE_FAILURE_THRESHOLD,
+        open_seconds=settings.SOURCE_CIRCUIT_OPEN_SECONDS,
+        max_open_seconds=settings.SOURCE_CIRCUIT_MAX_OPEN_SECONDS,
+        hedge_percentile=settings.SOURCE_HEDGE_PERCENTILE,
+        hedge_min_seconds=settings.SOURCE_HEDGE_MIN_SECONDS,
+        hedge_max_seconds=settings.SOURCE_HEDGE_MAX_SECONDS,
+        timeout_seconds=settings.SOURCE_TIMEOUT_SECONDS
+    )
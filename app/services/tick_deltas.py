@@ -0,0 +1,141 @@
+"""
+Tick Deltas - Change detection for published ticks
+
+The poller often sees the same quote twice in a row (Stooq caches for 60 s
+while we poll faster). TickDeltaTracker remembers the last published state of
+every symbol and turns each new tick into one of:
+
+- nothing, when no field other than the fetch timestamp changed;
+- a delta holding only the changed fields (plus the timestamp);
+- a full snapshot, for a symbol's first tick and then every
+  snapshot_interval seconds, so late joiners can rebuild state.
+
+TickState is the consumer side: it folds snapshots and deltas back into the
+full quote per symbol, numbering the updates it applies per symbol so that
+websocket clients can detect gaps.
+"""
+
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+
+SNAPSHOT = "snapshot"
+DELTA = "delta"
+
+# Fields that change on every fetch and never count as a change on their own
+VOLATILE_FIELDS = frozenset({"timestamp"})
+
+
+class TickDeltaTracker:
+    """Last published state per symbol; decides what each new tick publishes."""
+
+    def __init__(self, snapshot_interval: float = 60):
+        self.snapshot_interval = snapshot_interval
+        self._published: Dict[str, Dict] = {}
+        self._snapshot_at: Dict[str, float] = {}
+
+        # Metrics
+        self.snapshots = 0
+        self.deltas = 0
+        self.unchanged = 0
+
+    def diff(
+        self,
+        ticks: Dict[str, Dict],
+        now: Optional[float] = None
+    ) -> Dict[str, Tuple[str, Dict]]:
+        """
+        Compare ticks with the last published state.
+
+        Returns:
+            symbol -> (SNAPSHOT or DELTA, payload) for every symbol that
+            needs publishing; unchanged symbols are left out
+        """
+        now = time.time() if now is None else now
+        updates = {}
+
+        for symbol, tick in ticks.items():
+            symbol = symbol.lower()
+            previous = self._published.get(symbol)
+
+            if previous is None or now - self._snapshot_at.get(symbol, 0) >= self.snapshot_interval:
+                self._published[symbol] = dict(tick)
+                self._snapshot_at[symbol] = now
+                updates[symbol] = (SNAPSHOT, dict(tick))
+                self.snapshots += 1
+                continue
+
+            changed = {
+                field: value for field, value in tick.items()
+                if field not in VOLATILE_FIELDS and previous.get(field) != value
+            }
+            if not changed:
+                self.unchanged += 1
+                continue
+
+            for field in VOLATILE_FIELDS:
+                if field in tick:
+                    changed[field] = tick[field]
+            previous.update(changed)
+            updates[symbol] = (DELTA, changed)
+            self.deltas += 1
+
+        return updates
+
+    def snapshot(self, symbols: Iterable[str]) -> Dict[str, Dict]:
+        """Last published full state for each known symbol."""
+        return {
+            symbol.lower(): dict(self._published[symbol.lower()])
+            for symbol in symbols
+            if symbol.lower() in self._published
+        }
+
+    def get_stats(self) -> Dict:
+        published = self.snapshots + self.deltas
+        return {
+            "symbols": len(self._published),
+            "snapshots": self.snapshots,
+            "deltas": self.deltas,
+            "unchanged": self.unchanged,
+            "suppressed_ratio": (
+                self.unchanged / (published + self.unchanged) if published + self.unchanged else 0.0
+            )
+        }
+
+
+class TickState:
+    """Consumer-side full quote per symbol, rebuilt from snapshots and deltas."""
+
+    def __init__(self):
+        self._state: Dict[str, Dict] = {}
+        self._seq: Dict[str, int] = {}
+
+    def apply(self, symbol: str, kind: str, data: Dict) -> Optional[Dict]:
+        """
+        Fold one published update into the symbol's state.
+
+        Returns the full quote, or None for a delta that arrives before the
+        symbol's first snapshot (there is nothing to apply it to yet). Every
+        applied update advances the symbol's sequence number by one.
+        """
+        symbol = symbol.lower()
+        if kind == DELTA:
+            state = self._state.get(symbol)
+            if state is None:
+                return None
+            state.update(data)
+        else:
+            state = self._state[symbol] = dict(data)
+        self._seq[symbol] = self._seq.get(symbol, 0) + 1
+        return state
+
+    def get(self, symbol: str) -> Optional[Dict]:
+        return self._state.get(symbol.lower())
+
+    def seq(self, symbol: str) -> int:
+        """Sequence number of the symbol's last applied update (0 if none)."""
+        return self._seq.get(symbol.lower(), 0)
+
+    def forget(self, symbol: str):
+        """Drop a symbol's state once its updates stop being read (its seq never repeats)."""
+        self._state.pop(symbol.lower(), None)
@@ -0,0 +1,298 @@
+"""
+Tick Stream Consumer - Tails the `ticks` Redis Stream for websocket fan-out
+
+The data service appends every published tick to the global `ticks` stream
+(XADD). This consumer follows it with a blocking XREAD from the last entry ID
+it handled, hands each batch of entries to its handlers (the websocket
+dispatch), and reconnects from the same ID after an error, so nothing is
+skipped.
+
+Clients see each entry's stream ID. A reconnecting client can pass its
+last-seen ID per symbol to replay() and receive what it missed from the
+stream before following live updates again.
+
+With per_symbol, the consumer instead reads only the `ticks:{symbol}`
+streams of the symbols its node's clients subscribe to (add_interest /
+remove_interest, reference counted), one XREAD over all of them with a last
+ID per stream. Each node then reads what its own clients need rather than
+every tick of every symbol, so adding nodes adds fan-out capacity. A symbol
+that gains interest while an XREAD is blocked is read from the next one, at
+most block_ms later; its subscribers get a snapshot meanwhile. Release
+handlers are told when a symbol loses its last interest, whoever held it.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+from app.core.redis_client import RedisClient, get_redis
+
+
+StreamEntry = Tuple[str, Dict[str, str]]
+BatchHandler = Callable[[List[StreamEntry]], Awaitable[None]]
+
+
+def stream_id_ms(entry_id: str) -> int:
+    """Millisecond timestamp part of a stream entry ID."""
+    return int(entry_id.split("-", 1)[0])
+
+
+def stream_id_key(entry_id: str) -> Tuple[int, int]:
+    """Sort key ordering stream entry IDs of different streams."""
+    ms, _, sequence = entry_id.partition("-")
+    return int(ms), int(sequence or 0)
+
+
+def _is_after(entry_id: str, after_id: Optional[str]) -> bool:
+    return after_id is not None and stream_id_key(entry_id) > stream_id_key(after_id)
+
+
+class TickStreamConsumer:
+    """Blocking XREAD loop over one stream (or the interesting per-symbol streams)."""
+
+    def __init__(
+        self,
+        stream: str = "ticks",
+        batch_size: int = 500,
+        block_ms: int = 1000,
+        replay_limit: int = 1000,
+        reconnect_delay: float = 1.0,
+        max_reconnect_delay: float = 30.0,
+        per_symbol: bool = False
+    ):
+        self.stream = stream
+        self.per_symbol = per_symbol
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.replay_limit = replay_limit
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self.last_id: Optional[str] = None
+        self.interest: Dict[str, int] = {}
+        self.last_ids: Dict[str, str] = {}  # Per-symbol stream -> last handled ID
+        self._interest_changed = asyncio.Event()
+        self._handlers: List[BatchHandler] = []
+        self._release_handlers: List[Callable[[str], None]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._redis_client = None
+
+        # Metrics
+        self.entries = 0
+        self.batches = 0
+        self.replayed = 0
+        self.errors = 0
+        self.lag_ms = 0
+
+    def add_handler(self, handler: BatchHandler):
+        """Register a handler for each batch of new entries."""
+        self._handlers.append(handler)
+
+    def add_release_handler(self, handler: Callable[[str], None]):
+        """Register a handler called with each symbol that loses its last interest."""
+        self._release_handlers.append(handler)
+
+    def add_interest(self, symbols: Iterable[str]) -> List[str]:
+        """Count a subscription to each symbol; returns the symbols that gained interest."""
+        gained = []
+        for symbol in symbols:
+            symbol = symbol.lower()
+            self.interest[symbol] = self.interest.get(symbol, 0) + 1
+            if self.interest[symbol] == 1:
+                gained.append(symbol)
+        if gained:
+            self._interest_changed.set()
+        return gained
+
+    def remove_interest(self, symbols: Iterable[str]) -> List[str]:
+        """Release subscriptions; returns the symbols nobody is interested in any more."""
+        released = []
+        for symbol in symbols:
+            symbol = symbol.lower()
+            if symbol not in self.interest:
+                continue
+            self.interest[symbol] -= 1
+            if not self.interest[symbol]:
+                del self.interest[symbol]
+                self.last_ids.pop(RedisClient.tick_stream_key(symbol), None)
+                released.append(symbol)
+                for handler in self._release_handlers:
+                    handler(symbol)
+        if released:
+            self._interest_changed.set()
+        return released
+
+    async def start(self, redis_client=None):
+        """Start tailing from the current end of the stream."""
+        if self._task:
+            return
+        self._redis_client = redis_client or await get_redis()
+        self._task = asyncio.create_task(self._run())
+        source = "per-symbol streams" if self.per_symbol else self.stream
+        logger.info(f"Tick stream consumer started on {source}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def replay(self, after_ids: Dict[str, str]) -> List[StreamEntry]:
+        """
+        Entries for each symbol after its last-seen ID, up to the last dispatched ID.
+        
+        `after_ids` maps symbol -> the last entry ID the client saw for it.
+        IDs of the per-symbol streams are only comparable within one symbol,
+        hence one ID each (with the fan-in stream they may all be the same).
+        Entries newer than the last dispatched ID are still to be dispatched
+        live, so replay and live delivery meet without a gap (an entry may
+        arrive twice; IDs only increase, so clients drop IDs they have
+        already seen). Limited to replay_limit entries per stream, whose
+        older history may also have been trimmed.
+        """
+        after_ids = {symbol.lower(): entry_id for symbol, entry_id in after_ids.items() if entry_id}
+        if not after_ids:
+            return []
+        redis_client = self._redis_client or await get_redis()
+        if self.per_symbol:
+            return await self._replay_per_symbol(redis_client, after_ids)
+        end = self.last_id or "+"
+        entries = await redis_client.redis.xrange(
+            self.stream, min=min(after_ids.values(), key=stream_id_key), max=end, count=self.replay_limit
+        )
+        missed = [
+            (entry_id, fields) for entry_id, fields in entries
+            if _is_after(entry_id, after_ids.get(fields.get("symbol", "").lower()))
+        ]
+        self.replayed += len(missed)
+        return missed
+
+    async def _replay_per_symbol(self, redis_client, after_ids: Dict[str, str]) -> List[StreamEntry]:
+        keys = {symbol: RedisClient.tick_stream_key(symbol) for symbol in sorted(after_ids)}
+        async with redis_client.redis.pipeline(transaction=False) as pipe:
+            for symbol, key in keys.items():
+                pipe.xrange(key, min=after_ids[symbol], max=self.last_ids.get(key, "+"), count=self.replay_limit)
+            results = await pipe.execute()
+        missed = sorted(
+            (
+                (entry_id, fields)
+                for symbol, entries in zip(keys, results) for entry_id, fields in entries
+                if _is_after(entry_id, after_ids[symbol])
+            ),
+            key=lambda entry: stream_id_key(entry[0])
+        )[:self.replay_limit]
+        self.replayed += len(missed)
+        return missed
+
+    def get_stats(self) -> Dict:
+        return {
+            "stream": "ticks:{symbol}" if self.per_symbol else self.stream,
+            "symbols": len(self.interest),
+            "running": self._task is not None and not self._task.done(),
+            "last_id": self.last_id,
+            "entries": self.entries,
+            "batches": self.batches,
+            "avg_batch": self.entries / self.batches if self.batches else 0.0,
+            "replayed": self.replayed,
+            "errors": self.errors,
+            "lag_ms": self.lag_ms
+        }
+
+    async def _run(self):
+        delay = self.reconnect_delay
+        while True:
+            try:
+                redis = self._redis_client.redis
+                if self.per_symbol:
+                    await self._read_interest(redis)
+                    delay = self.reconnect_delay
+                    continue
+                if self.last_id is None:
+                    # Start at the current tail; earlier entries are served by replay()
+                    latest = await redis.xrevrange(self.stream, count=1)
+                    self.last_id = latest[0][0] if latest else "0-0"
+
+                response = await redis.xread(
+                    {self.stream: self.last_id}, count=self.batch_size, block=self.block_ms
+                )
+                delay = self.reconnect_delay
+                for _, entries in response or []:
+                    if entries:
+                        await self._dispatch(entries)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # last_id is kept, so the next XREAD resumes where this one stopped
+                self.errors += 1
+                logger.error(f"Tick stream consumer error, retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _read_interest(self, redis):
+        """One XREAD over the streams of the symbols with interest."""
+        if not self.interest:
+            self._interest_changed.clear()
+            await self._interest_changed.wait()
+            return
+        self._interest_changed.clear()
+
+        streams = [RedisClient.tick_stream_key(symbol) for symbol in self.interest]
+        new = [stream for stream in streams if stream not in self.last_ids]
+        if new:
+            # Start new streams at their current tail, like the fan-in stream
+            async with redis.pipeline(transaction=False) as pipe:
+                for stream in new:
+                    pipe.xrevrange(stream, count=1)
+                tails = await pipe.execute()
+            for stream, latest in zip(new, tails):
+                self.last_ids[stream] = latest[0][0] if latest else "0-0"
+
+        response = await redis.xread(
+            {stream: self.last_ids[stream] for stream in streams},
+            count=self.batch_size,
+            block=self.block_ms
+        )
+        batch = []
+        for stream, entries in response or []:
+            # Interest may have been released while the XREAD was blocked
+            if entries and stream in self.last_ids:
+                self.last_ids[stream] = entries[-1][0]
+                batch.extend(entries)
+        if batch:
+            batch.sort(key=lambda entry: stream_id_key(entry[0]))
+            await self._dispatch(batch)
+
+    async def _dispatch(self, entries: List[StreamEntry]):
+        self.batches += 1
+        self.entries += len(entries)
+        # Advanced before dispatching: a client joining mid-batch gets the
+        # whole batch from replay(), at worst with duplicates it can drop by ID
+        self.last_id = entries[-1][0]
+        self.lag_ms = max(int(time.time() * 1000) - stream_id_ms(self.last_id), 0)
+        for handler in self._handlers:
+            try:
+                await handler(entries)
+            except Exception as e:
+                logger.error(f"Error in tick stream handler: {e}")
+
+
+# Global consumer of the fan-in ticks stream, or of the per-symbol streams
+tick_stream_consumer = TickStreamConsumer(
+    stream="ticks",
+    batch_size=settings.TICK_STREAM_BATCH_SIZE,
+    block_ms=settings.TICK_STREAM_BLOCK_MS,
+    replay_limit=settings.TICK_STREAM_REPLAY_LIMIT,
+    per_symbol=settings.TICK_STREAM_PER_SYMBOL
+)
+
+
+def get_tick_stream_consumer() -> TickStreamConsumer:
+    """Get the global tick stream consumer."""
+    return tick_stream_consumer
@@ -0,0 +1,109 @@
+"""
+Local market-data simulator serving the upstream APIs MKTO consumes
+
+Serves Stooq-format CSV quotes and bars, Yahoo-format quote JSON and FMP
+profiles from app.services.market_simulator, at the same URL paths as the
+real services. Point the backend at it with:
+
+    STOOQ_BASE_URL=http://localhost:8090/stooq/q
+    YAHOO_BASE_URL=http://localhost:8090/yahoo/v7/finance
+    FMP_BASE_URL=http://localhost:8090/fmp/api/v3
+
+Run with: uvicorn app.simulator_main:app --port 8090
+"""
+
+import asyncio
+import io
+import random
+from datetime import datetime
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from app.core.config import settings
+from app.services.market_simulator import create_market_simulator
+
+
+app = FastAPI(
+    title="MKTO Market Simulator",
+    description="Synthetic Stooq/Yahoo/FMP endpoints for offline load testing",
+    version="1.0.0"
+)
+
+simulator = create_market_simulator()
+
+
+async def _inject_faults():
+    """Optional latency and error injection to exercise circuit breakers."""
+    if settings.SIM_LATENCY_MS:
+        await asyncio.sleep(random.expovariate(1000 / settings.SIM_LATENCY_MS))
+    if settings.SIM_ERROR_RATE and random.random() < settings.SIM_ERROR_RATE:
+        raise HTTPException(status_code=503, detail="Simulated upstream failure")
+
+
+@app.get("/stooq/q/l/", response_class=PlainTextResponse)
+async def stooq_quote(s: str):
+    """Stooq last quote: SYMBOL,YYYYMMDD,last,high,low,volume"""
+    await _inject_faults()
+    quote = simulator.quote(s)
+    if not quote:
+        return "N/D"
+    return (
+        f"{quote['symbol']},{quote['date']},{quote['last_price']},"
+        f"{quote['high']},{quote['low']},{quote['volume']:.0f}\n"
+    )
+
+
+@app.get("/stooq/q/d/l/", response_class=PlainTextResponse)
+async def stooq_bars(s: str, i: int = 5):
+    """Stooq intraday bars CSV (`i` in minutes)."""
+    await _inject_faults()
+    bars = simulator.bars(s, i * 60, settings.SIM_BAR_HISTORY)
+    if not len(bars):
+        return "No data"
+
+    out = io.StringIO()
+    out.write("Date,Time,Open,High,Low,Close,Volume\n")
+    for ts, open_, high, low, close, volume in zip(
+        bars.time.tolist(), bars.open.tolist(), bars.high.tolist(),
+        bars.low.tolist(), bars.close.tolist(), bars.volume.tolist()
+    ):
+        stamp = datetime.utcfromtimestamp(ts)
+        out.write(f"{stamp:%Y-%m-%d},{stamp:%H:%M:%S},{open_:.4f},{high:.4f},{low:.4f},{close:.4f},{volume:.0f}\n")
+    return out.getvalue()
+
+
+@app.get("/yahoo/v7/finance/quote")
+async def yahoo_quote(symbols: str):
+    """Yahoo quoteResponse JSON for comma-separated symbols."""
+    await _inject_faults()
+    result = []
+    for symbol in symbols.split(","):
+        quote = simulator.quote(f"{symbol.strip().lower()}.us")
+        if quote:
+            result.append({
+                "symbol": symbol.strip().upper(),
+                "regularMarketPrice": quote["last_price"],
+                "regularMarketDayHigh": quote["high"],
+                "regularMarketDayLow": quote["low"],
+                "regularMarketVolume": quote["volume"]
+            })
+    return {"quoteResponse": {"result": result, "error": None}}
+
+
+@app.get("/fmp/api/v3/profile/{symbol}")
+async def fmp_profile(symbol: str):
+    """FMP company profile list."""
+    await _inject_faults()
+    return [simulator.profile(symbol)]
+
+
+@app.get("/symbols")
+async def list_symbols():
+    """The generated symbol universe (for DEFAULT_TICKERS in load tests)."""
+    return {"symbols": simulator.symbols}
+
+
+@app.get("/stats")
+async def simulator_stats():
+    return simulator.get_stats()
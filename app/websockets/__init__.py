@@ -3,25 +3,141 @@ WebSocket handlers for real-time data streaming.
 """
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from typing import List, Dict, Set
+from typing import Iterable, List, Dict, Optional, Set, Union
 import asyncio
-import json
 from loguru import logger
 
+from app.core import encoding
+from app.core.config import settings
+from app.core.encoding import Frame
 from app.core.redis_client import get_redis
 from app.services.data_service import get_data_service
+from app.websockets.conflation import Conflator
+from app.websockets.outbound import OutboundQueue
+
+
+class SubscriptionIndex:
+    """
+    Two-way subscription index: key -> connections and connection -> keys.
+    
+    Both sides are sets, so subscribe/unsubscribe are O(1) per key,
+    duplicates are impossible, and routing a message for a key costs
+    O(subscribers of that key).
+    """
+    
+    def __init__(self):
+        self._subscribers: Dict[str, Set[WebSocket]] = {}
+        self._keys: Dict[WebSocket, Set[str]] = {}
+    
+    def add(self, websocket: WebSocket, keys: Iterable[str]) -> List[str]:
+        """Subscribe to keys; returns the keys that were not already subscribed."""
+        own = self._keys.setdefault(websocket, set())
+        added = []
+        for key in keys:
+            if key in own:
+                continue
+            own.add(key)
+            self._subscribers.setdefault(key, set()).add(websocket)
+            added.append(key)
+        if not own:
+            del self._keys[websocket]
+        return added
+    
+    def remove(self, websocket: WebSocket, keys: Optional[Iterable[str]] = None) -> List[str]:
+        """Unsubscribe from keys (all of them if None); returns the keys removed."""
+        own = self._keys.get(websocket)
+        if not own:
+            return []
+        removed = []
+        for key in list(own if keys is None else keys):
+            if key not in own:
+                continue
+            own.discard(key)
+            subscribers = self._subscribers[key]
+            subscribers.discard(websocket)
+            if not subscribers:
+                del self._subscribers[key]
+            removed.append(key)
+        if not own:
+            del self._keys[websocket]
+        return removed
+    
+    def subscribers(self, key: str) -> Set[WebSocket]:
+        return self._subscribers.get(key, set())
+    
+    def keys_of(self, websocket: WebSocket) -> Set[str]:
+        return self._keys.get(websocket, set())
+    
+    def keys(self) -> List[str]:
+        return list(self._subscribers)
+    
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "keys": len(self._subscribers),
+            "connections": len(self._keys),
+            "subscriptions": sum(len(keys) for keys in self._keys.values())
+        }
 
 
 class ConnectionManager:
-    """Manages WebSocket connections."""
+    """
+    Manages WebSocket connections.
+    
+    Besides the per-endpoint channels, connections subscribe to topics
+    (e.g. `bars:aapl.us:300`, `events:risk`) and, per stream such as
+    "market_data" or "quotes", to symbols. The pub/sub hub and the tick
+    stream consumer route each message to exactly those subscribers,
+    serialized once for all.
+    
+    Sends go through each connection's OutboundQueue, so fan-out never
+    waits on a slow client. Connections that asked for conflation get a
+    Conflator instead of every tick.
+    
+    Messages may be passed as a Frame (or dict), which is encoded once per
+    encoding in use among the recipients; plain strings are sent as-is.
+    """
     
     def __init__(self):
         self.active_connections: Dict[str, Set[WebSocket]] = {}
         self.connection_count = 0
+        self.topics = SubscriptionIndex()
+        self.symbols: Dict[str, SubscriptionIndex] = {}
+        self.queues: Dict[WebSocket, OutboundQueue] = {}
+        self.conflators: Dict[WebSocket, Conflator] = {}
+        self.encodings: Dict[WebSocket, str] = {}
+        self.send_errors = 0
+        self._connection_ids = 0
     
-    async def connect(self, websocket: WebSocket, channel: str):
-        """Accept and store WebSocket connection."""
+    async def connect(
+        self,
+        websocket: WebSocket,
+        channel: str,
+        policy: Optional[str] = None,
+        encoding_name: Optional[str] = None
+    ):
+        """
+        Accept and store WebSocket connection.
+        
+        Args:
+            policy: Slow-consumer policy for the connection's send buffer
+                (drop_oldest, coalesce, disconnect); defaults to settings
+            encoding_name: Frame encoding (json, msgpack, struct); defaults to json
+        """
+        # Validate before accepting so a bad policy or encoding is a handshake error
+        negotiated = encoding.negotiate(encoding_name)
+        # An opaque id, so stats and logs never carry the client's address
+        self._connection_ids += 1
+        queue = OutboundQueue(
+            websocket,
+            max_size=settings.WS_SEND_QUEUE_SIZE,
+            policy=policy or settings.WS_SLOW_CONSUMER_POLICY,
+            send_timeout=settings.WS_SEND_TIMEOUT_SECONDS,
+            label=f"{channel}#{self._connection_ids}"
+        )
         await websocket.accept()
+        queue.start()
+        self.queues[websocket] = queue
+        self.encodings[websocket] = negotiated
         
         if channel not in self.active_connections:
             self.active_connections[channel] = set()
@@ -32,44 +148,208 @@ class ConnectionManager:
         logger.info(f"WebSocket connected to {channel}. Total connections: {self.connection_count}")
     
     def disconnect(self, websocket: WebSocket, channel: str):
-        """Remove WebSocket connection."""
-        if channel in self.active_connections:
-            self.active_connections[channel].discard(websocket)
-            if not self.active_connections[channel]:
-                del self.active_connections[channel]
+        """Remove WebSocket connection and all of its subscriptions."""
+        self.topics.remove(websocket)
+        for index in self.symbols.values():
+            index.remove(websocket)
+        queue = self.queues.pop(websocket, None)
+        if queue is not None:
+            queue.stop()
+        conflator = self.conflators.pop(websocket, None)
+        if conflator is not None:
+            conflator.stop()
+        self.encodings.pop(websocket, None)
+        connections = self.active_connections.get(channel)
+        if connections is None or websocket not in connections:
+            # Rejected during the handshake (e.g. an invalid policy)
+            return
+        connections.discard(websocket)
+        if not connections:
+            del self.active_connections[channel]
         
         self.connection_count -= 1
         logger.info(f"WebSocket disconnected from {channel}. Total connections: {self.connection_count}")
     
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        """Send message to specific WebSocket."""
+    # Topics
+    
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]):
+        """Add the connection to each topic's subscriber set."""
+        self.topics.add(websocket, topics)
+    
+    def unsubscribe(self, websocket: WebSocket, topics: Optional[Iterable[str]] = None):
+        """Remove the connection from the given topics (all of its topics if None)."""
+        self.topics.remove(websocket, topics)
+    
+    def subscribers(self, topic: str) -> Set[WebSocket]:
+        """Connections subscribed to a topic."""
+        return self.topics.subscribers(topic)
+    
+    def topics_with_prefix(self, prefix: str) -> List[str]:
+        """Subscribed topics starting with `prefix`."""
+        return [topic for topic in self.topics.keys() if topic.startswith(prefix)]
+    
+    # Symbols
+    
+    def subscribe_symbols(self, websocket: WebSocket, stream: str, symbols: Iterable[str]) -> List[str]:
+        """Subscribe to symbols of a stream; returns the newly subscribed ones."""
+        index = self.symbols.setdefault(stream, SubscriptionIndex())
+        return index.add(websocket, (symbol.strip().lower() for symbol in symbols if symbol.strip()))
+    
+    def unsubscribe_symbols(
+        self,
+        websocket: WebSocket,
+        stream: str,
+        symbols: Optional[Iterable[str]] = None
+    ) -> List[str]:
+        """Unsubscribe from symbols of a stream (all if None); returns the removed ones."""
+        index = self.symbols.get(stream)
+        if index is None:
+            return []
+        if symbols is not None:
+            symbols = [symbol.strip().lower() for symbol in symbols]
+        return index.remove(websocket, symbols)
+    
+    def symbol_subscribers(self, stream: str, symbol: str) -> Set[WebSocket]:
+        """Connections subscribed to a symbol on a stream."""
+        index = self.symbols.get(stream)
+        return index.subscribers(symbol) if index is not None else set()
+    
+    def symbols_of(self, websocket: WebSocket, stream: str) -> List[str]:
+        """A connection's symbols on a stream, sorted."""
+        index = self.symbols.get(stream)
+        return sorted(index.keys_of(websocket)) if index is not None else []
+    
+    # Conflation
+    
+    def conflate(self, websocket: WebSocket, conflator: Conflator):
+        """Deliver the connection's symbol updates through a started conflator."""
+        conflator.start()
+        self.conflators[websocket] = conflator
+    
+    def split_conflated(self, connections: Iterable[WebSocket]):
+        """Split connections into (conflators, connections receiving every message)."""
+        conflators, direct = [], []
+        for connection in connections:
+            conflator = self.conflators.get(connection)
+            if conflator is not None:
+                conflators.append(conflator)
+            else:
+                direct.append(connection)
+        return conflators, direct
+    
+    # Sending
+    
+    def encoding_of(self, websocket: WebSocket) -> str:
+        return self.encodings.get(websocket, encoding.JSON)
+    
+    def encode_for(self, websocket: WebSocket, message: Union[str, dict, Frame]) -> encoding.Payload:
+        """The payload to send a message to a connection in its encoding."""
+        if isinstance(message, dict):
+            message = Frame(message)
+        if isinstance(message, Frame):
+            return message.encode(self.encoding_of(websocket))
+        return message
+    
+    async def send_to(self, connections: Iterable[WebSocket], message: Union[str, Frame], key=None):
+        """
+        Send one message to several connections, serialized once per encoding.
+        
+        Queued connections only get an O(1) enqueue; `key` lets a coalescing
+        queue replace a pending message for the same key (use it only for
+        full-state messages such as a symbol's latest quote). Connections
+        without a queue are written directly and concurrently. Failed sends
+        are only counted: the connection's own handler sees the disconnect
+        and releases its subscriptions.
+        """
+        direct = []
+        for connection in connections:
+            queue = self.queues.get(connection)
+            if queue is not None:
+                queue.put(self.encode_for(connection, message), key)
+            else:
+                direct.append(connection)
+        if not direct:
+            return
+        results = await asyncio.gather(
+            *(_send(connection, self.encode_for(connection, message)) for connection in direct),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                self.send_errors += 1
+                logger.debug(f"Error sending to subscriber: {result}")
+    
+    async def send_to_topic(self, topic: str, message: Union[str, Frame], key=None):
+        """Send one message to a topic's subscribers."""
+        await self.send_to(self.subscribers(topic), message, key)
+    
+    def get_stats(self, top_n: Optional[int] = None) -> Dict:
+        """
+        Aggregate connection stats; the payload does not grow with the connections.
+        
+        Args:
+            top_n: How many of the deepest send queues to list by connection id
+                (defaults to settings.WS_STATS_TOP_N)
+        """
+        top_n = settings.WS_STATS_TOP_N if top_n is None else top_n
+        queues = list(self.queues.values())
+        conflators = list(self.conflators.values())
+        updates = sum(conflator.updates for conflator in conflators)
+        flushed = sum(conflator.flushed for conflator in conflators)
+        return {
+            "connections": self.connection_count,
+            "channels": {channel: len(sockets) for channel, sockets in self.active_connections.items()},
+            "topics": self.topics.get_stats(),
+            "symbols": {stream: index.get_stats() for stream, index in self.symbols.items()},
+            "send_errors": self.send_errors,
+            "queued": sum(queue.depth for queue in queues),
+            "max_queue_depth": max((queue.depth for queue in queues), default=0),
+            "dropped": sum(queue.dropped for queue in queues),
+            "coalesced": sum(queue.coalesced for queue in queues),
+            "evicted": sum(queue.evicted for queue in queues),
+            "deepest_queues": [
+                {"connection": queue.label, "depth": queue.depth, "dropped": queue.dropped}
+                for queue in sorted(queues, key=lambda queue: queue.depth, reverse=True)[:top_n]
+            ],
+            "conflated": {
+                "connections": len(conflators),
+                "dirty": sum(conflator.dirty for conflator in conflators),
+                "conflation_ratio": 1 - flushed / updates if updates else 0.0
+            },
+            "encodings": {
+                name: sum(1 for used in self.encodings.values() if used == name)
+                for name in encoding.ENCODINGS
+            }
+        }
+    
+    async def send_personal_message(self, message: Union[str, dict, Frame], websocket: WebSocket):
+        """Send message to specific WebSocket (in order with its queued messages)."""
+        payload = self.encode_for(websocket, message)
+        queue = self.queues.get(websocket)
+        if queue is not None:
+            queue.put(payload)
+            return
         try:
-            await websocket.send_text(message)
+            await _send(websocket, payload)
         except Exception as e:
             logger.error(f"Error sending personal message: {e}")
     
-    async def broadcast_to_channel(self, message: str, channel: str):
+    async def broadcast_to_channel(self, message: Union[str, Frame], channel: str):
         """Broadcast message to all connections in a channel."""
         if channel not in self.active_connections:
             return
-        
-        disconnected = set()
-        
-        for connection in self.active_connections[channel]:
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                logger.error(f"Error broadcasting to {channel}: {e}")
-                disconnected.add(connection)
-        
-        # Remove disconnected connections
-        for connection in disconnected:
-            self.active_connections[channel].discard(connection)
+        await self.send_to(self.active_connections[channel], message)
     
     async def broadcast_json_to_channel(self, data: dict, channel: str):
-        """Broadcast JSON data to all connections in a channel."""
-        message = json.dumps(data)
-        await self.broadcast_to_channel(message, channel)
+        """Broadcast data to all connections in a channel, encoded once per encoding."""
+        await self.broadcast_to_channel(Frame(data), channel)
+
+
+async def _send(websocket: WebSocket, payload: encoding.Payload):
+    if isinstance(payload, bytes):
+        await websocket.send_bytes(payload)
+    else:
+        await websocket.send_text(payload)
 
 
 # Global connection manager
@@ -0,0 +1,193 @@
+"""
+Cluster - Websocket nodes registered in Redis, for cluster-wide counts
+
+Every process serving websockets (each uvicorn worker on each Fly machine)
+is a node. Its ConnectionManager only knows its own sockets, so on the
+shared timer wheel, every CLUSTER_HEARTBEAT_SECONDS, the node publishes:
+
+- `ws_node:{node_id}`:     hash of its connection, subscription and symbol
+                           counts;
+- `ws_interest:{node_id}`: set of the symbols its clients subscribe to;
+- `ws_nodes`:              sorted set of node ids scored by last heartbeat.
+
+Both keys expire after three missed heartbeats, and get_cluster_stats()
+only reads nodes that are still live, so a crashed node drops out of the
+counts without cleanup.
+
+Apart from the poller lease (app.services.poller_lease), which picks the
+one node that polls market data, nodes need no other coordination: each
+one reads only the tick streams
+and bar channels its own clients and quote cache need (TickStreamConsumer
+per_symbol, PubSubHub.add_interest), so fan-out capacity grows with the number of
+nodes. `nodes_per_symbol` in the cluster stats shows how many nodes read
+each symbol on average.
+"""
+
+import math
+import os
+import socket
+import time
+from typing import Dict, Optional, Set
+
+from loguru import logger
+
+from app.core.config import settings
+from app.core.redis_client import get_redis
+from app.websockets import manager
+from app.websockets.session import Timer, timer_wheel
+
+
+NODES_KEY = "ws_nodes"
+
+
+def default_node_id() -> str:
+    """NODE_ID, else the Fly machine (or host) and process id."""
+    if settings.NODE_ID:
+        return settings.NODE_ID
+    # Several uvicorn workers share a machine, so the pid is always part of it
+    machine = os.environ.get("FLY_MACHINE_ID") or socket.gethostname()
+    return f"{machine}-{os.getpid()}"
+
+
+class ClusterRegistry:
+    """This node's heartbeat in Redis and the cluster-wide websocket counts."""
+
+    def __init__(self, node_id: Optional[str] = None, heartbeat_interval: float = 10.0):
+        self.node_id = node_id or default_node_id()
+        self.heartbeat_interval = heartbeat_interval
+        self.ttl = math.ceil(heartbeat_interval * 3)
+        self._timer: Optional[Timer] = None
+        self._redis_client = None
+
+        # Metrics
+        self.heartbeats = 0
+        self.errors = 0
+
+    @staticmethod
+    def node_key(node_id: str) -> str:
+        return f"ws_node:{node_id}"
+
+    @staticmethod
+    def interest_key(node_id: str) -> str:
+        return f"ws_interest:{node_id}"
+
+    async def start(self, redis_client=None):
+        """Register the node and keep its heartbeat going."""
+        if self._timer is not None:
+            return
+        self._redis_client = redis_client or await get_redis()
+        await self.heartbeat()
+        self._timer = timer_wheel.every(self.heartbeat_interval, self.heartbeat)
+        logger.info(f"Websocket node {self.node_id} registered")
+
+    async def stop(self):
+        """Stop the heartbeat and deregister the node."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._redis_client is None:
+            return
+        try:
+            async with self._redis_client.redis.pipeline(transaction=False) as pipe:
+                pipe.delete(self.node_key(self.node_id), self.interest_key(self.node_id))
+                pipe.zrem(NODES_KEY, self.node_id)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error deregistering websocket node {self.node_id}: {e}")
+        self._redis_client = None
+
+    def local_state(self) -> Dict:
+        """This node's connection and subscription counts, and its symbols."""
+        symbols: Set[str] = set()
+        subscriptions = manager.topics.get_stats()["subscriptions"]
+        for index in manager.symbols.values():
+            symbols.update(index.keys())
+            subscriptions += index.get_stats()["subscriptions"]
+        return {
+            "connections": manager.connection_count,
+            "subscriptions": subscriptions,
+            "symbols": symbols
+        }
+
+    async def heartbeat(self):
+        """Publish this node's state."""
+        state = self.local_state()
+        now = time.time()
+        node_key = self.node_key(self.node_id)
+        interest_key = self.interest_key(self.node_id)
+        try:
+            # MULTI, so readers never see the interest set half replaced
+            async with self._redis_client.redis.pipeline(transaction=True) as pipe:
+                pipe.hset(node_key, mapping={
+                    "connections": state["connections"],
+                    "subscriptions": state["subscriptions"],
+                    "symbols": len(state["symbols"]),
+                    "updated": now
+                })
+                pipe.expire(node_key, self.ttl)
+                pipe.delete(interest_key)
+                if state["symbols"]:
+                    pipe.sadd(interest_key, *state["symbols"])
+                    pipe.expire(interest_key, self.ttl)
+                pipe.zadd(NODES_KEY, {self.node_id: now})
+                pipe.zremrangebyscore(NODES_KEY, "-inf", now - self.ttl)
+                await pipe.execute()
+            self.heartbeats += 1
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Websocket node {self.node_id} heartbeat failed: {e}")
+
+    async def get_cluster_stats(self) -> Dict:
+        """Connection, subscription and symbol counts summed over the live nodes."""
+        redis = (self._redis_client or await get_redis()).redis
+        now = time.time()
+        nodes = await redis.zrangebyscore(NODES_KEY, now - self.ttl, "+inf")
+        async with redis.pipeline(transaction=False) as pipe:
+            for node in nodes:
+                pipe.hgetall(self.node_key(node))
+            for node in nodes:
+                pipe.smembers(self.interest_key(node))
+            results = await pipe.execute()
+
+        by_node = {}
+        symbols: Set[str] = set()
+        symbol_reads = 0
+        for node, state, interest in zip(nodes, results[:len(nodes)], results[len(nodes):]):
+            if not state:
+                # Expired between the two reads
+                continue
+            by_node[node] = {
+                "connections": int(state.get("connections", 0)),
+                "subscriptions": int(state.get("subscriptions", 0)),
+                "symbols": int(state.get("symbols", 0)),
+                "age_seconds": round(now - float(state.get("updated", now)), 1)
+            }
+            symbols.update(interest)
+            symbol_reads += len(interest)
+
+        return {
+            "node_id": self.node_id,
+            "nodes": len(by_node),
+            "connections": sum(node["connections"] for node in by_node.values()),
+            "subscriptions": sum(node["subscriptions"] for node in by_node.values()),
+            "symbols": len(symbols),
+            "nodes_per_symbol": symbol_reads / len(symbols) if symbols else 0.0,
+            "by_node": by_node
+        }
+
+    def get_stats(self) -> Dict:
+        return {
+            "node_id": self.node_id,
+            "registered": self._timer is not None,
+            "heartbeats": self.heartbeats,
+            "errors": self.errors
+        }
+
+
+# Registry of this process's websocket node
+cluster = ClusterRegistry(heartbeat_interval=settings.CLUSTER_HEARTBEAT_SECONDS)
+
+
+def get_cluster() -> ClusterRegistry:
+    """Get the cluster registry."""
+    return cluster
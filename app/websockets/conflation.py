@@ -0,0 +1,107 @@
+"""
+Conflation - Latest-value-per-symbol delivery at a client-chosen rate
+
+A conflating connection does not receive every tick. Updates for its
+symbols are merged into a per-connection "dirty symbols" map, and at most
+max_rate times per second the latest value of each dirty symbol is flushed
+as one message per symbol:
+
+- a snapshot replaces whatever is pending for the symbol;
+- a delta is merged into the pending snapshot or delta, so the flushed
+  message still applies cleanly to the client's state.
+
+Bandwidth and serialization cost per client are therefore bounded by its
+refresh rate and symbol count, not by the tick rate. An update arriving
+after an idle period is flushed immediately.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from loguru import logger
+
+from app.services.tick_deltas import DELTA
+
+
+# symbol -> {"kind", "data", "conflated", plus metadata of the latest update}
+Pending = Dict[str, Dict[str, Any]]
+FlushHandler = Callable[[Pending], Awaitable[None]]
+
+
+class Conflator:
+    """Dirty-symbols map of one connection, flushed at most max_rate times a second."""
+
+    def __init__(self, flush: FlushHandler, max_rate: float, label: str = ""):
+        if max_rate <= 0:
+            raise ValueError(f"max_rate must be positive, got {max_rate}")
+        self.flush = flush
+        self.max_rate = max_rate
+        self.interval = 1.0 / max_rate
+        self.label = label
+
+        self._pending: Pending = {}
+        self._dirty = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.updates = 0
+        self.flushed = 0
+        self.flushes = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task and not self._task.done() and self._task is not asyncio.current_task():
+            self._task.cancel()
+        self._task = None
+        self._pending.clear()
+
+    def update(self, symbol: str, kind: str, data: Dict, **meta):
+        """Merge one update into the symbol's pending value; never waits."""
+        self.updates += 1
+        pending = self._pending.get(symbol)
+        if pending is None or kind != DELTA:
+            self._pending[symbol] = {**meta, "kind": kind, "data": dict(data), "conflated": 1}
+        else:
+            # Delta on top of a pending snapshot or delta keeps the pending kind
+            pending["data"].update(data)
+            pending.update(meta)
+            pending["conflated"] += 1
+        self._dirty.set()
+
+    @property
+    def dirty(self) -> int:
+        return len(self._pending)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "connection": self.label,
+            "max_rate": self.max_rate,
+            "dirty": self.dirty,
+            "updates": self.updates,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "conflation_ratio": 1 - self.flushed / self.updates if self.updates else 0.0
+        }
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            started = time.monotonic()
+
+            pending, self._pending = self._pending, {}
+            self.flushes += 1
+            self.flushed += len(pending)
+            try:
+                await self.flush(pending)
+            except Exception as e:
+                logger.error(f"Conflated flush to {self.label} failed: {e}")
+
+            # Rate limit: the next flush waits for the rest of this interval
+            remaining = self.interval - (time.monotonic() - started)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+
@@ -5,159 +5,357 @@ Streams live market data from Redis to connected clients.
 """
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
+from typing import List, Optional, Tuple
 import asyncio
-import json
 import redis.asyncio as aioredis
 from loguru import logger
 
+from app.core.encoding import Frame, loads
 from app.websockets import manager
-from app.core.redis_client import get_redis
+from app.websockets.conflation import Conflator, Pending
+from app.websockets.hub import hub
+from app.websockets.session import WebSocketSession
+from app.services.tick_stream_consumer import tick_stream_consumer
+from app.core.redis_client import RedisClient, get_redis
 from app.core.config import settings
+from app.services.data_service import data_service
+from app.services.tick_deltas import SNAPSHOT, TickState
 
 
 router = APIRouter()
 
+# Full quotes rebuilt from tick snapshots/deltas, shared by all quote sockets
+_quote_state = TickState()
+
 
 @router.websocket("/data")
 async def websocket_market_data(
     websocket: WebSocket,
     symbols: str = "aapl.us,msft.us,goog.us,tsla.us",
+    last_id: Optional[str] = None,
+    last_ids: Optional[str] = None,
+    overflow: Optional[str] = None,
+    max_rate: Optional[float] = None,
+    encoding: Optional[str] = None,
     redis_client = Depends(get_redis)
 ):
     """
     WebSocket endpoint for real-time market data.
     
-    Streams live price updates from Redis to connected clients.
+    Streams live price updates from the `ticks` Redis stream to connected
+    clients. Each market_data message has a `kind`: "snapshot" carries the
+    full quote, "delta" only the fields that changed since the previous
+    message for that symbol. A snapshot of every known symbol is sent on
+    subscribe.
+    
+    Messages carry a per-symbol sequence number `seq`. A snapshot sets the
+    client's state and seq; deltas with `seq` <= it are already included.
+    A delta whose `seq` is not the last one plus `conflated` (1 unless
+    conflating) means updates were missed: the client sends
+    `{"type": "resync", "symbols": [...]}` (all of its symbols if omitted)
+    and receives fresh snapshots.
+    
+    Every live message also carries its stream `id`. A reconnecting client
+    passes the last id it saw for each symbol as `last_ids` and first
+    receives the ticks it missed (without `seq`), followed by snapshots to
+    resume from. Ids are per symbol (each symbol has its own stream), so a
+    single `last_id` only resumes correctly when the server reads the
+    fan-in stream; it is used for symbols missing from `last_ids`.
+    
+    Client messages `{"type": "subscribe" | "unsubscribe", "symbols": [...]}`
+    change the subscription; repeated symbols are ignored.
+    
+    With `max_rate`, updates are conflated: at most `max_rate` times per
+    second the client gets one message per changed symbol, merging every
+    tick since the previous one (`conflated` counts them).
     
     Query Parameters:
     - symbols: Comma-separated list of symbols to subscribe to
+    - last_ids: Comma-separated `symbol:id` pairs to resume after
+    - last_id: Stream id to resume after, for symbols without one in last_ids
+    - overflow: What to do when this client falls behind: drop_oldest,
+      coalesce or disconnect (default from settings)
+    - max_rate: Conflate to at most this many updates per symbol per second
+    - encoding: Frame encoding: json (default), msgpack or struct
     """
     channel = "market_data"
+    session = WebSocketSession(websocket, channel)
     
-    try:
-        await manager.connect(websocket, channel)
+    async def on_message(message: dict):
+        if message.get("type") in ("subscribe", "unsubscribe"):
+            if message["type"] == "subscribe":
+                new_symbols = _subscribe_symbols(websocket, channel, message.get("symbols", []))
+            else:
+                _unsubscribe_symbols(websocket, channel, message.get("symbols", []))
+                new_symbols = []
+            
+            await session.send(Frame({
+                "type": "subscription_updated",
+                "subscribed_symbols": manager.symbols_of(websocket, channel)
+            }))
+            await _send_snapshots(websocket, new_symbols)
         
-        # Parse requested symbols
-        symbol_list = [s.strip().lower() for s in symbols.split(",")]
+        elif message.get("type") == "resync":
+            subscribed = manager.symbols_of(websocket, channel)
+            requested = {symbol.strip().lower() for symbol in message.get("symbols") or subscribed}
+            await _send_snapshots(websocket, [symbol for symbol in subscribed if symbol in requested])
+    
+    try:
+        conflator = _conflator(websocket, channel, max_rate, _flush_market_data)
+        await session.open(policy=overflow, encoding_name=encoding)
+        if conflator is not None:
+            manager.conflate(websocket, conflator)
+        _subscribe_symbols(websocket, channel, symbols.split(","))
+        symbol_list = manager.symbols_of(websocket, channel)
         
         # Send initial connection message
-        await manager.send_personal_message(
-            json.dumps({
-                "type": "connection",
-                "status": "connected",
-                "subscribed_symbols": symbol_list,
-                "message": "Market data stream connected"
-            }),
-            websocket
-        )
-        
-        # Start Redis subscription in background
-        subscription_task = asyncio.create_task(
-            _stream_market_data(websocket, symbol_list, redis_client)
-        )
+        await session.send(Frame({
+            "type": "connection",
+            "status": "connected",
+            "subscribed_symbols": symbol_list,
+            "message": "Market data stream connected"
+        }))
+        after_ids = _parse_last_ids(last_ids)
+        resume = {
+            symbol: after_ids.get(symbol, last_id) for symbol in symbol_list
+            if after_ids.get(symbol, last_id)
+        }
+        if resume:
+            await _send_missed_ticks(websocket, resume)
+        await _send_snapshots(websocket, symbol_list)
         
-        # Keep connection alive and handle client messages
-        while True:
-            try:
-                # Wait for messages from client
-                data = await websocket.receive_text()
-                message = json.loads(data)
-                
-                # Handle client messages
-                if message.get("type") == "subscribe":
-                    new_symbols = message.get("symbols", [])
-                    symbol_list.extend(new_symbols)
-                    
-                    await manager.send_personal_message(
-                        json.dumps({
-                            "type": "subscription_updated",
-                            "subscribed_symbols": symbol_list
-                        }),
-                        websocket
-                    )
-                
-                elif message.get("type") == "ping":
-                    await manager.send_personal_message(
-                        json.dumps({
-                            "type": "pong",
-                            "timestamp": message.get("timestamp")
-                        }),
-                        websocket
-                    )
-                
-            except WebSocketDisconnect:
-                break
-            except json.JSONDecodeError:
-                await manager.send_personal_message(
-                    json.dumps({
-                        "type": "error",
-                        "message": "Invalid JSON format"
-                    }),
-                    websocket
-                )
-            except Exception as e:
-                logger.error(f"Error in WebSocket message handling: {e}")
-                break
+        # Ticks arrive through the tick stream consumer
+        await session.serve(on_message)
     
     except WebSocketDisconnect:
         logger.info("Market data WebSocket disconnected")
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
     finally:
-        manager.disconnect(websocket, channel)
-        if 'subscription_task' in locals():
-            subscription_task.cancel()
+        _unsubscribe_symbols(websocket, channel)
+        session.close()
 
 
-async def _stream_market_data(
-    websocket: WebSocket,
-    symbol_list: list,
-    redis_client
-):
-    """Stream market data from Redis to WebSocket."""
-    try:
-        # Create Redis pub/sub connection
-        pubsub = redis_client.redis.pubsub()
-        await pubsub.subscribe("ticks")
-        
-        logger.info(f"Started market data stream for symbols: {symbol_list}")
-        
-        async for message in pubsub.listen():
-            if message["type"] == "message":
-                try:
-                    # Parse tick data
-                    tick_data = json.loads(message["data"])
-                    symbol = tick_data.get("symbol", "").lower()
-                    
-                    # Filter by subscribed symbols
-                    if symbol in symbol_list or not symbol_list:
-                        # Format message for client
-                        client_message = {
-                            "type": "market_data",
-                            "symbol": symbol,
-                            "data": json.loads(tick_data.get("data", "{}")),
-                            "timestamp": tick_data.get("timestamp")
-                        }
-                        
-                        await manager.send_personal_message(
-                            json.dumps(client_message),
-                            websocket
-                        )
-                        
-                except json.JSONDecodeError as e:
-                    logger.error(f"Error parsing tick data: {e}")
-                except Exception as e:
-                    logger.error(f"Error processing tick data: {e}")
+def _conflator(websocket: WebSocket, channel: str, max_rate: Optional[float], flush) -> Optional[Conflator]:
+    """A conflator for a client that asked for `max_rate` (capped by settings), else None."""
+    if max_rate is None:
+        return None
+    return Conflator(
+        lambda pending: flush(websocket, pending),
+        min(max_rate, settings.WS_MAX_CONFLATION_RATE),
+        label=channel
+    )
+
+
+async def _flush_market_data(websocket: WebSocket, pending: Pending):
+    for symbol, update in pending.items():
+        await manager.send_personal_message(
+            _market_data_message(
+                update["id"], {**update, "symbol": symbol}, update["data"],
+                conflated=update["conflated"], seq=update["seq"]
+            ),
+            websocket
+        )
+
+
+async def _flush_quotes(websocket: WebSocket, pending: Pending):
+    for symbol, update in pending.items():
+        await manager.send_personal_message(
+            _quote_message(symbol, update["data"], update["timestamp"]),
+            websocket
+        )
+
+
+def _subscribe_symbols(websocket: WebSocket, stream: str, symbols: list) -> list:
+    """Index the connection under each symbol and count new ones as poll and stream demand."""
+    added = manager.subscribe_symbols(websocket, stream, symbols)
+    data_service.scheduler.add_subscriptions(added)
+    tick_stream_consumer.add_interest(added)
+    return added
+
+
+def _unsubscribe_symbols(websocket: WebSocket, stream: str, symbols: Optional[list] = None) -> list:
+    """Release symbol subscriptions (all if None) and their poll and stream demand."""
+    removed = manager.unsubscribe_symbols(websocket, stream, symbols)
+    data_service.scheduler.remove_subscriptions(removed)
+    tick_stream_consumer.remove_interest(removed)
+    return removed
+
+
+async def _send_snapshots(websocket: WebSocket, symbols: list):
+    """Send each symbol's current full quote and seq, so deltas have a base."""
+    await _seed_quotes([symbol for symbol in symbols if _current_quote(symbol) is None])
     
-    except asyncio.CancelledError:
-        logger.info("Market data stream cancelled")
+    # Built without awaiting, so every snapshot is consistent with its seq
+    frames = []
+    for symbol in symbols:
+        data = _current_quote(symbol)
+        if data is None:
+            continue
+        frames.append(Frame({
+            "type": "market_data",
+            "kind": SNAPSHOT,
+            "symbol": symbol.lower(),
+            "seq": _quote_state.seq(symbol),
+            "data": dict(data),
+            "timestamp": data.get("timestamp")
+        }))
+    for frame in frames:
+        await manager.send_personal_message(frame, websocket)
+
+
+def _current_quote(symbol: str) -> Optional[dict]:
+    """The consumer-side full quote, seeded from the data service's last published state."""
+    state = _quote_state.get(symbol)
+    if state is None:
+        for known_symbol, known in data_service.tick_tracker.snapshot([symbol]).items():
+            state = _quote_state.apply(known_symbol, SNAPSHOT, known)
+    return state
+
+
+async def _seed_quotes(symbols: list):
+    """Seed quotes this node has not seen from the tick streams (it may not be the poller)."""
+    if not symbols:
+        return
+    redis_client = await get_redis()
+    recent = await asyncio.gather(
+        *(redis_client.get_recent_ticks(symbol, count=1) for symbol in symbols)
+    )
+    for symbol, ticks in zip(symbols, recent):
+        # A tick dispatched meanwhile is newer than the stream read
+        if ticks and _quote_state.get(symbol) is None:
+            _quote_state.apply(symbol, SNAPSHOT, ticks[0])
+
+
+def _parse_last_ids(last_ids: Optional[str]) -> dict:
+    """`symbol:id,...` -> {symbol: id}, ignoring malformed items."""
+    parsed = {}
+    for item in (last_ids or "").split(","):
+        symbol, _, entry_id = item.strip().rpartition(":")
+        if symbol and entry_id:
+            parsed[symbol.lower()] = entry_id
+    return parsed
+
+
+async def _send_missed_ticks(websocket: WebSocket, after_ids: dict):
+    """Replay each symbol's ticks after its last-seen id to a resuming client (snapshots follow)."""
+    try:
+        missed = await tick_stream_consumer.replay(after_ids)
     except Exception as e:
-        logger.error(f"Error in market data stream: {e}")
-    finally:
+        logger.error(f"Error replaying ticks after {after_ids}: {e}")
+        missed = []
+    
+    for entry_id, fields in missed:
+        await manager.send_personal_message(
+            _market_data_message(entry_id, fields, loads(fields.get("data", "{}"))),
+            websocket
+        )
+
+
+def _market_data_message(
+    entry_id: Optional[str],
+    tick_data: dict,
+    data: dict,
+    conflated: Optional[int] = None,
+    seq: Optional[int] = None
+) -> Frame:
+    message = {
+        "type": "market_data",
+        "id": entry_id,
+        "kind": tick_data.get("kind", SNAPSHOT),
+        "symbol": tick_data.get("symbol", "").lower(),
+        "seq": seq,
+        "data": data,
+        "timestamp": tick_data.get("timestamp")
+    }
+    if conflated is not None:
+        message["conflated"] = conflated
+    return Frame(message)
+
+
+def _quote_message(symbol: str, tick_info: dict, timestamp) -> Frame:
+    return Frame({
+        "type": "quote",
+        "symbol": symbol,
+        "last": tick_info.get("last_price"),
+        "bid": (tick_info.get("last_price") or 0) * 0.999,  # Mock bid
+        "ask": (tick_info.get("last_price") or 0) * 1.001,  # Mock ask
+        "high": tick_info.get("high"),
+        "low": tick_info.get("low"),
+        "volume": tick_info.get("volume"),
+        "timestamp": timestamp
+    })
+
+
+async def _dispatch_tick_entries(entries: List[Tuple[str, dict]]):
+    """Fan out one XREAD batch from the `ticks` stream, in stream order."""
+    for entry_id, fields in entries:
         try:
-            await pubsub.close()
-        except:
-            pass
+            await _dispatch_tick(fields, entry_id)
+        except Exception as e:
+            logger.error(f"Error dispatching tick {entry_id}: {e}")
+
+
+async def _dispatch_tick(tick_data: dict, entry_id: Optional[str] = None):
+    """
+    Route one tick to the market data and quote subscribers of its symbol.
+    
+    The tick payload is parsed once and each client format is serialized
+    once, whatever the number of subscribers. Conflating subscribers only
+    have the update merged into their pending value.
+    """
+    symbol = tick_data.get("symbol", "").lower()
+    kind = tick_data.get("kind", SNAPSHOT)
+    timestamp = tick_data.get("timestamp")
+    data = tick_data.get("data", "{}")
+    if isinstance(data, str):
+        data = loads(data)
+    
+    # Fold every tick into the full state, even without subscribers, so
+    # snapshots and quotes are current and seq counts every update
+    if kind != SNAPSHOT:
+        _current_quote(symbol)
+    tick_info = _quote_state.apply(symbol, kind, data)
+    seq = _quote_state.seq(symbol) if tick_info is not None else None
+    
+    conflators, subscribers = manager.split_conflated(manager.symbol_subscribers("market_data", symbol))
+    for conflator in conflators:
+        conflator.update(symbol, kind, data, id=entry_id, timestamp=timestamp, seq=seq)
+    if subscribers:
+        await manager.send_to(subscribers, _market_data_message(entry_id, tick_data, data, seq=seq))
+    
+    if tick_info is None:
+        return
+    conflators, subscribers = manager.split_conflated(manager.symbol_subscribers("quotes", symbol))
+    for conflator in conflators:
+        conflator.update(symbol, SNAPSHOT, tick_info, timestamp=timestamp)
+    if subscribers:
+        await manager.send_to(subscribers, _quote_message(symbol, tick_info, timestamp), key=symbol)
+
+
+async def _dispatch_bar(bar: dict):
+    """Route one aggregator bar update to the subscribers of its symbol and interval."""
+    topic = f"bars:{bar.get('symbol', '').lower()}:{bar.get('interval')}"
+    if not manager.subscribers(topic):
+        return
+    await manager.send_to_topic(topic, Frame({
+        "type": "bar_update",
+        "symbol": bar["symbol"],
+        "interval": bar["interval"] // 60,
+        "time": bar["start"],
+        "open": bar["open"],
+        "high": bar["high"],
+        "low": bar["low"],
+        "close": bar["close"],
+        "volume": bar["volume"],
+        "closed": bar["closed"]
+    }), key=None if bar["closed"] else (topic, bar["start"]))  # Running bars supersede each other
+
+
+tick_stream_consumer.add_handler(_dispatch_tick_entries)
+# A symbol no longer read by this node would have its state go stale
+tick_stream_consumer.add_release_handler(_quote_state.forget)
+hub.add_prefix_handler("bars:", _dispatch_bar)  # Per-symbol channels, subscribed on demand
 
 
 @router.websocket("/data/bars")
@@ -165,148 +363,99 @@ async def websocket_market_bars(
     websocket: WebSocket,
     symbol: str = "aapl.us",
     interval: int = 5,
+    overflow: Optional[str] = None,
+    encoding: Optional[str] = None,
     redis_client = Depends(get_redis)
 ):
     """
     WebSocket endpoint for historical price bars.
     
-    Streams historical price bar data for charting.
+    Streams historical price bar data for charting (`encoding`: json or msgpack).
     """
     channel = f"bars_{symbol}_{interval}"
+    session = WebSocketSession(websocket, channel)
+    data_service.scheduler.add_subscriptions([symbol])
+    bar_channels = []
     
     try:
-        await manager.connect(websocket, channel)
+        await session.open(policy=overflow, encoding_name=encoding)
         
-        # Send initial bars data
-        bars = await redis_client.get_market_bars(symbol)
+        # Send initial bars data (completed bars from the aggregator)
+        interval_seconds = interval * 60
+        bars = await redis_client.get_market_bars(symbol, interval_seconds)
         
         await manager.send_personal_message(
-            json.dumps({
+            Frame({
                 "type": "initial_bars",
                 "symbol": symbol,
                 "interval": interval,
-                "bars": bars[-100:] if bars else [],  # Last 100 bars
-                "count": len(bars) if bars else 0
+                "bars": bars.tail(100).to_dicts(symbol),  # Last 100 bars
+                "count": len(bars)
             }),
             websocket
         )
         
-        # Set up real-time bar updates
-        last_bar_time = None
-        
-        # Subscribe to tick stream to build bars
-        pubsub = redis_client.redis.pubsub()
-        await pubsub.subscribe("ticks")
-        
-        current_bar = None
+        # Bar updates published by the aggregator arrive through the pub/sub hub
+        manager.subscribe(websocket, [f"bars:{symbol.lower()}:{interval_seconds}"])
+        bar_channels.append(RedisClient.bar_channel(symbol))
+        await hub.add_interest(bar_channels)
         
-        async for message in pubsub.listen():
-            if message["type"] == "message":
-                try:
-                    tick_data = json.loads(message["data"])
-                    tick_symbol = tick_data.get("symbol", "").lower()
-                    
-                    if tick_symbol == symbol.lower():
-                        tick_info = json.loads(tick_data.get("data", "{}"))
-                        price = tick_info.get("last_price")
-                        
-                        if price:
-                            # Simple bar aggregation (in real implementation, use proper time windows)
-                            bar_update = {
-                                "type": "bar_update",
-                                "symbol": symbol,
-                                "interval": interval,
-                                "price": price,
-                                "timestamp": tick_data.get("timestamp")
-                            }
-                            
-                            await manager.send_personal_message(
-                                json.dumps(bar_update),
-                                websocket
-                            )
-                
-                except Exception as e:
-                    logger.error(f"Error processing bar update: {e}")
-        
-        # Keep connection alive
-        while True:
-            await asyncio.sleep(1)
+        await session.serve()
     
     except WebSocketDisconnect:
         logger.info(f"Bars WebSocket disconnected for {symbol}")
     except Exception as e:
         logger.error(f"Bars WebSocket error: {e}")
     finally:
-        manager.disconnect(websocket, channel)
+        session.close()
+        data_service.scheduler.remove_subscriptions([symbol])
+        await hub.remove_interest(bar_channels)
 
 
 @router.websocket("/data/quotes")
 async def websocket_quotes(
     websocket: WebSocket,
     symbols: str = "aapl.us,msft.us",
+    overflow: Optional[str] = None,
+    max_rate: Optional[float] = None,
+    encoding: Optional[str] = None,
     redis_client = Depends(get_redis)
 ):
     """
     WebSocket endpoint for real-time quotes.
     
-    Provides simplified quote stream with bid/ask/last prices.
+    Provides simplified quote stream with bid/ask/last prices. Quotes are
+    full state, so with `overflow=coalesce` a lagging client only receives
+    the latest pending quote per symbol, and with `max_rate` it receives at
+    most that many quotes per symbol per second. With `encoding=struct`
+    quotes are fixed 72-byte binary frames (see app.core.encoding).
     """
     channel = "quotes"
+    session = WebSocketSession(websocket, channel)
     
     try:
-        await manager.connect(websocket, channel)
-        
-        symbol_list = [s.strip().lower() for s in symbols.split(",")]
+        conflator = _conflator(websocket, channel, max_rate, _flush_quotes)
+        await session.open(policy=overflow, encoding_name=encoding)
+        if conflator is not None:
+            manager.conflate(websocket, conflator)
+        _subscribe_symbols(websocket, channel, symbols.split(","))
         
         await manager.send_personal_message(
-            json.dumps({
+            Frame({
                 "type": "quote_connection",
                 "status": "connected",
-                "symbols": symbol_list
+                "symbols": manager.symbols_of(websocket, channel)
             }),
             websocket
         )
         
-        # Subscribe to market data
-        pubsub = redis_client.redis.pubsub()
-        await pubsub.subscribe("ticks")
-        
-        async for message in pubsub.listen():
-            if message["type"] == "message":
-                try:
-                    tick_data = json.loads(message["data"])
-                    symbol = tick_data.get("symbol", "").lower()
-                    
-                    if symbol in symbol_list:
-                        tick_info = json.loads(tick_data.get("data", "{}"))
-                        
-                        # Create simplified quote
-                        quote = {
-                            "type": "quote",
-                            "symbol": symbol,
-                            "last": tick_info.get("last_price"),
-                            "bid": tick_info.get("last_price", 0) * 0.999,  # Mock bid
-                            "ask": tick_info.get("last_price", 0) * 1.001,  # Mock ask
-                            "high": tick_info.get("high"),
-                            "low": tick_info.get("low"),
-                            "volume": tick_info.get("volume"),
-                            "timestamp": tick_data.get("timestamp")
-                        }
-                        
-                        await manager.send_personal_message(
-                            json.dumps(quote),
-                            websocket
-                        )
-                
-                except Exception as e:
-                    logger.error(f"Error processing quote: {e}")
-        
-        while True:
-            await asyncio.sleep(0.1)
+        # Quotes arrive through the tick stream consumer
+        await session.serve()
     
     except WebSocketDisconnect:
         logger.info("Quotes WebSocket disconnected")
     except Exception as e:
         logger.error(f"Quotes WebSocket error: {e}")
     finally:
-        manager.disconnect(websocket, channel)
+        _unsubscribe_symbols(websocket, channel)
+        session.close()
@@ -5,197 +5,145 @@ Streams system events like optimization results, risk alerts, etc.
 """
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-import asyncio
-import json
+from typing import Optional
 from loguru import logger
 
+from app.core.encoding import Frame
 from app.websockets import manager
+from app.websockets.hub import hub
+from app.websockets.session import WebSocketSession
 from app.core.redis_client import get_redis
 
 
 router = APIRouter()
 
+RISK_KEYWORDS = ("risk", "var", "stress", "alert")
+
 
 @router.websocket("/events")
 async def websocket_events(
     websocket: WebSocket,
     event_types: str = "optimization,risk,training",
+    history: int = 0,
+    encoding: Optional[str] = None,
     redis_client = Depends(get_redis)
 ):
     """
     WebSocket endpoint for system events.
     
     Streams optimization results, risk alerts, model training updates, etc.
+    Past events are kept in capped per-type streams; `get_recent_events`
+    (with optional `count`, `since`, `until`) returns them newest first.
     
     Query Parameters:
     - event_types: Comma-separated list of event types to subscribe to
+    - history: Send this many recent events right after connecting
+    - encoding: Frame encoding: json (default) or msgpack
     """
     channel = "events"
+    session = WebSocketSession(websocket, channel)
+    subscribed_events = list(dict.fromkeys(e.strip() for e in event_types.split(",")))
     
-    try:
-        await manager.connect(websocket, channel)
+    async def on_message(message: dict):
+        if message.get("type") == "subscribe_events":
+            # Already-subscribed types are skipped so the list stays duplicate-free
+            new_events = [
+                event_type for event_type in dict.fromkeys(message.get("event_types", []))
+                if event_type not in subscribed_events
+            ]
+            subscribed_events.extend(new_events)
+            manager.subscribe(websocket, [f"events:{event_type}" for event_type in new_events])
+            
+            await session.send(Frame({
+                "type": "subscription_updated",
+                "subscribed_events": subscribed_events
+            }))
         
-        # Parse event types
-        subscribed_events = [e.strip() for e in event_types.split(",")]
+        elif message.get("type") == "get_recent_events":
+            recent_events = await _get_recent_events(redis_client, subscribed_events, message)
+            
+            await session.send(Frame({
+                "type": "recent_events",
+                "events": recent_events
+            }))
+    
+    try:
+        await session.open(encoding_name=encoding)
+        manager.subscribe(websocket, [f"events:{event_type}" for event_type in subscribed_events])
         
         # Send connection confirmation
-        await manager.send_personal_message(
-            json.dumps({
-                "type": "events_connection",
-                "status": "connected",
-                "subscribed_events": subscribed_events,
-                "message": "Events stream connected"
-            }),
-            websocket
-        )
-        
-        # Start event stream
-        event_task = asyncio.create_task(
-            _stream_events(websocket, subscribed_events, redis_client)
-        )
-        
-        # Handle client messages
-        while True:
-            try:
-                data = await websocket.receive_text()
-                message = json.loads(data)
-                
-                if message.get("type") == "subscribe_events":
-                    new_events = message.get("event_types", [])
-                    subscribed_events.extend(new_events)
-                    
-                    await manager.send_personal_message(
-                        json.dumps({
-                            "type": "subscription_updated",
-                            "subscribed_events": subscribed_events
-                        }),
-                        websocket
-                    )
-                
-                elif message.get("type") == "get_recent_events":
-                    # Send recent events (mock implementation)
-                    recent_events = await _get_recent_events(redis_client)
-                    
-                    await manager.send_personal_message(
-                        json.dumps({
-                            "type": "recent_events",
-                            "events": recent_events
-                        }),
-                        websocket
-                    )
-            
-            except WebSocketDisconnect:
-                break
-            except json.JSONDecodeError:
-                await manager.send_personal_message(
-                    json.dumps({
-                        "type": "error",
-                        "message": "Invalid JSON format"
-                    }),
-                    websocket
-                )
-            except Exception as e:
-                logger.error(f"Error in events WebSocket: {e}")
-                break
+        await session.send(Frame({
+            "type": "events_connection",
+            "status": "connected",
+            "subscribed_events": subscribed_events,
+            "message": "Events stream connected"
+        }))
+        if history > 0:
+            await session.send(Frame({
+                "type": "recent_events",
+                "events": await _get_recent_events(redis_client, subscribed_events, {"count": history})
+            }))
+        
+        # Events arrive through the pub/sub hub
+        await session.serve(on_message)
     
     except WebSocketDisconnect:
         logger.info("Events WebSocket disconnected")
     except Exception as e:
         logger.error(f"Events WebSocket error: {e}")
     finally:
-        manager.disconnect(websocket, channel)
-        if 'event_task' in locals():
-            event_task.cancel()
+        session.close()
 
 
-async def _stream_events(
-    websocket: WebSocket,
-    subscribed_events: list,
-    redis_client
-):
-    """Stream events from Redis to WebSocket."""
-    try:
-        # Subscribe to events channel
-        pubsub = redis_client.redis.pubsub()
-        await pubsub.subscribe("events")
-        
-        logger.info(f"Started events stream for: {subscribed_events}")
-        
-        async for message in pubsub.listen():
-            if message["type"] == "message":
-                try:
-                    event_data = json.loads(message["data"])
-                    event_type = event_data.get("type", "")
-                    
-                    # Filter by subscribed event types
-                    if any(sub_type in event_type for sub_type in subscribed_events):
-                        client_message = {
-                            "type": "event",
-                            "event_type": event_type,
-                            "data": event_data.get("data", {}),
-                            "timestamp": event_data.get("timestamp")
-                        }
-                        
-                        await manager.send_personal_message(
-                            json.dumps(client_message),
-                            websocket
-                        )
-                
-                except json.JSONDecodeError as e:
-                    logger.error(f"Error parsing event data: {e}")
-                except Exception as e:
-                    logger.error(f"Error processing event: {e}")
+async def _dispatch_event(event_data: dict):
+    """
+    Route one `events` message to every interested connection.
     
-    except asyncio.CancelledError:
-        logger.info("Events stream cancelled")
-    except Exception as e:
-        logger.error(f"Error in events stream: {e}")
-    finally:
-        try:
-            await pubsub.close()
-        except:
-            pass
+    Each client format (generic, optimization, risk) is encoded once per
+    encoding in use and sent to the union of its subscribers.
+    """
+    event_type = event_data.get("type", "")
+    payload = {
+        "event_type": event_type,
+        "data": event_data.get("data", {}),
+        "timestamp": event_data.get("timestamp")
+    }
+    
+    # /events subscribers match by substring of the event type
+    recipients = set()
+    for topic in manager.topics_with_prefix("events:"):
+        if topic[len("events:"):] in event_type:
+            recipients |= manager.subscribers(topic)
+    if recipients:
+        await manager.send_to(recipients, Frame({"type": "event", **payload}))
+    
+    if "optimization" in event_type:
+        await manager.send_to_topic(
+            "optimization_events", Frame({"type": "optimization_event", **payload})
+        )
+    
+    if any(keyword in event_type for keyword in RISK_KEYWORDS):
+        await manager.send_to_topic(
+            "risk_events", Frame({"type": "risk_event", **payload})
+        )
+
 
+hub.add_handler("events", _dispatch_event)
 
-async def _get_recent_events(redis_client) -> list:
-    """Get recent events from Redis."""
+
+async def _get_recent_events(redis_client, event_types: list, message: dict) -> list:
+    """
+    Get recent events of the subscribed types from their history streams.
+    
+    The request may set `count`, and `since`/`until` as epoch seconds.
+    """
     try:
-        # In a real implementation, you'd store events in Redis with timestamps
-        # For now, return mock events
-        from datetime import datetime, timedelta
-        
-        mock_events = [
-            {
-                "type": "optimization_completed",
-                "timestamp": (datetime.utcnow() - timedelta(minutes=5)).isoformat(),
-                "data": {
-                    "selected_assets": ["AAPL.US", "MSFT.US", "GOOG.US"],
-                    "optimization_time_ms": 45.2,
-                    "sharpe_ratio": 1.45
-                }
-            },
-            {
-                "type": "risk_alert",
-                "timestamp": (datetime.utcnow() - timedelta(minutes=15)).isoformat(),
-                "data": {
-                    "alert_type": "var_breach",
-                    "severity": "medium",
-                    "message": "Portfolio VaR exceeded threshold"
-                }
-            },
-            {
-                "type": "model_training_completed",
-                "timestamp": (datetime.utcnow() - timedelta(hours=1)).isoformat(),
-                "data": {
-                    "symbol": "AAPL.US",
-                    "accuracy": 0.78,
-                    "model_type": "xgboost"
-                }
-            }
-        ]
-        
-        return mock_events
-        
+        return await redis_client.get_recent_events(
+            event_types,
+            count=int(message.get("count", 50)),
+            since=message.get("since"),
+            until=message.get("until")
+        )
     except Exception as e:
         logger.error(f"Error getting recent events: {e}")
         return []
@@ -204,20 +152,22 @@ async def _get_recent_events(redis_client) -> list:
 @router.websocket("/events/optimization")
 async def websocket_optimization_events(
     websocket: WebSocket,
+    encoding: Optional[str] = None,
     redis_client = Depends(get_redis)
 ):
     """
     Dedicated WebSocket for optimization events.
     
-    Streams real-time optimization progress and results.
+    Streams real-time optimization progress and results (`encoding`: json or msgpack).
     """
     channel = "optimization_events"
+    session = WebSocketSession(websocket, channel)
     
     try:
-        await manager.connect(websocket, channel)
+        await session.open(encoding_name=encoding)
         
         await manager.send_personal_message(
-            json.dumps({
+            Frame({
                 "type": "optimization_events_connection",
                 "status": "connected",
                 "message": "Optimization events stream connected"
@@ -225,61 +175,39 @@ async def websocket_optimization_events(
             websocket
         )
         
-        # Subscribe to optimization events
-        pubsub = redis_client.redis.pubsub()
-        await pubsub.subscribe("events")
+        # Optimization events arrive through the pub/sub hub
+        manager.subscribe(websocket, ["optimization_events"])
         
-        async for message in pubsub.listen():
-            if message["type"] == "message":
-                try:
-                    event_data = json.loads(message["data"])
-                    event_type = event_data.get("type", "")
-                    
-                    # Filter optimization-related events
-                    if "optimization" in event_type:
-                        client_message = {
-                            "type": "optimization_event",
-                            "event_type": event_type,
-                            "data": event_data.get("data", {}),
-                            "timestamp": event_data.get("timestamp")
-                        }
-                        
-                        await manager.send_personal_message(
-                            json.dumps(client_message),
-                            websocket
-                        )
-                
-                except Exception as e:
-                    logger.error(f"Error processing optimization event: {e}")
-        
-        while True:
-            await asyncio.sleep(0.1)
+        await session.serve()
     
     except WebSocketDisconnect:
         logger.info("Optimization events WebSocket disconnected")
     except Exception as e:
         logger.error(f"Optimization events WebSocket error: {e}")
     finally:
-        manager.disconnect(websocket, channel)
+        session.close()
 
 
 @router.websocket("/events/risk")
 async def websocket_risk_events(
     websocket: WebSocket,
+    encoding: Optional[str] = None,
     redis_client = Depends(get_redis)
 ):
     """
     Dedicated WebSocket for risk management events.
     
     Streams risk alerts, VaR breaches, stress test results, etc.
+    (`encoding`: json or msgpack).
     """
     channel = "risk_events"
+    session = WebSocketSession(websocket, channel)
     
     try:
-        await manager.connect(websocket, channel)
+        await session.open(encoding_name=encoding)
         
         await manager.send_personal_message(
-            json.dumps({
+            Frame({
                 "type": "risk_events_connection",
                 "status": "connected",
                 "message": "Risk events stream connected"
@@ -287,39 +215,14 @@ async def websocket_risk_events(
             websocket
         )
         
-        # Subscribe to risk events
-        pubsub = redis_client.redis.pubsub()
-        await pubsub.subscribe("events")
-        
-        async for message in pubsub.listen():
-            if message["type"] == "message":
-                try:
-                    event_data = json.loads(message["data"])
-                    event_type = event_data.get("type", "")
-                    
-                    # Filter risk-related events
-                    if any(keyword in event_type for keyword in ["risk", "var", "stress", "alert"]):
-                        client_message = {
-                            "type": "risk_event",
-                            "event_type": event_type,
-                            "data": event_data.get("data", {}),
-                            "timestamp": event_data.get("timestamp")
-                        }
-                        
-                        await manager.send_personal_message(
-                            json.dumps(client_message),
-                            websocket
-                        )
-                
-                except Exception as e:
-                    logger.error(f"Error processing risk event: {e}")
+        # Risk events arrive through the pub/sub hub
+        manager.subscribe(websocket, ["risk_events"])
         
-        while True:
-            await asyncio.sleep(0.1)
+        await session.serve()
     
     except WebSocketDisconnect:
         logger.info("Risk events WebSocket disconnected")
     except Exception as e:
         logger.error(f"Risk events WebSocket error: {e}")
     finally:
-        manager.disconnect(websocket, channel)
+        session.close()
@@ -0,0 +1,236 @@
+"""
+Pub/Sub Hub - One Redis subscriber per channel, shared by every websocket
+
+Websocket endpoints register a handler per Redis channel at import time
+instead of opening a subscription per connection. The hub runs one
+subscriber task per channel, JSON-parses each message once and passes it
+to the channel's handlers. Handlers route it through the ConnectionManager
+topic index and serialize each client message format once.
+
+Redis connections and parsing cost therefore scale with channels, not with
+connected clients.
+
+Per-symbol channels (e.g. `bars:{symbol}`) are subscribed on demand: a
+prefix handler serves every channel starting with its prefix, and
+add_interest / remove_interest (reference counted) subscribe and
+unsubscribe them on one shared connection. A node therefore only receives
+the symbols its own clients watch.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from loguru import logger
+
+from app.core.encoding import loads
+from app.core.redis_client import get_redis
+
+
+Handler = Callable[[Any], Awaitable[None]]
+
+
+class PubSubHub:
+    """Process-wide Redis pub/sub fan-out."""
+
+    def __init__(self, reconnect_delay: float = 1.0, max_reconnect_delay: float = 30.0):
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._redis_client = None
+        self._prefix_handlers: Dict[str, List[Handler]] = {}
+        self._interest: Dict[str, int] = {}
+        self._has_interest = asyncio.Event()
+        self._dynamic = None  # PubSub of the per-symbol channels, once listening
+        self._dynamic_task: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.messages: Dict[str, int] = {}
+        self.parse_errors = 0
+        self.handler_errors = 0
+        self.reconnects = 0
+
+    def add_handler(self, channel: str, handler: Handler):
+        """Register a handler for a channel's parsed messages."""
+        self._handlers.setdefault(channel, []).append(handler)
+        if self._redis_client is not None and channel not in self._tasks:
+            self._tasks[channel] = asyncio.create_task(self._listen(channel))
+
+    def add_prefix_handler(self, prefix: str, handler: Handler):
+        """Register a handler for every on-demand channel starting with `prefix`."""
+        self._prefix_handlers.setdefault(prefix, []).append(handler)
+
+    async def add_interest(self, channels: Iterable[str]):
+        """Subscribe to on-demand channels (counted; the first interest subscribes)."""
+        new = []
+        for channel in channels:
+            self._interest[channel] = self._interest.get(channel, 0) + 1
+            if self._interest[channel] == 1:
+                new.append(channel)
+        if not new:
+            return
+        self._has_interest.set()
+        if self._dynamic is not None:
+            try:
+                await self._dynamic.subscribe(*new)
+            except Exception as e:
+                # The listener resubscribes all interest when it reconnects
+                logger.error(f"Error subscribing to {new}: {e}")
+
+    async def remove_interest(self, channels: Iterable[str]):
+        """Release on-demand channels; the last release unsubscribes."""
+        released = []
+        for channel in channels:
+            if channel not in self._interest:
+                continue
+            self._interest[channel] -= 1
+            if not self._interest[channel]:
+                del self._interest[channel]
+                released.append(channel)
+        if not self._interest:
+            self._has_interest.clear()
+        if released and self._dynamic is not None:
+            try:
+                await self._dynamic.unsubscribe(*released)
+            except Exception as e:
+                logger.error(f"Error unsubscribing from {released}: {e}")
+
+    async def start(self, redis_client=None):
+        """Start one subscriber task per registered channel, and the on-demand listener."""
+        self._redis_client = redis_client or await get_redis()
+        for channel in self._handlers:
+            if channel not in self._tasks:
+                self._tasks[channel] = asyncio.create_task(self._listen(channel))
+        if self._prefix_handlers and self._dynamic_task is None:
+            self._dynamic_task = asyncio.create_task(self._listen_dynamic())
+        logger.info(f"Pub/sub hub started for channels: {sorted(self._handlers)}")
+
+    async def stop(self):
+        """Cancel all subscriber tasks."""
+        tasks = list(self._tasks.values())
+        if self._dynamic_task is not None:
+            tasks.append(self._dynamic_task)
+            self._dynamic_task = None
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._redis_client = None
+
+    async def dispatch(self, channel: str, data: Any):
+        """Pass one parsed message to every handler of the channel."""
+        self.messages[channel] = self.messages.get(channel, 0) + 1
+        for handler in self._handlers_for(channel):
+            try:
+                await handler(data)
+            except Exception as e:
+                self.handler_errors += 1
+                logger.error(f"Error in {channel} handler: {e}")
+
+    def get_stats(self) -> Dict:
+        return {
+            "channels": sorted(self._tasks),
+            "on_demand_channels": len(self._interest),
+            "messages": dict(self.messages),
+            "parse_errors": self.parse_errors,
+            "handler_errors": self.handler_errors,
+            "reconnects": self.reconnects
+        }
+
+    def _handlers_for(self, channel: str) -> List[Handler]:
+        handlers = list(self._handlers.get(channel, []))
+        for prefix, prefix_handlers in self._prefix_handlers.items():
+            if channel.startswith(prefix):
+                handlers.extend(prefix_handlers)
+        return handlers
+
+    async def _listen(self, channel: str):
+        delay = self.reconnect_delay
+        while True:
+            pubsub = None
+            try:
+                pubsub = self._redis_client.redis.pubsub()
+                await pubsub.subscribe(channel)
+                delay = self.reconnect_delay
+
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    try:
+                        data = loads(message["data"])
+                    except (TypeError, ValueError) as e:
+                        self.parse_errors += 1
+                        logger.error(f"Error parsing {channel} message: {e}")
+                        continue
+                    await self.dispatch(channel, data)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.reconnects += 1
+                logger.error(f"Pub/sub {channel} subscriber failed, retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.close()
+                    except Exception:
+                        pass
+
+
+    async def _listen_dynamic(self):
+        delay = self.reconnect_delay
+        while True:
+            pubsub = None
+            try:
+                await self._has_interest.wait()
+                pubsub = self._redis_client.redis.pubsub()
+                channels = list(self._interest)
+                await pubsub.subscribe(*channels)
+                self._dynamic = pubsub
+                # Interest may have changed while subscribing
+                added = set(self._interest) - set(channels)
+                if added:
+                    await pubsub.subscribe(*added)
+                released = set(channels) - set(self._interest)
+                if released:
+                    await pubsub.unsubscribe(*released)
+                delay = self.reconnect_delay
+
+                # Ends once every channel has been unsubscribed
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    channel = message["channel"]
+                    try:
+                        data = loads(message["data"])
+                    except (TypeError, ValueError) as e:
+                        self.parse_errors += 1
+                        logger.error(f"Error parsing {channel} message: {e}")
+                        continue
+                    await self.dispatch(channel, data)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.reconnects += 1
+                logger.error(f"On-demand pub/sub subscriber failed, retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+            finally:
+                self._dynamic = None
+                if pubsub is not None:
+                    try:
+                        await pubsub.close()
+                    except Exception:
+                        pass
+
+
+# Global hub instance
+hub = PubSubHub()
+
+
+def get_hub() -> PubSubHub:
+    """Get the pub/sub hub."""
+    return hub
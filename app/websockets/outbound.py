@@ -0,0 +1,165 @@
+"""
+Outbound queues - Per-connection send buffers with slow-consumer policies
+
+Every connection gets a bounded buffer drained by its own writer task, so a
+broadcast only enqueues (O(1) per client) and a slow client never delays the
+others. When a buffer is full the connection's policy decides:
+
+- drop_oldest: discard the oldest pending message;
+- coalesce:    messages carrying a key (e.g. a symbol's latest quote) replace
+               the pending message with the same key in place; unkeyed
+               messages fall back to drop_oldest;
+- disconnect:  close the connection, which must reconnect and resync.
+"""
+
+import asyncio
+import itertools
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set, Union
+
+from fastapi import WebSocket
+from loguru import logger
+
+
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+# Close code for evicted slow consumers ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+Frame = Union[str, bytes]
+
+
+class OutboundQueue:
+    """Bounded send buffer and writer task for one websocket."""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        max_size: int = 1000,
+        policy: str = DROP_OLDEST,
+        send_timeout: float = 10.0,
+        label: str = ""
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow-consumer policy {policy!r}; expected one of {POLICIES}")
+        self.websocket = websocket
+        self.max_size = max_size
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.label = label
+
+        self._buffer: "OrderedDict[Hashable, Frame]" = OrderedDict()
+        self._sequence = itertools.count()
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = asyncio.Event()
+        self._closing: Set[asyncio.Task] = set()  # Referenced until done, so they are not collected
+        self.closed = False
+
+        # Metrics
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.evicted = False
+
+    def start(self):
+        self._task = asyncio.create_task(self._writer())
+
+    def put(self, frame: Frame, key: Optional[Hashable] = None) -> bool:
+        """Enqueue a frame without waiting; returns False if it was not accepted."""
+        if self.closed:
+            return False
+
+        if key is not None and self.policy == COALESCE and ("key", key) in self._buffer:
+            # Replace in place: keeps the key's position, delivers only the latest value
+            self._buffer[("key", key)] = frame
+            self.coalesced += 1
+            return True
+
+        if len(self._buffer) >= self.max_size:
+            if self.policy == DISCONNECT:
+                self._evict()
+                return False
+            self._buffer.popitem(last=False)
+            self.dropped += 1
+
+        slot = ("key", key) if key is not None and self.policy == COALESCE else ("seq", next(self._sequence))
+        self._buffer[slot] = frame
+        self.max_depth = max(self.max_depth, len(self._buffer))
+        self._ready.set()
+        return True
+
+    def stop(self):
+        """Stop the writer; pending frames are discarded."""
+        self._close()
+        self._buffer.clear()
+        if self._task and not self._task.done() and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    async def wait_closed(self):
+        """Wait until the queue stops delivering (stopped, evicted or the send failed)."""
+        await self._closed.wait()
+
+    @property
+    def depth(self) -> int:
+        return len(self._buffer)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "connection": self.label,
+            "policy": self.policy,
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "evicted": self.evicted
+        }
+
+    async def _writer(self):
+        while not self.closed:
+            await self._ready.wait()
+            self._ready.clear()
+            while self._buffer and not self.closed:
+                _, frame = self._buffer.popitem(last=False)
+                try:
+                    if isinstance(frame, bytes):
+                        await asyncio.wait_for(self.websocket.send_bytes(frame), self.send_timeout)
+                    else:
+                        await asyncio.wait_for(self.websocket.send_text(frame), self.send_timeout)
+                    self.sent += 1
+                except asyncio.TimeoutError:
+                    logger.warning(f"Send to {self.label} stalled for {self.send_timeout}s, disconnecting")
+                    self._evict()
+                    return
+                except Exception as e:
+                    # Connection is gone; its handler cleans up on disconnect
+                    logger.debug(f"Send to {self.label} failed: {e}")
+                    self._close()
+                    return
+
+    def _evict(self):
+        """Close a consumer that cannot keep up."""
+        if self.evicted:
+            return
+        self.evicted = True
+        self._close()
+        self._buffer.clear()
+        logger.warning(f"Evicting slow websocket consumer {self.label}")
+        task = asyncio.create_task(self._close_socket())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def _close(self):
+        self.closed = True
+        self._closed.set()
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception as e:
+            logger.debug(f"Closing evicted {self.label} failed: {e}")
@@ -0,0 +1,343 @@
+"""
+Sessions - Lifecycle of one websocket connection
+
+Every endpoint runs its connection as a WebSocketSession:
+
+    session = WebSocketSession(websocket, channel)
+    try:
+        await session.open(policy=overflow)
+        ... subscribe, send snapshots ...
+        await session.serve(on_message)
+    finally:
+        session.close()
+
+serve() runs the connection's tasks as one structured asyncio.TaskGroup:
+the reader (client messages), the writer (the OutboundQueue, which stops on
+eviction or a failed send), any producer tasks added with add_task(), and a
+stop signal. When any of them ends, the others are cancelled, so a
+disconnect or a dead writer tears the whole session down. close() then
+releases the connection and its subscriptions exactly once.
+
+Periodic work (heartbeats, periodic metrics) runs on the process-wide
+TimerWheel instead of a sleep loop per connection: one task ticks once a
+second and only touches the timers that are due. Coroutine callbacks run
+on their own tasks, so a slow send or Redis call never delays the other
+timers.
+
+Heartbeats send {"type": "heartbeat"} every WS_HEARTBEAT_INTERVAL_SECONDS.
+A client that answers with {"type": "pong"} once is expected to keep doing
+so, and is disconnected after WS_HEARTBEAT_TIMEOUT_SECONDS of silence.
+"""
+
+import asyncio
+import math
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from fastapi import WebSocket
+from loguru import logger
+
+from app.core.config import settings
+from app.core.encoding import loads
+from app.websockets import manager
+
+
+MessageHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+TimerCallback = Callable[[], Optional[Awaitable[None]]]
+
+
+class Timer:
+    """Handle of a periodic timer on a TimerWheel."""
+
+    __slots__ = ("callback", "ticks", "rounds", "cancelled", "task")
+
+    def __init__(self, callback: TimerCallback, ticks: int):
+        self.callback = callback
+        self.ticks = ticks
+        self.rounds = 0
+        self.cancelled = False
+        self.task: Optional[asyncio.Task] = None  # Run of a coroutine callback in flight
+
+    def cancel(self):
+        self.cancelled = True
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel for periodic per-connection work.
+
+    Timers hash into `slots` buckets by due tick; each tick visits only its
+    bucket, so the cost is proportional to the timers due, whatever the
+    number of connections. Intervals longer than one revolution wait extra
+    rounds. Cancelled timers are dropped lazily when their bucket is visited.
+
+    Coroutine callbacks are started as tasks rather than awaited. A timer
+    whose previous run is still in flight skips its turn instead of piling up.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 64):
+        self.tick = tick
+        self.slots: List[List[Timer]] = [[] for _ in range(slots)]
+        self.cursor = 0
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+
+        # Metrics
+        self.timers = 0
+        self.fired = 0
+        self.skipped = 0
+        self.errors = 0
+
+    def every(self, interval: float, callback: TimerCallback) -> Timer:
+        """Call `callback` every `interval` seconds (rounded up to whole ticks)."""
+        timer = Timer(callback, max(1, math.ceil(interval / self.tick)))
+        self._schedule(timer)
+        self.timers += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return timer
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        in_flight = list(self._in_flight)
+        for task in in_flight:
+            task.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
+
+    def get_stats(self) -> Dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "pending": sum(len(slot) for slot in self.slots),
+            "scheduled": self.timers,
+            "fired": self.fired,
+            "in_flight": len(self._in_flight),
+            "skipped": self.skipped,
+            "errors": self.errors
+        }
+
+    def _schedule(self, timer: Timer):
+        timer.rounds, offset = divmod(timer.ticks, len(self.slots))
+        if offset == 0:
+            # A whole number of revolutions lands on the current slot
+            timer.rounds -= 1
+        self.slots[(self.cursor + offset) % len(self.slots)].append(timer)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            self.cursor = (self.cursor + 1) % len(self.slots)
+            self._advance()
+
+    def _advance(self):
+        """Fire the timers due at the current slot and reschedule them."""
+        bucket, self.slots[self.cursor] = self.slots[self.cursor], []
+        for timer in bucket:
+            if timer.cancelled:
+                continue
+            if timer.rounds > 0:
+                timer.rounds -= 1
+                self.slots[self.cursor].append(timer)
+                continue
+
+            self._fire(timer)
+            if not timer.cancelled:
+                self._schedule(timer)
+
+    def _fire(self, timer: Timer):
+        if timer.task is not None and not timer.task.done():
+            self.skipped += 1
+            return
+
+        self.fired += 1
+        try:
+            result = timer.callback()
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Timer callback failed: {e}")
+            return
+        if asyncio.iscoroutine(result):
+            timer.task = asyncio.create_task(result)
+            self._in_flight.add(timer.task)
+            timer.task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task):
+        self._in_flight.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+            logger.error(f"Timer callback failed: {task.exception()}")
+
+
+class SessionRegistry:
+    """Per-process counts of open websocket sessions and their tasks."""
+
+    def __init__(self):
+        self.open: Dict[str, int] = {}
+        self.opened = 0
+        self.closed = 0
+        self.tasks = 0
+        self.heartbeat_timeouts = 0
+
+    def add(self, channel: str):
+        self.open[channel] = self.open.get(channel, 0) + 1
+        self.opened += 1
+
+    def remove(self, channel: str):
+        self.open[channel] -= 1
+        if not self.open[channel]:
+            del self.open[channel]
+        self.closed += 1
+
+    def get_stats(self) -> Dict:
+        return {
+            "open": sum(self.open.values()),
+            "by_channel": dict(self.open),
+            "opened": self.opened,
+            "closed": self.closed,
+            "tasks": self.tasks,
+            "heartbeat_timeouts": self.heartbeat_timeouts,
+            "timers": timer_wheel.get_stats()
+        }
+
+
+class _SessionEndedError(Exception):
+    """Raised inside the task group when one of its members finishes."""
+
+
+class WebSocketSession:
+    """One websocket connection: its task group, heartbeat and teardown."""
+
+    def __init__(self, websocket: WebSocket, channel: str):
+        self.websocket = websocket
+        self.channel = channel
+        self.opened = False
+        self.answers_heartbeats = False
+        self.last_seen = time.monotonic()
+
+        self._producers: List[Callable[[], Awaitable[None]]] = []
+        self._timers: List[Timer] = []
+        self._stopped = asyncio.Event()
+
+    async def open(self, policy: Optional[str] = None, encoding_name: Optional[str] = None):
+        """Accept the connection and start its heartbeat."""
+        await manager.connect(self.websocket, self.channel, policy=policy, encoding_name=encoding_name)
+        self.opened = True
+        sessions.add(self.channel)
+        self.every(settings.WS_HEARTBEAT_INTERVAL_SECONDS, self._heartbeat)
+
+    def every(self, interval: float, callback: TimerCallback) -> Timer:
+        """Run periodic work for this session on the shared timer wheel."""
+        timer = timer_wheel.every(interval, callback)
+        self._timers.append(timer)
+        return timer
+
+    def add_task(self, producer: Callable[[], Awaitable[None]]):
+        """Run a coroutine function for the lifetime of the session (before serve())."""
+        self._producers.append(producer)
+
+    async def send(self, message):
+        await manager.send_personal_message(message, self.websocket)
+
+    async def serve(self, on_message: Optional[MessageHandler] = None):
+        """
+        Run the session until the client disconnects, the writer stops, a
+        producer ends, or stop() is called; the remaining tasks are cancelled.
+        """
+        members = [self._reader(on_message), self._watch_writer(), self._stopped.wait()]
+        members += [producer() for producer in self._producers]
+        try:
+            async with asyncio.TaskGroup() as group:
+                for member in members:
+                    group.create_task(self._member(member))
+        except* _SessionEndedError:
+            pass
+
+    def stop(self):
+        """End serve() from outside the task group."""
+        self._stopped.set()
+
+    def close(self):
+        """Release the connection, its subscriptions and timers (idempotent)."""
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+        if self.opened:
+            self.opened = False
+            manager.disconnect(self.websocket, self.channel)
+            sessions.remove(self.channel)
+
+    async def _member(self, awaitable: Awaitable[None]):
+        sessions.tasks += 1
+        try:
+            await awaitable
+        finally:
+            sessions.tasks -= 1
+        raise _SessionEndedError()
+
+    async def _reader(self, on_message: Optional[MessageHandler]):
+        while True:
+            received = await self.websocket.receive()
+            if received["type"] == "websocket.disconnect":
+                return
+            self.last_seen = time.monotonic()
+
+            # Clients may send JSON as text or binary frames
+            data = received.get("text")
+            if data is None:
+                data = received.get("bytes") or b""
+            try:
+                message = loads(data)
+            except ValueError:
+                await self.send({"type": "error", "message": "Invalid JSON format"})
+                continue
+            if not isinstance(message, dict):
+                continue
+
+            if message.get("type") == "pong":
+                self.answers_heartbeats = True
+            elif message.get("type") == "ping":
+                await self.send({
+                    "type": "pong",
+                    "timestamp": message.get("timestamp") or datetime.utcnow().isoformat()
+                })
+            elif on_message is not None:
+                # A failing handler answers that message only; the session lives on
+                try:
+                    await on_message(message)
+                except Exception as e:
+                    logger.error(f"Error handling {message.get('type')!r} message on {self.channel}: {e}")
+                    await self.send({"type": "error", "message": f"Could not handle {message.get('type')!r} message"})
+
+    async def _watch_writer(self):
+        queue = manager.queues.get(self.websocket)
+        if queue is not None:
+            await queue.wait_closed()
+        else:
+            await self._stopped.wait()
+
+    async def _heartbeat(self):
+        silent = time.monotonic() - self.last_seen
+        if self.answers_heartbeats and silent > settings.WS_HEARTBEAT_TIMEOUT_SECONDS:
+            sessions.heartbeat_timeouts += 1
+            logger.info(f"No heartbeat answer on {self.channel} for {silent:.0f}s, closing")
+            self.stop()
+            return
+        await self.send({"type": "heartbeat", "timestamp": datetime.utcnow().isoformat()})
+
+
+# Process-wide timer wheel and session metrics
+timer_wheel = TimerWheel()
+sessions = SessionRegistry()
+
+
+def get_sessions() -> SessionRegistry:
+    """Get the session registry."""
+    return sessions
@@ -1,6 +1,28 @@
 -- Initialize database with test data
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
 
+-- market_data is range-partitioned by month; app.services.history_store
+-- creates upcoming partitions and drops expired ones. The default partition
+-- only catches rows outside the managed range.
+CREATE TABLE IF NOT EXISTS market_data (
+    id BIGSERIAL NOT NULL,
+    timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    symbol VARCHAR NOT NULL,
+    open_price FLOAT NOT NULL,
+    high_price FLOAT NOT NULL,
+    low_price FLOAT NOT NULL,
+    close_price FLOAT NOT NULL,
+    volume FLOAT NOT NULL,
+    source VARCHAR NOT NULL,
+    interval_seconds INTEGER NOT NULL DEFAULT 60,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE IF NOT EXISTS market_data_default PARTITION OF market_data DEFAULT;
+
+CREATE INDEX IF NOT EXISTS ix_market_data_symbol_timestamp ON market_data (symbol, timestamp);
+CREATE INDEX IF NOT EXISTS ix_market_data_timestamp_brin ON market_data USING brin (timestamp);
+
 -- Insert test user
 INSERT INTO users (email, hashed_password, is_active) VALUES 
 ('test@mkto.com', '$2b$12$LQv3c1yqBWVHxkd0LHAkCOYz6TtxMQJqhN8/LewqyBW4CZkZbKbVS', true)
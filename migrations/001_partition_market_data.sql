@@ -0,0 +1,100 @@
+-- Migrate market_data to the monthly range-partitioned layout
+--
+-- Databases created before partitioning have a plain market_data table
+-- (integer id primary key, no interval_seconds). init_db() does not alter
+-- existing tables, so run this once before deploying the partitioned model:
+--
+--     psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/001_partition_market_data.sql
+--
+-- Stop the app nodes first: the write-behind buffer would otherwise keep
+-- inserting into the table being replaced. The script is one transaction
+-- and does nothing if market_data is already partitioned, so a fresh
+-- database (init.sql) or a second run is a no-op.
+--
+-- Backfill: every existing row is a base bar, so it is copied with
+-- interval_seconds = 60 and keeps its id. The old id sequence is widened
+-- to bigint and reused, so new ids continue after the existing ones.
+-- Monthly partitions are created for every month that holds rows, plus
+-- the months history_store would create ahead, so no existing row lands in
+-- the default partition (which would block creating its month's partition
+-- later). The old table is dropped only if every row was copied.
+
+BEGIN;
+
+DO $$
+DECLARE
+    first_month DATE;
+    last_month DATE;
+    part_month DATE;
+    copied BIGINT;
+    expected BIGINT;
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('market_data')
+    ) THEN
+        RAISE NOTICE 'market_data is already partitioned, nothing to do';
+        RETURN;
+    END IF;
+
+    ALTER TABLE market_data RENAME TO market_data_unpartitioned;
+    ALTER TABLE market_data_unpartitioned RENAME CONSTRAINT market_data_pkey TO market_data_unpartitioned_pkey;
+    ALTER SEQUENCE market_data_id_seq OWNED BY NONE;
+    ALTER SEQUENCE market_data_id_seq AS BIGINT;
+
+    CREATE TABLE market_data (
+        id BIGINT NOT NULL DEFAULT nextval('market_data_id_seq'),
+        timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        symbol VARCHAR NOT NULL,
+        open_price FLOAT NOT NULL,
+        high_price FLOAT NOT NULL,
+        low_price FLOAT NOT NULL,
+        close_price FLOAT NOT NULL,
+        volume FLOAT NOT NULL,
+        source VARCHAR NOT NULL,
+        interval_seconds INTEGER NOT NULL DEFAULT 60,
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp);
+    ALTER SEQUENCE market_data_id_seq OWNED BY market_data.id;
+
+    CREATE TABLE market_data_default PARTITION OF market_data DEFAULT;
+
+    -- Same names as init.sql and the MarketData model
+    CREATE INDEX ix_market_data_symbol_timestamp ON market_data (symbol, timestamp);
+    CREATE INDEX ix_market_data_timestamp_brin ON market_data USING brin (timestamp);
+
+    -- Partitions named like history_store.ensure_partitions creates them
+    SELECT date_trunc('month', min(timestamp))::date INTO first_month FROM market_data_unpartitioned;
+    last_month := (date_trunc('month', now()) + INTERVAL '2 months')::date;  -- HISTORY_PARTITION_MONTHS_AHEAD
+    part_month := LEAST(COALESCE(first_month, last_month), date_trunc('month', now())::date);
+    WHILE part_month <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF market_data FOR VALUES FROM (%L) TO (%L)',
+            'market_data_' || to_char(part_month, 'YYYY_MM'),
+            part_month,
+            (part_month + INTERVAL '1 month')::date
+        );
+        part_month := (part_month + INTERVAL '1 month')::date;
+    END LOOP;
+
+    INSERT INTO market_data (
+        id, timestamp, symbol, open_price, high_price, low_price,
+        close_price, volume, source, interval_seconds
+    )
+    SELECT
+        id, timestamp, symbol, open_price, high_price, low_price,
+        close_price, volume, source, 60
+    FROM market_data_unpartitioned;
+    GET DIAGNOSTICS copied = ROW_COUNT;
+
+    SELECT count(*) INTO expected FROM market_data_unpartitioned;
+    IF copied <> expected THEN
+        RAISE EXCEPTION 'Copied % of % market_data rows', copied, expected;
+    END IF;
+
+    DROP TABLE market_data_unpartitioned;
+
+    RAISE NOTICE 'Moved % rows into partitioned market_data', copied;
+END
+$$;
+
+COMMIT;
@@ -205,6 +205,1501 @@ class TestDataService:
         assert client._parse_volume("1.5k") == 1_500
         assert client._parse_volume("2.1b") == 2_100_000_000
         assert client._parse_volume("invalid") is None
+    
+    @pytest.mark.asyncio
+    async def test_get_market_data_many_batches_redis(self):
+        """Batch lookups use one MGET and one pipelined write for all misses."""
+        import json
+        from datetime import datetime
+        from app.services.data_service import MarketDataClient
+        
+        client = MarketDataClient()
+        client.redis_client = AsyncMock()
+        now = datetime.utcnow().isoformat()
+        
+        client.quote_cache.set(
+            "market_data:aapl.us", {"last_price": 1.0, "source": "stooq"}, ttl=60, symbol="aapl.us"
+        )
+        client.redis_client.mget_cached.return_value = [
+            json.dumps({"last_price": 2.0, "timestamp": now, "source": "stooq"}), None,
+            None, None
+        ]
+        client._request_stooq_quote = AsyncMock(
+            return_value={"last_price": 3.0, "timestamp": now, "source": "stooq"}
+        )
+        
+        quotes = await client.get_market_data_many(["aapl.us", "msft.us", "goog.us"])
+        
+        assert quotes["aapl.us"]["last_price"] == 1.0
+        assert quotes["msft.us"]["last_price"] == 2.0
+        assert quotes["goog.us"]["last_price"] == 3.0
+        client.redis_client.mget_cached.assert_awaited_once()
+        client.redis_client.mset_cached_with_ttl.assert_awaited_once()
+        assert list(client.redis_client.mset_cached_with_ttl.call_args[0][0]) == ["stooq_quote:goog.us"]
+
+
+class TestQuoteCache:
+    """Test cases for the in-process quote cache."""
+    
+    def test_fresh_hit_and_miss(self):
+        """Fresh entries are served; unknown keys miss."""
+        from app.services.quote_cache import QuoteCache
+        
+        cache = QuoteCache(max_entries=10)
+        cache.set("stooq_quote:aapl.us", {"last_price": 209.11}, ttl=60, symbol="aapl.us")
+        
+        assert cache.get("stooq_quote:aapl.us") == {"last_price": 209.11}
+        assert cache.get("stooq_quote:msft.us") is None
+        
+        stats = cache.get_stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+    
+    @pytest.mark.asyncio
+    async def test_stale_while_revalidate(self):
+        """Expired entries inside the grace window trigger one background refresh."""
+        from app.services.quote_cache import QuoteCache
+        
+        cache = QuoteCache(max_entries=10, stale_grace_seconds=60)
+        cache.set("market_data:aapl.us", {"last_price": 1.0}, ttl=0, symbol="aapl.us")
+        refreshes = []
+        
+        async def refresh():
+            refreshes.append(1)
+            cache.set("market_data:aapl.us", {"last_price": 2.0}, ttl=60, symbol="aapl.us")
+        
+        assert cache.get("market_data:aapl.us") is None
+        assert cache.get_or_revalidate("market_data:aapl.us", refresh) == {"last_price": 1.0}
+        assert cache.get_or_revalidate("market_data:aapl.us", refresh) == {"last_price": 1.0}
+        await asyncio.sleep(0)
+        
+        assert len(refreshes) == 1
+        assert cache.get("market_data:aapl.us") == {"last_price": 2.0}
+    
+    @pytest.mark.asyncio
+    async def test_clear_cancels_refreshes(self):
+        """A refresh in flight during clear() neither repopulates the cache nor stays marked."""
+        from app.services.quote_cache import QuoteCache
+        
+        cache = QuoteCache(max_entries=10, stale_grace_seconds=60)
+        cache.set("market_data:aapl.us", {"last_price": 1.0}, ttl=0, symbol="aapl.us")
+        released = asyncio.Event()
+        
+        async def refresh():
+            await released.wait()
+            cache.set("market_data:aapl.us", {"last_price": 2.0}, ttl=60, symbol="aapl.us")
+        
+        cache.get_or_revalidate("market_data:aapl.us", refresh)
+        await asyncio.sleep(0)
+        cache.clear()
+        assert cache.get_stats()["refreshing"] == 0
+        
+        released.set()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert cache.get("market_data:aapl.us") is None and cache.get_stats()["size"] == 0
+    
+    def test_lru_eviction_and_symbol_invalidation(self):
+        """Cache stays bounded and ticks drop every entry for their symbol."""
+        from app.services.quote_cache import QuoteCache
+        
+        cache = QuoteCache(max_entries=2)
+        cache.set("stooq_quote:aapl.us", {}, ttl=60, symbol="aapl.us")
+        cache.set("yahoo_quote:AAPL", {}, ttl=60, symbol="AAPL.US")
+        cache.set("stooq_quote:msft.us", {}, ttl=60, symbol="msft.us")
+        
+        assert len(cache) == 2
+        assert cache.get_stats()["evictions"] == 1
+        
+        cache.invalidate_symbol("aapl.us")
+        assert cache.get("yahoo_quote:AAPL") is None
+        assert cache.get("stooq_quote:msft.us") == {}
+    
+    @pytest.mark.asyncio
+    async def test_tick_stream_drives_invalidation(self):
+        """Every node's L1 follows the tick stream, and cached symbols are read."""
+        import json
+        from app.services.data_service import MarketDataClient
+        from app.services.tick_stream_consumer import TickStreamConsumer
+        
+        consumer = TickStreamConsumer(per_symbol=True)
+        released = []
+        consumer.add_release_handler(released.append)
+        client = MarketDataClient()
+        client.watch_ticks(consumer)
+        
+        client.quote_cache.set("stooq_quote:aapl.us", {"last_price": 1.0}, ttl=60, symbol="aapl.us")
+        client.quote_cache.set("market_data:aapl.us", {"last_price": 1.0}, ttl=60, symbol="aapl.us")
+        assert consumer.interest == {"aapl.us": 1}
+        
+        await consumer._dispatch([("1-0", {
+            "symbol": "aapl.us", "kind": "snapshot", "data": json.dumps({"last_price": 2.0})
+        })])
+        assert client.quote_cache.get("market_data:aapl.us") == {"last_price": 2.0}
+        assert client.quote_cache.get("stooq_quote:aapl.us") is None
+        assert consumer.interest == {"aapl.us": 1}
+        
+        await consumer._dispatch([("2-0", {
+            "symbol": "aapl.us", "kind": "delta", "data": json.dumps({"last_price": 3.0})
+        })])
+        assert client.quote_cache.get("market_data:aapl.us") == {"last_price": 3.0}
+        
+        # A delta without a snapshot read first drops the symbol, and with it the interest
+        client.quote_cache.set("market_data:msft.us", {"last_price": 1.0}, ttl=60, symbol="msft.us")
+        await consumer._dispatch([("3-0", {
+            "symbol": "msft.us", "kind": "delta", "data": json.dumps({"last_price": 2.0})
+        })])
+        assert client.quote_cache.get("market_data:msft.us") is None
+        assert consumer.interest == {"aapl.us": 1}
+        assert released == ["msft.us"]
+
+
+class TestBarCodec:
+    """Test cases for the columnar bar encoding."""
+    
+    @pytest.fixture
+    def bars(self):
+        from app.core.bar_codec import BarArrays
+        
+        return BarArrays.from_dicts([
+            {"datetime": "2025-07-16 15:35:00", "open": 209.0, "high": 209.5,
+             "low": 208.8, "close": 209.2, "volume": 1000},
+            {"datetime": "2025-07-16 15:40:00", "open": 209.2, "high": 210.0,
+             "low": 209.1, "close": 209.9, "volume": 1500},
+        ])
+    
+    def test_roundtrip_is_zero_copy(self, bars):
+        """Uncompressed payloads decode to views over the buffer."""
+        from app.core.bar_codec import encode_bars, decode_bars
+        
+        payload = encode_bars(bars)
+        decoded = decode_bars(payload)
+        
+        assert len(payload) == 16 + 2 * 6 * 8
+        assert decoded.time.tolist() == bars.time.tolist()
+        assert decoded.close.tolist() == [209.2, 209.9]
+        assert not decoded.close.flags.owndata
+    
+    def test_compressed_roundtrip(self, bars):
+        """Compressed payloads decode to the same values."""
+        from app.core.bar_codec import encode_bars, decode_bars
+        
+        decoded = decode_bars(encode_bars(bars, compress=True))
+        
+        assert decoded.volume.tolist() == [1000.0, 1500.0]
+        assert decoded.to_dicts("aapl.us")[0]["datetime"] == "2025-07-16 15:35:00"
+    
+    def test_rejects_legacy_json(self):
+        """JSON payloads from before the codec are rejected, not misread."""
+        from app.core.bar_codec import BarCodecError, decode_bars
+        
+        with pytest.raises(BarCodecError):
+            decode_bars(b'[{"open": 1.0, "close": 2.0}]')
+    
+    def test_returns(self, bars):
+        """Close-to-close returns are computed on the arrays."""
+        returns = bars.returns()
+        
+        assert len(returns) == 1
+        assert abs(returns[0] - (209.9 - 209.2) / 209.2) < 1e-12
+    
+    def test_merge_deduplicates_by_time(self, bars):
+        """Overlapping blocks merge oldest first with one bar per timestamp."""
+        from app.core.bar_codec import BarArrays
+        
+        newer = BarArrays.from_dicts([
+            {"datetime": "2025-07-16 15:40:00", "open": 209.2, "high": 210.0,
+             "low": 209.1, "close": 210.1, "volume": 1600},
+            {"datetime": "2025-07-16 15:45:00", "open": 210.1, "high": 210.4,
+             "low": 209.8, "close": 210.0, "volume": 900},
+        ])
+        
+        merged = BarArrays.merge([bars, newer])
+        
+        assert merged.time.tolist() == sorted(set(bars.time.tolist() + newer.time.tolist()))
+        assert merged.close.tolist() == [209.2, 210.1, 210.0]
+
+
+class TestStooqBarParser:
+    """Test cases for the streaming Stooq bar parser."""
+    
+    def test_parses_across_chunk_boundaries(self):
+        """Rows split across chunks are reassembled; bad rows are skipped."""
+        from app.services.bar_parser import StooqBarParser
+        
+        body = (
+            b"Date,Time,Open,High,Low,Close,Volume\r\n"
+            b"2025-07-16,15:35:00,209.11,209.59,209.02,209.40,125000\r\n"
+            b"2025-07-16,15:40:00,bad,209.70,209.30,209.55,98000\r\n"
+            b"2025-07-16,15:45:00,209.55,209.80,209.50,209.75,110000"
+        )
+        parser = StooqBarParser()
+        for i in range(0, len(body), 7):
+            parser.feed(body[i:i + 7])
+        bars = parser.finish()
+        
+        assert len(bars) == 2
+        assert parser.rows_skipped == 1
+        assert bars.close.tolist() == [209.40, 209.75]
+        assert bars.time[1] - bars.time[0] == 600
+        assert bars.to_dicts()[0]["datetime"] == "2025-07-16 15:35:00"
+    
+    def test_no_data_response(self):
+        """Stooq's plain-text 'No data' body yields empty bars."""
+        from app.services.bar_parser import StooqBarParser
+        
+        parser = StooqBarParser()
+        parser.feed(b"No data")
+        
+        assert len(parser.finish()) == 0
+
+
+class TestMarketDataWriter:
+    """Test cases for the write-behind ingestion buffer."""
+    
+    @pytest.mark.asyncio
+    async def test_batches_and_drains_on_stop(self):
+        """Rows are flushed in bulk batches and nothing is lost on shutdown."""
+        from unittest.mock import MagicMock
+        from app.services.ingestion_buffer import MarketDataWriter
+        
+        session = AsyncMock()
+        session_maker = MagicMock()
+        session_maker.return_value.__aenter__.return_value = session
+        
+        writer = MarketDataWriter(max_batch_size=2, flush_interval_seconds=60)
+        with patch('app.services.ingestion_buffer.async_session_maker', session_maker):
+            await writer.start()
+            for price in (1.0, 2.0, 3.0):
+                await writer.enqueue({"symbol": "AAPL.US", "close_price": price, "source": "stooq"})
+            await writer.stop()
+        
+        assert writer.rows_written == 3
+        assert writer.flushes == 2
+        assert session.execute.await_count == 2
+        assert session.commit.await_count == 2
+
+
+class TestBarAggregator:
+    """Test cases for intraday OHLCV bar aggregation."""
+    
+    def test_window_roll_and_volume_delta(self):
+        """Ticks build OHLC per window; volume is the cumulative delta."""
+        from app.services.bar_aggregator import BarAggregator
+        
+        agg = BarAggregator(intervals=(60, 300))
+        assert agg.add_tick("AAPL.US", 100.0, 1200, cumulative_volume=1000)
+        assert agg.add_tick("AAPL.US", 102.0, 1210, cumulative_volume=1500)
+        assert not agg.add_tick("AAPL.US", 99.0, 1210, cumulative_volume=1600)  # duplicate
+        assert agg.add_tick("AAPL.US", 98.0, 1230, cumulative_volume=1700)
+        assert agg.add_tick("AAPL.US", 101.0, 1265, cumulative_volume=1800)  # next minute
+        
+        completed = agg.drain_completed()
+        assert len(completed) == 1
+        bar = completed[0]
+        assert (bar.interval, bar.start) == (60, 1200)
+        assert (bar.open, bar.high, bar.low, bar.close) == (100.0, 102.0, 98.0, 98.0)
+        assert bar.volume == 700
+        
+        five_min = agg.running_bar("aapl.us", 300)
+        assert five_min["open"] == 100.0 and five_min["close"] == 101.0
+        assert five_min["volume"] == 800
+    
+    def test_close_due_on_wall_clock(self):
+        """Bars close at the window end even without a new tick."""
+        from app.services.bar_aggregator import BarAggregator
+        
+        agg = BarAggregator(intervals=(60, 300))
+        agg.add_tick("msft.us", 400.0, 1205)
+        
+        assert agg.close_due(1259) == 0
+        assert agg.close_due(1260) == 1
+        assert agg.running_bar("msft.us", 60) is None
+        assert agg.running_bar("msft.us", 300) is not None
+        
+        history = agg.history("msft.us", 60)
+        assert history.time.tolist() == [1200]
+        assert history.close.tolist() == [400.0]
+    
+    @pytest.mark.asyncio
+    async def test_closed_bars_append_to_redis_series(self):
+        """Closed bars extend the Redis series by start time instead of replacing it."""
+        from app.core.bar_codec import BarArrays
+        from app.core.redis_client import RedisClient
+        
+        zsets = {}
+        
+        class FakePipeline:
+            def __init__(self):
+                self.results = []
+            
+            async def __aenter__(self):
+                return self
+            
+            async def __aexit__(self, *exc):
+                return False
+            
+            def zremrangebyscore(self, key, low, high):
+                zsets[key] = {m: s for m, s in zsets.get(key, {}).items() if not low <= s <= high}
+            
+            def zadd(self, key, mapping):
+                zsets.setdefault(key, {}).update(mapping)
+            
+            def zremrangebyrank(self, key, start, stop):
+                members = sorted(zsets.get(key, {}).items(), key=lambda item: item[1])
+                zsets[key] = dict(members[stop + 1:] if stop < 0 else members)
+            
+            def expire(self, key, ttl):
+                pass
+            
+            def zrange(self, key, start, stop):
+                members = sorted(zsets.get(key, {}).items(), key=lambda item: item[1])
+                self.results.append([member for member, _ in members])
+            
+            async def execute(self):
+                return self.results
+        
+        def bars(*rows):
+            return BarArrays.from_dicts([
+                {"time": t, "open": c, "high": c, "low": c, "close": c, "volume": 1.0} for t, c in rows
+            ])
+        
+        client = RedisClient()
+        client.raw_redis = AsyncMock()
+        client.raw_redis.pipeline = lambda transaction=False: FakePipeline()
+        
+        # Written by another process (or before a restart)
+        await client.append_market_bars({("AAPL.US", 60): bars((1200, 1.0), (1260, 2.0))})
+        await client.append_market_bars({("aapl.us", 60): bars((1260, 2.5), (1320, 3.0))})
+        
+        series = await client.get_market_bars("aapl.us", 60)
+        assert series.time.tolist() == [1200, 1260, 1320]
+        assert series.close.tolist() == [1.0, 2.5, 3.0]
+        assert (await client.get_market_bars_many([("msft.us", 60)]))[0].time.tolist() == []
+
+
+class TestHistoryStore:
+    """Test cases for the market_data history store."""
+    
+    @pytest.mark.asyncio
+    async def test_range_many_splits_rows_per_symbol(self):
+        """One range query is split into columnar bars per requested symbol."""
+        from datetime import datetime
+        from unittest.mock import MagicMock
+        from app.services.history_store import HistoryStore
+        
+        rows = [
+            ("AAPL.US", datetime(2025, 7, 16, 15, 35), 209.1, 209.6, 209.0, 209.4, 100.0),
+            ("AAPL.US", datetime(2025, 7, 16, 15, 36), 209.4, 209.8, 209.3, 209.7, 80.0),
+            ("MSFT.US", datetime(2025, 7, 16, 15, 35), 341.5, 343.0, 340.0, 342.2, 50.0),
+        ]
+        session = AsyncMock()
+        session.execute.return_value = MagicMock(all=MagicMock(return_value=rows))
+        session_maker = MagicMock()
+        session_maker.return_value.__aenter__.return_value = session
+        
+        store = HistoryStore(session_maker=session_maker)
+        bars = await store.get_range_many(
+            ["aapl.us", "msft.us", "goog.us"], start=datetime(2025, 7, 16)
+        )
+        
+        assert session.execute.await_count == 1
+        assert bars["aapl.us"].close.tolist() == [209.4, 209.7]
+        assert bars["aapl.us"].time[1] - bars["aapl.us"].time[0] == 60
+        assert len(bars["msft.us"]) == 1
+        assert len(bars["goog.us"]) == 0
+
+
+class TestBarArchive:
+    """Test cases for the memory-mapped bar archive."""
+    
+    @pytest.mark.asyncio
+    async def test_segments_compact_and_map(self, tmp_path):
+        """Segments merge into one day file that reads back as memory-mapped views."""
+        from datetime import date, datetime
+        from app.services.bar_archive import BarArchive
+        
+        archive = BarArchive(str(tmp_path))
+        day_start = 1752624000  # 2025-07-16 00:00 UTC
+        archive.add("AAPL.US", 60, day_start + 60, 1.0, 1.0, 1.0, 1.0, 10.0)
+        archive.add("AAPL.US", 60, day_start, 2.0, 2.0, 2.0, 2.0, 10.0)
+        await archive.flush()
+        archive.add("aapl.us", 60, day_start + 60, 3.0, 3.0, 3.0, 3.0, 10.0)  # Rewrite
+        await archive.flush()
+        
+        assert await archive.compact(before=date(2025, 7, 17)) == 1
+        assert len(list((tmp_path / "aapl.us" / "60").iterdir())) == 1
+        
+        bars = archive.read("aapl.us", datetime(2025, 7, 16), datetime(2025, 7, 17))
+        assert bars.time.tolist() == [day_start, day_start + 60]
+        assert bars.close.tolist() == [2.0, 3.0]
+        assert not bars.close.flags.writeable  # View over the read-only mapping
+        assert archive.read_latest("aapl.us", 1).close.tolist() == [3.0]
+
+
+class TestPollScheduler:
+    """Test cases for demand- and session-aware poll scheduling."""
+    
+    def _scheduler(self, **kwargs):
+        from app.services.poll_scheduler import MarketSession, PollScheduler
+        
+        session = MarketSession("America/New_York", "09:30", "16:00")
+        return PollScheduler(["aapl.us"], session, **kwargs)
+    
+    def test_demand_shortens_interval_and_closed_market_slows(self):
+        """Subscribed symbols poll faster; outside the session everything slows."""
+        scheduler = self._scheduler(quota_per_hour=10000)
+        scheduler.add_subscriptions(["MSFT.US", "msft.us"])
+        
+        open_now = 1752672600.0  # Wed 2025-07-16 09:30 New York
+        intervals = scheduler.plan(open_now)
+        assert intervals["msft.us"] < intervals["aapl.us"]
+        
+        closed_now = 1752706800.0  # Wed 2025-07-16 19:00 New York
+        assert set(scheduler.plan(closed_now).values()) == {scheduler.closed_interval}
+        
+        scheduler.remove_subscriptions(["msft.us", "msft.us"])
+        assert scheduler.poll_set(open_now) == ["aapl.us"]
+    
+    def test_schedule_fits_quota(self):
+        """Intervals are stretched so planned polls stay within the quota."""
+        scheduler = self._scheduler(quota_per_hour=60)
+        scheduler.note_lookups([f"sym{i}.us" for i in range(20)], now=1752672600.0)
+        
+        intervals = scheduler.plan(1752672600.0)
+        assert sum(3600 / interval for interval in intervals.values()) <= 60 + 1e-6
+        
+        due = scheduler.due(1752672600.0)
+        assert len(due) == 21
+        scheduler.mark_polled(due, {}, 1752672600.0)
+        assert scheduler.due(1752672601.0) == []
+    
+    def test_lookup_symbols_age_out(self):
+        """Lookup-only symbols leave the poll set after lookup_ttl, with their poll state."""
+        scheduler = self._scheduler(quota_per_hour=10000, lookup_ttl=900)
+        now = 1752672600.0
+        scheduler.note_lookups(["msft.us"], now=now)
+        scheduler.mark_polled(scheduler.due(now), {"msft.us": {"last_price": 340.0}}, now)
+        
+        # A node that never polls still drops expired lookups
+        scheduler.note_lookups(["goog.us"], now=now + 901)
+        assert "msft.us" not in scheduler._lookups
+        
+        assert scheduler.due(now + 901) == ["aapl.us", "goog.us"]
+        assert "msft.us" not in scheduler._last_price
+        assert "msft.us" not in scheduler._next_poll
+
+
+class TestSourceHealth:
+    """Test cases for upstream circuit breaking and hedged requests."""
+    
+    def test_circuit_opens_and_probes(self):
+        """Repeated failures open the circuit; a successful probe closes it."""
+        from app.services.source_health import SourceHealth
+        
+        health = SourceHealth("stooq", min_requests=3, open_seconds=0)
+        for _ in range(3):
+            assert health.allow_request()
+            health.record_failure()
+        
+        assert health.state == "half_open"  # open_seconds=0: cool-down already over
+        assert health.allow_request()
+        assert not health.allow_request()  # Only one probe at a time
+        health.record_success(0.05)
+        assert health.state == "closed"
+    
+    @pytest.mark.asyncio
+    async def test_hedged_request_uses_backup_when_primary_slow(self):
+        """A slow primary is hedged to the backup, and the loser is cancelled."""
+        from app.services.source_health import SourceHealth, hedged_request
+        
+        primary = SourceHealth("stooq", hedge_max_seconds=0.05)
+        backup = SourceHealth("yahoo")
+        cancelled = asyncio.Event()
+        
+        async def slow():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+        
+        async def fast():
+            return {"source": "yahoo", "last_price": 1.0}
+        
+        result = await hedged_request([(primary, slow), (backup, fast)], deadline_seconds=1)
+        await asyncio.sleep(0)
+        
+        assert result["source"] == "yahoo"
+        assert cancelled.is_set()
+    
+    @pytest.mark.asyncio
+    async def test_hedged_backup_respects_quota(self):
+        """Hedged Yahoo calls count against its rate limit and are skipped once it is used up."""
+        from app.services.data_service import MarketDataClient, RateLimiter
+        
+        client = MarketDataClient()
+        client.yahoo_limiter = RateLimiter(1, 86400)
+        calls = []
+        
+        async def request():
+            calls.append(1)
+            return {"quoteResponse": {"result": [{"symbol": "AAPL", "regularMarketPrice": 1.0}]}}
+        
+        first = await client._call_source("yahoo", request, client.yahoo_limiter, "test", wait_for_quota=False)
+        second = await client._call_source("yahoo", request, client.yahoo_limiter, "test", wait_for_quota=False)
+        
+        assert first is not None
+        assert second is None
+        assert len(calls) == 1
+
+
+class TestHttpPool:
+    """Test cases for the upstream connection pool."""
+    
+    @pytest.mark.asyncio
+    async def test_session_tuning_and_reuse_metrics(self):
+        """The shared session uses the tuned connector and traces reuse and pool waits."""
+        from types import SimpleNamespace
+        from app.services.http_pool import HttpPoolMetrics, create_client_session
+        
+        metrics = HttpPoolMetrics()
+        session = create_client_session(metrics)
+        try:
+            assert session.connector.limit_per_host > 0
+            assert session.timeout.connect is not None and session.timeout.sock_read is not None
+            
+            ctx = SimpleNamespace()
+            await metrics._on_create_start(session, ctx, None)
+            await metrics._on_create_end(session, ctx, None)
+            await metrics._on_reuseconn(session, SimpleNamespace(), None)
+            await metrics._on_reuseconn(session, SimpleNamespace(), None)
+            await metrics._on_queued_start(session, ctx, None)
+            await metrics._on_queued_end(session, ctx, None)
+        finally:
+            await session.close()
+        
+        stats = metrics.get_stats()
+        assert stats["connections_created"] == 1
+        assert stats["reuse_ratio"] == pytest.approx(2 / 3)
+        assert stats["queued"] == 1
+
+
+class TestMarketSimulator:
+    """Test cases for the local market-data simulator."""
+    
+    @pytest.mark.asyncio
+    async def test_serves_parseable_upstream_formats(self):
+        """Stooq CSV bars parse with StooqBarParser; quotes evolve with the clock."""
+        from app.simulator_main import app as simulator_app, simulator
+        from app.services.bar_parser import StooqBarParser
+        
+        async with AsyncClient(app=simulator_app, base_url="http://sim") as client:
+            bars_response = await client.get("/stooq/q/d/l/", params={"s": "aapl.us", "i": 5})
+            quote_response = await client.get("/stooq/q/l/", params={"s": "aapl.us"})
+            yahoo_response = await client.get("/yahoo/v7/finance/quote", params={"symbols": "AAPL"})
+        
+        parser = StooqBarParser()
+        parser.feed(bars_response.content)
+        bars = parser.finish()
+        assert len(bars) > 0 and parser.rows_skipped == 0
+        assert (bars.high >= bars.low).all()
+        assert set(bars.time % 300) == {0}
+        
+        row = quote_response.text.strip().split(",")
+        assert row[0] == "AAPL.US" and float(row[2]) > 0
+        assert yahoo_response.json()["quoteResponse"]["result"][0]["regularMarketPrice"] > 0
+        
+        first = simulator.quote("msft.us", now=1_000_000.0)["last_price"]
+        later = simulator.quote("msft.us", now=1_000_600.0)["last_price"]
+        assert first != later
+
+
+class TestTickDeltas:
+    """Test cases for delta-only tick publication."""
+    
+    def test_publishes_changes_and_periodic_snapshots(self):
+        """Unchanged ticks are suppressed, changes go out as deltas, state rebuilds."""
+        from app.services.tick_deltas import TickDeltaTracker, TickState, SNAPSHOT, DELTA
+        
+        tracker = TickDeltaTracker(snapshot_interval=60)
+        state = TickState()
+        tick = {"last_price": 100.0, "high": 101.0, "volume": 10, "timestamp": "t0"}
+        
+        updates = tracker.diff({"AAPL.US": tick}, now=0)
+        assert updates["aapl.us"][0] == SNAPSHOT
+        state.apply("aapl.us", *updates["aapl.us"])
+        
+        assert tracker.diff({"aapl.us": {**tick, "timestamp": "t1"}}, now=10) == {}
+        
+        updates = tracker.diff({"aapl.us": {**tick, "last_price": 100.5, "timestamp": "t2"}}, now=20)
+        assert updates["aapl.us"] == (DELTA, {"last_price": 100.5, "timestamp": "t2"})
+        assert state.apply("aapl.us", *updates["aapl.us"]) == {
+            "last_price": 100.5, "high": 101.0, "volume": 10, "timestamp": "t2"
+        }
+        
+        assert tracker.diff({"aapl.us": tick}, now=61)["aapl.us"][0] == SNAPSHOT
+        assert TickState().apply("msft.us", DELTA, {"last_price": 1.0}) is None
+        assert tracker.get_stats()["unchanged"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_recent_ticks_read_back_to_snapshot(self):
+        """Recent ticks are exactly `count` full quotes even when the snapshot is further back."""
+        import json
+        from app.core.redis_client import RedisClient
+        
+        # Oldest first: a snapshot followed by 149 deltas
+        stream = [("1-0", {"kind": "snapshot", "data": json.dumps({"last_price": 0, "high": 9})})]
+        stream += [(f"{i + 1}-0", {"kind": "delta", "data": json.dumps({"last_price": i})}) for i in range(1, 150)]
+        
+        async def xrevrange(key, max="+", count=None):
+            newest = [entry for entry in reversed(stream)
+                      if max == "+" or int(entry[0].split("-")[0]) < int(max[1:].split("-")[0])]
+            return newest[:count]
+        
+        client = RedisClient()
+        client.redis = AsyncMock()
+        client.redis.xrevrange.side_effect = xrevrange
+        
+        ticks = await client.get_recent_ticks("aapl.us", count=5)
+        assert [tick["last_price"] for tick in ticks] == [149, 148, 147, 146, 145]
+        assert all(tick["high"] == 9 for tick in ticks)
+        assert client.redis.xrevrange.await_count == 2
+
+
+class TestDerivedCache:
+    """Test cases for dependency-tracked derived results."""
+    
+    @pytest.mark.asyncio
+    async def test_evicts_only_dependents_of_moved_symbols(self):
+        """A material move evicts results using that symbol and nothing else."""
+        from app.services.derived_cache import DerivedCache
+        
+        class FakeRedis:
+            def __init__(self):
+                self.values, self.versions, self.deps = {}, {}, {}
+            
+            async def get_cached_response(self, key):
+                return self.values.get(key)
+            
+            async def get_data_versions(self, dependencies):
+                return {dep.lower(): self.versions.get(dep.lower(), 0) for dep in dependencies}
+            
+            async def set_derived(self, key, value, dependencies, ttl):
+                self.values[key] = value
+                for dep in dependencies:
+                    self.deps.setdefault(dep, set()).add(key)
+            
+            async def invalidate_derived(self, dependencies):
+                evicted = set()
+                for dep in dependencies:
+                    self.versions[dep] = self.versions.get(dep, 0) + 1
+                    evicted |= self.deps.pop(dep, set())
+                for key in evicted:
+                    self.values.pop(key, None)
+                return len(evicted)
+        
+        cache = DerivedCache(ttl=3600, move_threshold=0.01)
+        cache.redis_client = FakeRedis()
+        
+        aapl_versions = await cache.versions(["AAPL.US"])
+        await cache.set("forecast:aapl.us:5", {"price": 1}, aapl_versions)
+        await cache.set("forecast:msft.us:5", {"price": 2}, await cache.versions(["msft.us"]))
+        
+        assert cache.material_moves({"aapl.us": 100.0, "msft.us": 50.0}) == []
+        assert cache.material_moves({"aapl.us": 100.5, "msft.us": 50.0}) == []
+        moved = cache.material_moves({"aapl.us": 101.5})
+        assert moved == ["aapl.us"]
+        assert await cache.invalidate(moved) == 1
+        
+        assert await cache.get("forecast:aapl.us:5") is None
+        assert await cache.get("forecast:msft.us:5") == {"price": 2}
+        
+        # A result computed from inputs read before the move is never served
+        await cache.set("forecast:aapl.us:5", {"price": 1}, aapl_versions)
+        assert await cache.get("forecast:aapl.us:5") is None
+        assert cache.get_stats()["stale"] == 1
+
+
+class TestPubSubHub:
+    """Test cases for the shared pub/sub fan-out."""
+    
+    @pytest.mark.asyncio
+    async def test_bar_update_reaches_only_topic_subscribers(self):
+        """One parsed message is serialized once and sent to matching sockets only."""
+        import json
+        from app.websockets import manager
+        from app.websockets.hub import hub
+        import app.websockets.data_ws  # noqa: F401 - registers the bars handler
+        
+        aapl_socket, msft_socket = AsyncMock(), AsyncMock()
+        manager.subscribe(aapl_socket, ["bars:aapl.us:300"])
+        manager.subscribe(msft_socket, ["bars:msft.us:300"])
+        
+        try:
+            await hub.dispatch("bars:aapl.us", {
+                "symbol": "aapl.us", "interval": 300, "start": 1_700_000_100,
+                "open": 1.0, "high": 2.0, "low": 0.5, "close": 1.5, "volume": 10.0, "closed": True
+            })
+            
+            aapl_socket.send_text.assert_awaited_once()
+            msft_socket.send_text.assert_not_awaited()
+            assert json.loads(aapl_socket.send_text.call_args[0][0])["interval"] == 5
+        finally:
+            manager.unsubscribe(aapl_socket)
+            manager.unsubscribe(msft_socket)
+        
+        assert manager.subscribers("bars:aapl.us:300") == set()
+    
+    @pytest.mark.asyncio
+    async def test_order_fill_reaches_only_its_users_sockets(self):
+        """A processed order fill is tagged with its user and routed to that user's fill sockets only."""
+        import json
+        from datetime import datetime
+        from unittest.mock import MagicMock
+        from app.api.v1 import orders
+        from app.core.encoding import dumps, loads
+        from app.websockets import manager
+        from app.websockets.hub import hub
+        import app.websockets.fills_ws  # noqa: F401 - registers the fills handler
+        
+        session = AsyncMock()
+        result = MagicMock()
+        result.scalar_one_or_none.return_value = None
+        session.execute.return_value = result
+        session_maker = MagicMock()
+        session_maker.return_value.__aenter__.return_value = session
+        
+        async def publish_fill(fill):
+            await hub.dispatch("fills", loads(dumps(fill)))
+        
+        redis_client = AsyncMock()
+        redis_client.publish_fill.side_effect = publish_fill
+        own_socket, other_socket = AsyncMock(), AsyncMock()
+        manager.subscribe(own_socket, ["fills:1"])
+        manager.subscribe(other_socket, ["fills:2"])
+        
+        try:
+            with patch.object(orders, "async_session_maker", session_maker):
+                await orders._process_order_fill({
+                    "order_id": "o-1", "symbol": "AAPL.US", "side": "sell", "quantity": 1,
+                    "price": 100.0, "timestamp": datetime(2025, 1, 2), "slippage_bps": 0.0
+                }, 1, None, redis_client)
+        finally:
+            manager.unsubscribe(own_socket)
+            manager.unsubscribe(other_socket)
+        
+        message = json.loads(own_socket.send_text.call_args[0][0])
+        assert message["type"] == "fill" and message["fill_data"]["user_id"] == 1
+        other_socket.send_text.assert_not_awaited()
+
+
+class TestTickStreamConsumer:
+    """Test cases for the ticks stream consumer."""
+    
+    @pytest.mark.asyncio
+    async def test_dispatches_batches_and_replays_missed_entries(self):
+        """XREAD batches reach subscribers with their ids; replay returns what a client missed."""
+        import json
+        from app.services.tick_stream_consumer import TickStreamConsumer
+        from app.websockets import manager
+        from app.websockets.data_ws import _dispatch_tick_entries
+        
+        entries = [
+            ("1700000000000-0", {"symbol": "aapl.us", "kind": "snapshot", "data": json.dumps({"last_price": 1.0})}),
+            ("1700000000001-0", {"symbol": "msft.us", "kind": "snapshot", "data": json.dumps({"last_price": 2.0})}),
+            ("1700000000002-0", {"symbol": "aapl.us", "kind": "delta", "data": json.dumps({"last_price": 1.5})}),
+        ]
+        
+        consumer = TickStreamConsumer(stream="ticks")
+        consumer.add_handler(_dispatch_tick_entries)
+        socket = AsyncMock()
+        manager.subscribe_symbols(socket, "market_data", ["aapl.us"])
+        try:
+            await consumer._dispatch(entries)
+        finally:
+            manager.unsubscribe_symbols(socket, "market_data")
+        
+        sent = [json.loads(call[0][0]) for call in socket.send_text.call_args_list]
+        assert [message["id"] for message in sent] == ["1700000000000-0", "1700000000002-0"]
+        assert consumer.last_id == "1700000000002-0"
+        
+        consumer._redis_client = AsyncMock()
+        consumer._redis_client.redis.xrange.return_value = entries
+        missed = await consumer.replay({"AAPL.US": "1700000000000-0"})
+        assert [entry_id for entry_id, _ in missed] == ["1700000000002-0"]
+        assert consumer._redis_client.redis.xrange.call_args.kwargs["max"] == "1700000000002-0"
+
+
+class TestSubscriptionIndex:
+    """Test cases for the symbol-indexed subscription registry."""
+    
+    def test_duplicate_free_subscribe_and_unsubscribe(self):
+        """Repeated symbols are ignored and only real changes are reported."""
+        from app.websockets import ConnectionManager
+        
+        manager = ConnectionManager()
+        first, second = object(), object()
+        
+        assert manager.subscribe_symbols(first, "market_data", ["AAPL.US", "aapl.us", " msft.us"]) == ["aapl.us", "msft.us"]
+        assert manager.subscribe_symbols(first, "market_data", ["aapl.us"]) == []
+        assert manager.subscribe_symbols(second, "market_data", ["aapl.us"]) == ["aapl.us"]
+        
+        assert manager.symbol_subscribers("market_data", "aapl.us") == {first, second}
+        assert manager.symbol_subscribers("quotes", "aapl.us") == set()
+        
+        assert manager.unsubscribe_symbols(first, "market_data", ["aapl.us", "goog.us"]) == ["aapl.us"]
+        assert manager.symbols_of(first, "market_data") == ["msft.us"]
+        
+        manager.disconnect(first, "market_data")
+        manager.disconnect(second, "market_data")
+        assert manager.symbols["market_data"].get_stats() == {"keys": 0, "connections": 0, "subscriptions": 0}
+
+
+class TestOutboundQueue:
+    """Test cases for per-connection send buffers."""
+    
+    @pytest.mark.asyncio
+    async def test_slow_consumer_policies(self):
+        """Full buffers drop the oldest, coalesce by key, or evict the client."""
+        from app.websockets.outbound import OutboundQueue
+        
+        socket = AsyncMock()
+        
+        dropping = OutboundQueue(socket, max_size=2, policy="drop_oldest")
+        for message in ("a", "b", "c"):
+            assert dropping.put(message)
+        assert dropping.depth == 2 and dropping.dropped == 1
+        
+        coalescing = OutboundQueue(socket, max_size=2, policy="coalesce")
+        coalescing.put("aapl 1", key="aapl.us")
+        coalescing.put("msft 1", key="msft.us")
+        coalescing.put("aapl 2", key="aapl.us")
+        assert coalescing.depth == 2 and coalescing.coalesced == 1
+        
+        coalescing.start()
+        for _ in range(5):
+            await asyncio.sleep(0)
+        assert [call[0][0] for call in socket.send_text.call_args_list] == ["aapl 2", "msft 1"]
+        coalescing.stop()
+        
+        evicting = OutboundQueue(socket, max_size=1, policy="disconnect")
+        evicting.put("a")
+        assert not evicting.put("b")
+        await asyncio.sleep(0)
+        assert evicting.evicted
+        socket.close.assert_awaited_once()
+        await asyncio.sleep(0)
+        assert not evicting._closing
+        dropping.stop()
+        evicting.stop()
+    
+    @pytest.mark.asyncio
+    async def test_manager_stats_are_aggregate(self):
+        """Stats report totals and the deepest queues by opaque id, never client addresses."""
+        from unittest.mock import MagicMock
+        
+        from app.websockets import ConnectionManager
+        from app.websockets.outbound import OutboundQueue
+        
+        manager = ConnectionManager()
+        socket = AsyncMock()
+        socket.client = MagicMock(host="203.0.113.7", port=50123)
+        await manager.connect(socket, "market_data")
+        
+        for depth, label in ((3, "quotes#8"), (1, "quotes#9")):
+            queue = OutboundQueue(AsyncMock(), max_size=2, label=label)
+            for message in range(depth):
+                queue.put(str(message))
+            manager.queues[object()] = queue
+        
+        stats = manager.get_stats(top_n=2)
+        assert "203.0.113.7" not in str(stats)
+        assert (stats["queued"], stats["max_queue_depth"], stats["dropped"]) == (3, 2, 1)
+        assert stats["deepest_queues"] == [
+            {"connection": "quotes#8", "depth": 2, "dropped": 1},
+            {"connection": "quotes#9", "depth": 1, "dropped": 0}
+        ]
+        manager.disconnect(socket, "market_data")
+
+
+class TestConflation:
+    """Test cases for latest-value conflation of symbol updates."""
+    
+    @pytest.mark.asyncio
+    async def test_merges_updates_per_symbol(self):
+        """Deltas merge into the pending value and each dirty symbol flushes once."""
+        from app.websockets.conflation import Conflator
+        
+        flushed = []
+        
+        async def flush(pending):
+            flushed.append(pending)
+        
+        conflator = Conflator(flush, max_rate=4)
+        conflator.update("aapl.us", "snapshot", {"last_price": 150.0, "volume": 100}, id="1-0")
+        conflator.update("aapl.us", "delta", {"last_price": 150.5}, id="2-0")
+        conflator.update("aapl.us", "delta", {"volume": 120}, id="3-0")
+        conflator.update("msft.us", "delta", {"last_price": 300.0}, id="4-0")
+        assert conflator.dirty == 2
+        
+        conflator.start()
+        await asyncio.sleep(0)
+        conflator.stop()
+        
+        assert len(flushed) == 1
+        aapl = flushed[0]["aapl.us"]
+        assert aapl["kind"] == "snapshot" and aapl["id"] == "3-0" and aapl["conflated"] == 3
+        assert aapl["data"] == {"last_price": 150.5, "volume": 120}
+        assert flushed[0]["msft.us"]["kind"] == "delta"
+        assert conflator.get_stats()["conflation_ratio"] == 0.5
+
+
+class TestEncoding:
+    """Test cases for websocket frame encoding."""
+    
+    @pytest.mark.asyncio
+    async def test_frames_encode_once_per_encoding(self):
+        """JSON clients share one string; struct clients get packed quote frames."""
+        import json
+        from app.core import encoding
+        from app.websockets import ConnectionManager
+        
+        manager = ConnectionManager()
+        json_client, struct_client = AsyncMock(), AsyncMock()
+        manager.encodings[struct_client] = encoding.STRUCT
+        
+        frame = encoding.Frame({
+            "type": "quote", "symbol": "aapl.us", "last": 150.0, "bid": 149.85,
+            "ask": 150.15, "high": 151.0, "low": None, "volume": 1000,
+            "timestamp": "2024-01-02T15:30:00"
+        })
+        await manager.send_to([json_client, struct_client], frame)
+        
+        assert json.loads(json_client.send_text.call_args[0][0])["last"] == 150.0
+        packed = struct_client.send_bytes.call_args[0][0]
+        assert len(packed) == encoding.QUOTE_FRAME.size == 72
+        quote = encoding.unpack_quote(packed)
+        assert quote["symbol"] == "aapl.us" and quote["last"] == 150.0 and quote["low"] is None
+        assert quote["timestamp"] == 1704209400.0
+        assert frame.encode(encoding.JSON) is frame.encode(encoding.JSON)
+        
+        with pytest.raises(ValueError):
+            encoding.negotiate("xml")
+        assert encoding.negotiate(None) == encoding.JSON
+        assert encoding.negotiate("msgpack") == (encoding.MSGPACK if encoding.msgpack else encoding.JSON)
+    
+    @pytest.mark.asyncio
+    async def test_events_are_encoded_once_for_all_recipients(self):
+        """Event sockets share one encoded payload per encoding, like market data."""
+        import json
+        from app.websockets import manager
+        from app.websockets.events_ws import _dispatch_event
+        
+        first, second = AsyncMock(), AsyncMock()
+        manager.subscribe(first, ["events:risk"])
+        manager.subscribe(second, ["events:risk", "risk_events"])
+        try:
+            await _dispatch_event({"type": "risk_alert", "data": {"var": 0.1}, "timestamp": "t"})
+        finally:
+            manager.unsubscribe(first)
+            manager.unsubscribe(second)
+        
+        assert first.send_text.call_args_list[0][0][0] is second.send_text.call_args_list[0][0][0]
+        assert [json.loads(call[0][0])["type"] for call in second.send_text.call_args_list] == ["event", "risk_event"]
+
+
+class TestSnapshotDeltaProtocol:
+    """Test cases for sequenced snapshots and deltas."""
+    
+    def test_tick_state_numbers_updates(self):
+        """Every applied update advances the symbol's sequence number."""
+        from app.services.tick_deltas import TickState
+        
+        state = TickState()
+        assert state.apply("AAPL.US", "delta", {"last_price": 1.0}) is None
+        assert state.seq("aapl.us") == 0
+        state.apply("AAPL.US", "snapshot", {"last_price": 1.0, "volume": 5})
+        state.apply("aapl.us", "delta", {"last_price": 1.5})
+        assert state.seq("aapl.us") == 2
+        assert state.get("aapl.us") == {"last_price": 1.5, "volume": 5}
+    
+    @pytest.mark.asyncio
+    async def test_portfolio_snapshot_then_sequenced_fills(self):
+        """Fills racing the load trigger a reload; later fills become sequenced deltas."""
+        from app.services.portfolio_state import PortfolioStateStore
+        
+        rows = {"AAPL.US": {"quantity": 10, "avg_price": 100.0}}
+        store = PortfolioStateStore(loader=None, price_of=lambda symbol: 110.0)
+        
+        async def loader(user_id):
+            if store.loads == 1:
+                # A fill published while the first load is in flight
+                assert store.apply_fill({"user_id": 1, "symbol": "AAPL.US", "side": "buy", "quantity": 1, "price": 1}) is None
+            return {symbol: dict(position) for symbol, position in rows.items()}
+        
+        store.loader = loader
+        snapshot = await store.snapshot(1)
+        assert store.reloads == 1
+        assert snapshot["seq"] == 0
+        assert snapshot["summary"]["total_market_value"] == 1100.0
+        assert snapshot["summary"]["total_unrealized_pnl"] == 100.0
+        
+        delta = store.apply_fill({"user_id": 1, "symbol": "AAPL.US", "side": "buy", "quantity": 10, "price": 120.0})
+        assert delta["seq"] == 1 and delta["position"]["quantity"] == 20
+        assert delta["position"]["avg_price"] == 110.0
+        
+        delta = store.apply_fill({"user_id": "1", "symbol": "AAPL.US", "side": "sell", "quantity": 20, "price": 130.0})
+        assert delta["seq"] == 2 and delta["position"] == {"symbol": "AAPL.US", "quantity": 0}
+        assert (await store.snapshot(1))["summary"]["position_count"] == 0
+        
+        store.forget(1)
+        assert store.apply_fill({"user_id": 1, "symbol": "MSFT.US", "side": "buy", "quantity": 1, "price": 1}) is None
+    
+    @pytest.mark.asyncio
+    async def test_order_fill_reaches_portfolio_socket_as_delta(self):
+        """A processed order fill is published, applied to the held positions and sent as the next seq."""
+        import json
+        from datetime import datetime
+        from unittest.mock import MagicMock
+        from app.api.v1 import orders
+        from app.core.encoding import dumps, loads
+        from app.services.portfolio_state import portfolio_state
+        from app.websockets import manager
+        from app.websockets.hub import hub
+        import app.websockets.fills_ws  # noqa: F401 - registers the fills handler
+        
+        session = AsyncMock()
+        session.add = MagicMock()
+        result = MagicMock()
+        result.scalar_one_or_none.return_value = None
+        session.execute.return_value = result
+        session_maker = MagicMock()
+        session_maker.return_value.__aenter__.return_value = session
+        
+        async def publish_fill(fill):
+            await hub.dispatch("fills", loads(dumps(fill)))
+        
+        redis_client = AsyncMock()
+        redis_client.publish_fill.side_effect = publish_fill
+        socket = AsyncMock()
+        
+        with patch.object(portfolio_state, "loader", AsyncMock(return_value={})), \
+                patch.object(portfolio_state, "price_of", lambda symbol: 110.0), \
+                patch.object(orders, "async_session_maker", session_maker):
+            assert (await portfolio_state.snapshot(7))["seq"] == 0
+            manager.subscribe(socket, ["portfolio:7"])
+            try:
+                await orders._process_order_fill({
+                    "order_id": "o-1", "symbol": "AAPL.US", "side": "buy", "quantity": 5,
+                    "price": 100.0, "timestamp": datetime(2025, 1, 2), "slippage_bps": 0.0
+                }, 7, None, redis_client)
+            finally:
+                manager.unsubscribe(socket)
+                portfolio_state.forget(7)
+        
+        session.add.assert_called_once()
+        session.commit.assert_awaited_once()
+        update = json.loads(socket.send_text.call_args[0][0])
+        assert update["type"] == "portfolio_update" and update["seq"] == 1
+        assert update["triggered_by_fill"] == "o-1"
+        assert update["data"]["position"]["quantity"] == 5
+        assert update["data"]["summary"]["total_unrealized_pnl"] == 50.0
+
+
+class TestFillEventHistory:
+    """Test cases for fill and event history streams."""
+    
+    @pytest.mark.asyncio
+    async def test_last_n_and_time_range_queries(self):
+        """Fills are one bounded XREVRANGE; events merge newest first across matching types."""
+        import json
+        from app.core.redis_client import RedisClient
+        
+        streams = {
+            "fills:1": [("1700000002000-0", {"data": json.dumps({"order_id": "b"})}),
+                        ("1700000001000-0", {"data": json.dumps({"order_id": "a"})})],
+            "events:risk_alert": [("1700000003000-0", {"data": json.dumps({"type": "risk_alert"})})],
+            "events:optimization_completed": [
+                ("1700000004000-0", {"data": json.dumps({"type": "optimization_completed"})}),
+                ("1700000001000-0", {"data": json.dumps({"type": "optimization_completed"})})
+            ]
+        }
+        
+        event_types = {"risk_alert", "optimization_completed", "model_training_completed"}
+        pipelines = []
+        
+        class FakePipeline:
+            def __init__(self):
+                self.calls = []
+                pipelines.append(self)
+            
+            async def __aenter__(self):
+                return self
+            
+            async def __aexit__(self, *exc):
+                return False
+            
+            def smembers(self, key):
+                self.calls.append(key)
+            
+            def xrevrange(self, key, **kwargs):
+                self.calls.append(key)
+            
+            async def execute(self):
+                return [event_types if key == "event_types" else streams.get(key, []) for key in self.calls]
+        
+        client = RedisClient()
+        client.redis = AsyncMock()
+        client.redis.xrevrange.return_value = streams["fills:1"]
+        client.redis.pipeline = lambda transaction=False: FakePipeline()
+        
+        fills = await client.get_recent_fills(1, count=2, since=1_700_000_000.5)
+        assert [fill["order_id"] for fill in fills] == ["b", "a"]
+        assert fills[0]["id"] == "1700000002000-0"
+        assert client.redis.xrevrange.call_args.kwargs == {"max": "+", "min": "1700000000500", "count": 2}
+        
+        events = await client.get_recent_events(["risk", "optimization"], count=2)
+        assert [event["id"] for event in events] == ["1700000004000-0", "1700000003000-0"]
+        
+        # Once the types are known, the type set and the streams are one round trip
+        pipelines.clear()
+        events = await client.get_recent_events(["risk", "optimization"], count=2)
+        assert [event["id"] for event in events] == ["1700000004000-0", "1700000003000-0"]
+        assert len(pipelines) == 1
+    
+    @pytest.mark.asyncio
+    async def test_order_fill_is_recorded_in_user_history(self):
+        """A processed order fill is appended to its user's capped stream and read back newest first."""
+        from datetime import datetime
+        from unittest.mock import MagicMock
+        from app.api.v1 import orders
+        from app.core.redis_client import RedisClient
+        
+        streams, published = {}, []
+        
+        class FakePipeline:
+            async def __aenter__(self):
+                return self
+            
+            async def __aexit__(self, *exc):
+                return False
+            
+            def xadd(self, key, fields, **kwargs):
+                entries = streams.setdefault(key, [])
+                entries.append((f"17000000000{len(entries)}0-0", fields))
+            
+            def publish(self, channel, message):
+                published.append(channel)
+            
+            async def execute(self):
+                return []
+        
+        async def xrevrange(key, **kwargs):
+            return list(reversed(streams.get(key, [])))[:kwargs["count"]]
+        
+        client = RedisClient()
+        client.redis = AsyncMock()
+        client.redis.pipeline = lambda transaction=False: FakePipeline()
+        client.redis.xrevrange.side_effect = xrevrange
+        session = AsyncMock()
+        result = MagicMock()
+        result.scalar_one_or_none.return_value = None
+        session.execute.return_value = result
+        session_maker = MagicMock()
+        session_maker.return_value.__aenter__.return_value = session
+        
+        with patch.object(orders, "async_session_maker", session_maker):
+            for order_id in ("o-1", "o-2"):
+                await orders._process_order_fill({
+                    "order_id": order_id, "symbol": "AAPL.US", "side": "sell", "quantity": 1,
+                    "price": 100.0, "timestamp": datetime(2025, 1, 2), "slippage_bps": 0.0
+                }, 7, None, client)
+        
+        assert published == ["fills", "fills"]
+        fills = await client.get_recent_fills(7, count=10)
+        assert [fill["order_id"] for fill in fills] == ["o-2", "o-1"]
+        assert fills[0]["user_id"] == 7 and fills[0]["id"] == "1700000000010-0"
+
+
+class TestWebSocketSession:
+    """Test cases for websocket session lifecycle and the timer wheel."""
+    
+    @pytest.mark.asyncio
+    async def test_timer_wheel_fires_due_timers_only(self):
+        """Timers fire every interval, across revolutions, until cancelled."""
+        from app.websockets.session import TimerWheel
+        
+        wheel = TimerWheel(tick=1.0, slots=4)
+        fired = []
+        wheel.every(1, lambda: fired.append("fast"))
+        slow = wheel.every(6, lambda: fired.append("slow"))
+        
+        async def advance(ticks):
+            for _ in range(ticks):
+                wheel.cursor = (wheel.cursor + 1) % len(wheel.slots)
+                wheel._advance()
+        
+        await advance(6)
+        assert fired.count("fast") == 6 and fired.count("slow") == 1
+        slow.cancel()
+        await advance(6)
+        assert fired.count("fast") == 12 and fired.count("slow") == 1
+        await wheel.stop()
+    
+    @pytest.mark.asyncio
+    async def test_slow_timer_does_not_stall_the_wheel(self):
+        """Coroutine callbacks run on their own tasks; one still in flight skips its turn."""
+        from app.websockets.session import TimerWheel
+        
+        wheel = TimerWheel(tick=1.0, slots=4)
+        released = asyncio.Event()
+        fired = []
+        
+        async def slow():
+            fired.append("slow")
+            await released.wait()
+        
+        wheel.every(1, slow)
+        wheel.every(1, lambda: fired.append("fast"))
+        for _ in range(3):
+            wheel.cursor = (wheel.cursor + 1) % len(wheel.slots)
+            wheel._advance()
+            await asyncio.sleep(0)
+        
+        assert fired.count("fast") == 3 and fired.count("slow") == 1
+        assert wheel.skipped == 2 and wheel.get_stats()["in_flight"] == 1
+        released.set()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert wheel.get_stats()["in_flight"] == 0
+        await wheel.stop()
+    
+    @pytest.mark.asyncio
+    async def test_disconnect_tears_down_session(self):
+        """The reader ending cancels the other members and close() releases everything once."""
+        import json
+        from app.websockets import manager
+        from app.websockets.session import WebSocketSession, sessions, timer_wheel
+        
+        socket = AsyncMock()
+        socket.client = None
+        socket.receive.side_effect = [
+            {"type": "websocket.receive", "text": json.dumps({"type": "pong"})},
+            {"type": "websocket.receive", "bytes": json.dumps({"type": "resync"}).encode()},
+            {"type": "websocket.disconnect", "code": 1000}
+        ]
+        handled = []
+        
+        async def on_message(message):
+            handled.append(message["type"])
+        
+        session = WebSocketSession(socket, "test")
+        await session.open()
+        manager.subscribe(socket, ["events:test"])
+        assert sessions.open["test"] == 1
+        
+        await asyncio.wait_for(session.serve(on_message), timeout=1)
+        assert handled == ["resync"] and session.answers_heartbeats
+        assert sessions.tasks == 0
+        
+        session.close()
+        session.close()
+        assert "test" not in sessions.open
+        assert socket not in manager.queues and not manager.subscribers("events:test")
+        await timer_wheel.stop()
+    
+    @pytest.mark.asyncio
+    async def test_failing_handler_keeps_session_open(self):
+        """A handler error is answered with an error frame and the reader carries on."""
+        import json
+        from app.websockets.session import WebSocketSession, timer_wheel
+        
+        socket = AsyncMock()
+        socket.client = None
+        socket.receive.side_effect = [
+            {"type": "websocket.receive", "text": json.dumps({"type": "subscribe"})},
+            {"type": "websocket.receive", "text": json.dumps({"type": "resync"})},
+            {"type": "websocket.disconnect", "code": 1000}
+        ]
+        handled = []
+        
+        async def on_message(message):
+            if message["type"] == "subscribe":
+                raise KeyError("symbols")
+            handled.append(message["type"])
+        
+        session = WebSocketSession(socket, "test")
+        sent = []
+        session.send = AsyncMock(side_effect=sent.append)
+        await session.open()
+        
+        await asyncio.wait_for(session.serve(on_message), timeout=1)
+        assert handled == ["resync"]
+        assert [frame["type"] for frame in sent] == ["error"]
+        
+        session.close()
+        await timer_wheel.stop()
+
+
+class TestClusterScaleOut:
+    """Test cases for per-node subscription interest and cluster-wide counts."""
+    
+    @pytest.mark.asyncio
+    async def test_reads_only_streams_with_local_interest(self):
+        """XREAD covers the subscribed symbols' streams, merged in ID order; released ones are dropped."""
+        import json
+        from app.services.tick_stream_consumer import TickStreamConsumer
+        
+        consumer = TickStreamConsumer(per_symbol=True)
+        assert consumer.add_interest(["AAPL.US", "msft.us"]) == ["aapl.us", "msft.us"]
+        assert consumer.add_interest(["aapl.us"]) == []
+        consumer.last_ids = {"ticks:aapl.us": "1-0", "ticks:msft.us": "1-0"}
+        
+        batches = []
+        
+        async def handler(entries):
+            batches.append([entry_id for entry_id, _ in entries])
+        
+        consumer.add_handler(handler)
+        redis = AsyncMock()
+        redis.xread.return_value = [
+            ("ticks:aapl.us", [("3-0", {"symbol": "aapl.us", "data": json.dumps({})})]),
+            ("ticks:msft.us", [("2-0", {"symbol": "msft.us", "data": json.dumps({})})])
+        ]
+        await consumer._read_interest(redis)
+        
+        assert set(redis.xread.call_args[0][0]) == {"ticks:aapl.us", "ticks:msft.us"}
+        assert batches == [["2-0", "3-0"]]
+        assert consumer.last_ids == {"ticks:aapl.us": "3-0", "ticks:msft.us": "2-0"}
+        
+        assert consumer.remove_interest(["aapl.us", "msft.us"]) == ["msft.us"]
+        assert consumer.remove_interest(["aapl.us"]) == ["aapl.us"]
+        assert consumer.interest == {} and consumer.last_ids == {}
+    
+    @pytest.mark.asyncio
+    async def test_per_symbol_replay_uses_each_symbols_last_id(self):
+        """Each per-symbol stream is replayed after that symbol's own last-seen id."""
+        from app.services.tick_stream_consumer import TickStreamConsumer
+        from app.websockets.data_ws import _parse_last_ids
+        
+        streams = {
+            "ticks:aapl.us": [("5-0", {"symbol": "aapl.us"}), ("9-0", {"symbol": "aapl.us"})],
+            "ticks:msft.us": [("2-0", {"symbol": "msft.us"}), ("3-0", {"symbol": "msft.us"})]
+        }
+        
+        class FakePipeline:
+            def __init__(self):
+                self.calls = []
+            
+            async def __aenter__(self):
+                return self
+            
+            async def __aexit__(self, *exc):
+                return False
+            
+            def xrange(self, key, min, max, count):
+                self.calls.append((key, min))
+            
+            async def execute(self):
+                return [
+                    [entry for entry in streams[key] if int(entry[0].split("-")[0]) >= int(low.split("-")[0])]
+                    for key, low in self.calls
+                ]
+        
+        consumer = TickStreamConsumer(per_symbol=True)
+        consumer._redis_client = AsyncMock()
+        consumer._redis_client.redis.pipeline = lambda transaction=False: FakePipeline()
+        
+        after_ids = _parse_last_ids("AAPL.US:5-0,msft.us:2-0,bad")
+        assert after_ids == {"aapl.us": "5-0", "msft.us": "2-0"}
+        missed = await consumer.replay(after_ids)
+        assert [entry_id for entry_id, _ in missed] == ["3-0", "9-0"]
+    
+    @pytest.mark.asyncio
+    async def test_cluster_stats_sum_live_nodes(self):
+        """Each node's heartbeat hash and interest set are summed across the live nodes."""
+        from app.websockets.cluster import ClusterRegistry
+        
+        states = {
+            "ws_node:a": {"connections": "3", "subscriptions": "7", "symbols": "2", "updated": "0"},
+            "ws_node:b": {"connections": "2", "subscriptions": "2", "symbols": "1", "updated": "0"},
+            "ws_interest:a": {"aapl.us", "msft.us"},
+            "ws_interest:b": {"aapl.us"}
+        }
+        
+        class FakePipeline:
+            def __init__(self):
+                self.calls = []
+            
+            async def __aenter__(self):
+                return self
+            
+            async def __aexit__(self, *exc):
+                return False
+            
+            def hgetall(self, key):
+                self.calls.append(key)
+            
+            smembers = hgetall
+            
+            async def execute(self):
+                return [states.get(key, {}) for key in self.calls]
+        
+        client = AsyncMock()
+        client.redis.zrangebyscore.return_value = ["a", "b", "gone"]
+        client.redis.pipeline = lambda transaction=False: FakePipeline()
+        registry = ClusterRegistry(node_id="a")
+        registry._redis_client = client
+        
+        stats = await registry.get_cluster_stats()
+        assert (stats["nodes"], stats["connections"], stats["subscriptions"]) == (2, 5, 9)
+        assert stats["symbols"] == 2 and stats["nodes_per_symbol"] == 1.5
+    
+    @pytest.mark.asyncio
+    async def test_one_poller_covers_cluster_demand(self):
+        """Only the lease holder polls; demand on other nodes reaches its schedule."""
+        from app.services.poll_scheduler import MarketSession, PollScheduler
+        from app.services.poller_lease import PollerLease
+        
+        class FakeRedis:
+            def __init__(self):
+                self.values = {}
+            
+            async def set(self, key, value, nx=False, px=None):
+                if nx and key in self.values:
+                    return None
+                self.values[key] = value
+                return True
+            
+            async def eval(self, script, numkeys, key, node_id, *args):
+                if self.values.get(key) != node_id:
+                    return 0
+                if "del" in script:
+                    del self.values[key]
+                return 1
+        
+        redis = FakeRedis()
+        a, b = PollerLease("a"), PollerLease("b")
+        assert await a.renew(redis) and await a.renew(redis)
+        assert not await b.renew(redis)
+        
+        await a.release(redis)
+        assert await b.renew(redis)
+        assert not await a.renew(redis)
+        assert (a.get_stats()["acquired"], b.get_stats()["held"]) == (1, True)
+        
+        session = MarketSession("America/New_York", "09:30", "16:00")
+        poller = PollScheduler([], session, quota_per_hour=10000)
+        consumer = PollScheduler([], session, quota_per_hour=10000)
+        now = 1752672600.0
+        consumer.add_subscriptions(["MSFT.US"])
+        consumer.note_lookups(["goog.us"], now=now)
+        
+        poller.set_cluster_demand(*consumer.local_demand(now))
+        assert poller.poll_set(now) == ["goog.us", "msft.us"]
+        assert poller.plan(now)["msft.us"] < poller.plan(now)["goog.us"]
 
 
 class TestRiskCalculations: